@@ -1,14 +1,19 @@
 """
 AI 问法 API 路由
 """
-from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi import APIRouter, HTTPException, Depends, Request, BackgroundTasks
 from pydantic import BaseModel
 from typing import Optional, List
 
 from app.services.ai_service import chat_with_ai
+from app.services.llm_dispatcher import get_llm_dispatcher, LLMQueueFullError
+from app.services.llm_pool import get_llm_pool_stats
 from app.services.qa_memory_service import QAMemoryService
+from app.services.chat_session_service import ChatSessionService
+from app.services.usage_aggregator import get_usage_aggregator
 from app.db import get_database
 from .ip_filter import verify_ai_access
+from .auth import verify_admin
 
 router = APIRouter(prefix="/ai", tags=["AI 问法"])
 
@@ -22,7 +27,8 @@ class ChatMessage(BaseModel):
 class ChatRequest(BaseModel):
     """聊天请求模型"""
     message: str
-    history: Optional[List[ChatMessage]] = None
+    session_id: Optional[str] = None  # 服务端会话 ID，传入后只需发送新消息
+    history: Optional[List[ChatMessage]] = None  # 兼容旧客户端：未传 session_id 时使用
     use_rag: bool = True
     rag_top_k: Optional[int] = None
 
@@ -34,6 +40,7 @@ class ChatResponse(BaseModel):
     provider: Optional[str] = None
     sources: Optional[List[dict]] = None
     from_memory: bool = False
+    session_id: Optional[str] = None
 
 
 class FeedbackRequest(BaseModel):
@@ -44,44 +51,41 @@ class FeedbackRequest(BaseModel):
     sources: Optional[List[dict]] = None
 
 
-async def record_token_usage(db, usage: dict):
-    """记录 Token 使用量到数据库"""
-    if not usage or usage.get("total_tokens", 0) == 0:
-        return
-    
-    await db.settings.update_one(
-        {"key": "ai_token_usage"},
-        {
-            "$inc": {
-                "prompt_tokens": usage.get("prompt_tokens", 0),
-                "completion_tokens": usage.get("completion_tokens", 0),
-                "total_tokens": usage.get("total_tokens", 0),
-                "call_count": 1,
-            }
-        },
-        upsert=True,
-    )
+def record_token_usage(provider: Optional[str], usage: dict):
+    """记录 Token 使用量（按天、按 provider 累加，由写回聚合器批量写库）"""
+    get_usage_aggregator().record_token_usage(provider, usage)
 
 
 @router.post("/chat", response_model=ChatResponse)
-async def chat(request: Request, chat_request: ChatRequest, _ip_check: bool = Depends(verify_ai_access)):
+async def chat(
+    request: Request,
+    chat_request: ChatRequest,
+    background_tasks: BackgroundTasks,
+    _ip_check: bool = Depends(verify_ai_access),
+):
     """
     与 AI 法律助手对话
     
     - **message**: 用户问题
-    - **history**: 对话历史（可选）
+    - **session_id**: 会话 ID（可选）。传入时历史由服务端维护；未传入时创建新会话并在响应中返回
+    - **history**: 对话历史（可选，仅兼容未使用会话的旧客户端）
     """
     if not chat_request.message.strip():
         raise HTTPException(status_code=400, detail="消息不能为空")
     
     try:
-        # 转换历史记录格式
-        history = None
-        if chat_request.history:
-            history = [{"role": msg.role, "content": msg.content} for msg in chat_request.history]
-        
         # 获取数据库连接
         db = get_database()
+        session_service = ChatSessionService(db)
+        
+        if chat_request.session_id:
+            session_id = chat_request.session_id
+            history = await session_service.build_history(session_id)
+        else:
+            session_id = session_service.new_session_id()
+            history = None
+            if chat_request.history:
+                history = [{"role": msg.role, "content": msg.content} for msg in chat_request.history]
         
         # 调用 AI 服务（传递数据库以读取配置）
         result = await chat_with_ai(
@@ -93,7 +97,15 @@ async def chat(request: Request, chat_request: ChatRequest, _ip_check: bool = De
         )
         
         # 记录 Token 使用量
-        await record_token_usage(db, result.get("usage", {}))
+        record_token_usage(result.get("provider"), result.get("usage", {}))
+        
+        # 保存本轮问答；未压缩的消息过多时在后台压缩为摘要
+        try:
+            appended = await session_service.append_turns(session_id, chat_request.message, result["reply"])
+            if session_service.needs_compaction(appended["pending_turns"]):
+                background_tasks.add_task(session_service.compact, session_id)
+        except Exception as e:
+            print(f"[AI API] ⚠️ 保存会话 {session_id} 失败: {e}")
         
         return ChatResponse(
             reply=result["reply"],
@@ -101,12 +113,45 @@ async def chat(request: Request, chat_request: ChatRequest, _ip_check: bool = De
             provider=result.get("provider"),
             sources=result.get("sources"),
             from_memory=result.get("from_memory", False),
+            session_id=session_id,
         )
     
+    except LLMQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/sessions/{session_id}")
+async def get_chat_session(request: Request, session_id: str, _ip_check: bool = Depends(verify_ai_access)):
+    """获取会话内容（最近的消息及摘要）"""
+    db = get_database()
+    session = await ChatSessionService(db).get_session(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="会话不存在或已过期")
+    return {"success": True, "data": session}
+
+
+@router.delete("/sessions/{session_id}")
+async def delete_chat_session(request: Request, session_id: str, _ip_check: bool = Depends(verify_ai_access)):
+    """删除会话（清空对话）"""
+    db = get_database()
+    deleted = await ChatSessionService(db).delete_session(session_id)
+    return {"success": True, "deleted": deleted}
+
+
+@router.get("/llm/stats")
+async def get_llm_stats(request: Request, _admin: bool = Depends(verify_admin)):
+    """获取 LLM 调度器并发/排队指标及端点池健康状态"""
+    return {
+        "success": True,
+        "data": {
+            "dispatcher": get_llm_dispatcher().get_stats(),
+            "pools": get_llm_pool_stats(),
+        },
+    }
+
+
 @router.post("/feedback")
 async def submit_feedback(request: Request, feedback: FeedbackRequest):
     """
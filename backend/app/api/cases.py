@@ -1,11 +1,13 @@
 """
 案件 + 笔录 API 路由
 """
-from fastapi import APIRouter, HTTPException, Query, Depends, Request, BackgroundTasks, UploadFile, File, Form
+from fastapi import APIRouter, HTTPException, Query, Depends, Request, UploadFile, File, Form
 from typing import Optional, List
 from app.models import APIResponse, PaginationInfo, CaseCreate, CaseUpdate, TranscriptCreate
 from app.services.case_service import CaseService
-from app.services.transcript_service import TranscriptService
+from app.services.transcript_service import TranscriptService, TranscriptTooLargeError
+from app.services.document_parser import ParseRetryableError, get_document_parser, spool_upload
+from app.services.transcript_import import parse_manifest, bulk_import_transcripts
 from .auth import verify_admin
 
 router = APIRouter(prefix="/cases", tags=["cases"])
@@ -108,6 +110,12 @@ async def search_transcripts_global(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/parse-stats", response_model=APIResponse)
+async def get_parse_stats(_admin: bool = Depends(verify_admin)):
+    """获取笔录文件解析耗时与排队指标"""
+    return APIResponse(success=True, data=get_document_parser().get_stats())
+
+
 @router.get("/{case_id}", response_model=APIResponse)
 async def get_case_detail(
     case_id: str,
@@ -184,22 +192,20 @@ async def delete_case(
 async def create_transcript(
     case_id: str,
     transcript_in: TranscriptCreate,
-    background_tasks: BackgroundTasks,
     service: TranscriptService = Depends(get_transcript_service),
 ):
     """添加笔录（文本方式）"""
     try:
         result = await service.create_transcript(case_id, transcript_in.model_dump())
-        # 自动触发 AI 分析
+        # 自动触发 AI 分析（提交到任务队列，由 worker 执行）
         if transcript_in.auto_analyze:
-            background_tasks.add_task(
-                service.analyze_transcript,
-                case_id,
-                result["transcript_id"],
-            )
+            analysis = await service.request_analysis(case_id, result["transcript_id"])
+            result["analysis_status"] = analysis["analysis_status"]
         return APIResponse(success=True, data=result)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
+    except TranscriptTooLargeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -207,7 +213,6 @@ async def create_transcript(
 @router.post("/{case_id}/transcripts/upload", response_model=APIResponse)
 async def upload_transcript(
     case_id: str,
-    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     title: str = Form(...),
     type: str = Form(...),
@@ -224,19 +229,10 @@ async def upload_transcript(
     if ext not in ("doc", "docx", "txt"):
         raise HTTPException(status_code=400, detail="仅支持 .doc、.docx 和 .txt 文件")
 
-    # 校验大小（10MB）
-    file_bytes = await file.read()
-    if len(file_bytes) > 10 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="文件大小不能超过 10MB")
-
     try:
-        # 解析文件内容
-        if ext == "docx":
-            content = TranscriptService.parse_docx(file_bytes)
-        elif ext == "doc":
-            content = TranscriptService.parse_doc(file_bytes)
-        else:
-            content = TranscriptService.parse_txt(file_bytes)
+        # 分块落盘（超过大小上限立即拒绝），解析器直接读取临时文件（进程池 / 子进程，不阻塞事件循环）
+        async with spool_upload(file) as spooled:
+            content = await TranscriptService.parse_file(spooled.path, ext)
 
         data = {
             "title": title,
@@ -245,15 +241,46 @@ async def upload_transcript(
             "subject_role": subject_role,
             "content": content,
             "file_name": file.filename,
+            "file_hash": spooled.sha256,
         }
         result = await service.create_transcript(case_id, data)
 
         if auto_analyze:
-            background_tasks.add_task(
-                service.analyze_transcript,
-                case_id,
-                result["transcript_id"],
-            )
+            analysis = await service.request_analysis(case_id, result["transcript_id"])
+            result["analysis_status"] = analysis["analysis_status"]
+        return APIResponse(success=True, data=result)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ParseRetryableError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/{case_id}/transcripts/bulk-upload", response_model=APIResponse)
+async def bulk_upload_transcripts(
+    case_id: str,
+    files: List[UploadFile] = File(..., description="笔录文件（.doc / .docx / .txt）或 zip 压缩包，可多个"),
+    manifest: Optional[str] = Form(None, description='元数据清单 JSON：[{"file_name", "title", "type", "subject_name", "subject_role"}]'),
+    type: Optional[str] = Form(None, description="清单未填写时的默认笔录类型"),
+    subject_role: Optional[str] = Form(None, description="清单未填写时的默认被询问人角色"),
+    auto_analyze: bool = Form(True),
+    service: TranscriptService = Depends(get_transcript_service),
+):
+    """批量导入笔录（zip / 多文件 + 元数据清单），逐文件返回结果"""
+    try:
+        entries = parse_manifest(manifest)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        result = await bulk_import_transcripts(
+            service, case_id, files, entries,
+            defaults={"type": type, "subject_role": subject_role},
+            auto_analyze=auto_analyze,
+        )
         return APIResponse(success=True, data=result)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
@@ -316,7 +343,7 @@ async def delete_transcript(
 async def trigger_analysis(
     case_id: str,
     transcript_id: str,
-    background_tasks: BackgroundTasks,
+    force: bool = Query(False, description="忽略相同内容的分析缓存，强制重新分析"),
     service: TranscriptService = Depends(get_transcript_service),
 ):
     """触发/重新触发 AI 分析"""
@@ -325,13 +352,11 @@ async def trigger_analysis(
         status = await service.get_analysis_status(case_id, transcript_id)
         if status is None:
             raise HTTPException(status_code=404, detail="笔录不存在")
-        background_tasks.add_task(
-            service.analyze_transcript, case_id, transcript_id
-        )
+        analysis = await service.request_analysis(case_id, transcript_id, force=force)
         return APIResponse(success=True, data={
             "transcript_id": transcript_id,
-            "analysis_status": "analyzing",
-            "message": "分析任务已提交",
+            **analysis,
+            "message": "已复用相同内容的分析结果" if analysis["cached"] else "分析任务已提交",
         })
     except HTTPException:
         raise
@@ -350,7 +375,8 @@ async def get_analysis_status(
         status = await service.get_analysis_status(case_id, transcript_id)
         if status is None:
             raise HTTPException(status_code=404, detail="笔录不存在")
-        return APIResponse(success=True, data={"analysis_status": status})
+        job = await service.get_analysis_job(transcript_id)
+        return APIResponse(success=True, data={"analysis_status": status, "job": job})
     except HTTPException:
         raise
     except Exception as e:
@@ -362,11 +388,11 @@ async def get_analysis_status(
 @router.post("/{case_id}/cross-analyze", response_model=APIResponse)
 async def trigger_cross_analysis(
     case_id: str,
-    background_tasks: BackgroundTasks,
+    full: bool = Query(False, description="忽略上次结果，全量重新交叉分析"),
     service: TranscriptService = Depends(get_transcript_service),
     case_service: CaseService = Depends(get_case_service),
 ):
-    """触发交叉分析（需 ≥2 份已分析笔录）"""
+    """触发交叉分析（需 ≥2 份已分析笔录；默认只比对新增/变更的笔录）"""
     try:
         # 检查案件是否存在
         case = await case_service.get_case_detail(case_id)
@@ -382,13 +408,14 @@ async def trigger_cross_analysis(
                 detail=f"至少需要 2 份已分析的笔录，当前已分析 {analyzed_count} 份"
             )
 
-        # 异步触发交叉分析
-        background_tasks.add_task(service.cross_analyze, case_id)
+        # 提交交叉分析任务（由 worker 执行）
+        job = await service.enqueue_cross_analysis(case_id, full=full)
 
         return APIResponse(success=True, data={
             "case_id": case_id,
             "analysis_status": "analyzing",
             "analyzed_transcripts": analyzed_count,
+            "job_id": job["job_id"],
             "message": "交叉分析任务已提交",
         })
     except HTTPException:
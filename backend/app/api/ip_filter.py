@@ -1,16 +1,18 @@
 """
 IP 访问控制模块 - 基于 IP 白名单的访问过滤
 """
+import bisect
 import ipaddress
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 from fastapi import Request, HTTPException
 from app.db import get_database
+from app.services.settings_cache import get_settings_cache
 
 
 async def get_ip_access_config() -> dict:
     """获取 IP 访问控制配置"""
     db = get_database()
-    settings = await db.settings.find_one({"key": "ip_access_config"})
+    settings = await get_settings_cache().get(db, "ip_access_config")
     if settings:
         return {
             "ai_enabled": settings.get("ai_enabled", False),
@@ -43,32 +45,88 @@ def get_client_ip(request: Request) -> str:
     return request.client.host if request.client else "unknown"
 
 
-def is_ip_in_whitelist(client_ip: str, whitelist: List[str]) -> bool:
-    """检查 IP 是否在白名单中（支持 CIDR 格式）"""
-    if not whitelist:
-        return False  # 空白名单表示不允许访问
-    
-    try:
-        client = ipaddress.ip_address(client_ip)
-        for entry in whitelist:
-            entry = entry.strip()
+class CompiledWhitelist:
+    """
+    预编译的 IP 白名单：将 CIDR / 单 IP 条目转换为按版本（IPv4/IPv6）分组、
+    排序并合并后的整数区间，查询时二分查找，复杂度 O(log n)
+    """
+
+    def __init__(self, whitelist: List[str]):
+        ranges: Dict[int, List[Tuple[int, int]]] = {4: [], 6: []}
+        for entry in whitelist or []:
+            entry = entry.strip() if isinstance(entry, str) else ""
             if not entry:
                 continue
             try:
-                # 尝试解析为网络（CIDR 格式）
-                if "/" in entry:
-                    network = ipaddress.ip_network(entry, strict=False)
-                    if client in network:
-                        return True
-                else:
-                    # 单个 IP 地址
-                    if client == ipaddress.ip_address(entry):
-                        return True
+                # 单个 IP 也按 /32 或 /128 网络处理
+                network = ipaddress.ip_network(entry, strict=False)
             except ValueError:
                 continue  # 跳过无效条目
-        return False
-    except ValueError:
-        return False  # 无效的客户端 IP
+            ranges[network.version].append(
+                (int(network.network_address), int(network.broadcast_address))
+            )
+
+        self._starts: Dict[int, List[int]] = {}
+        self._ends: Dict[int, List[int]] = {}
+        for version, items in ranges.items():
+            merged: List[List[int]] = []
+            for start, end in sorted(items):
+                if merged and start <= merged[-1][1] + 1:
+                    merged[-1][1] = max(merged[-1][1], end)
+                else:
+                    merged.append([start, end])
+            self._starts[version] = [m[0] for m in merged]
+            self._ends[version] = [m[1] for m in merged]
+
+    def __len__(self) -> int:
+        return sum(len(starts) for starts in self._starts.values())
+
+    def contains(self, client_ip: str) -> bool:
+        """检查 IP 是否落在任一白名单区间内"""
+        try:
+            client = ipaddress.ip_address(client_ip)
+        except ValueError:
+            return False  # 无效的客户端 IP
+        # IPv4 映射的 IPv6 地址（::ffff:a.b.c.d）按 IPv4 匹配
+        if client.version == 6 and client.ipv4_mapped is not None:
+            client = client.ipv4_mapped
+        starts = self._starts.get(client.version)
+        if not starts:
+            return False
+        value = int(client)
+        idx = bisect.bisect_right(starts, value) - 1
+        return idx >= 0 and value <= self._ends[client.version][idx]
+
+
+# 预编译白名单缓存：配置字段名 -> (配置版本, 预编译结果)，随配置版本失效
+_COMPILED_WHITELISTS: Dict[str, Tuple[int, CompiledWhitelist]] = {}
+
+
+def _on_settings_changed(key: str, doc: Optional[dict]):
+    """IP 访问控制配置变化时清空预编译缓存"""
+    if key == "ip_access_config":
+        _COMPILED_WHITELISTS.clear()
+
+
+get_settings_cache().add_listener(_on_settings_changed)
+
+
+def get_compiled_whitelist(field: str, whitelist: List[str]) -> CompiledWhitelist:
+    """获取当前配置版本下的预编译白名单（每个版本只编译一次）"""
+    version = get_settings_cache().get_version("ip_access_config")
+    cached = _COMPILED_WHITELISTS.get(field)
+    if cached and cached[0] == version:
+        return cached[1]
+    matcher = CompiledWhitelist(whitelist)
+    _COMPILED_WHITELISTS[field] = (version, matcher)
+    return matcher
+
+
+def is_ip_in_whitelist(client_ip: str, whitelist: List[str]) -> bool:
+    """检查 IP 是否在白名单中（支持 CIDR 格式）"""
+    if not whitelist:
+        return False  # 空白名单表示不允许访问
+    return CompiledWhitelist(whitelist).contains(client_ip)
 
 
 async def verify_ai_access(request: Request):
@@ -81,7 +139,8 @@ async def verify_ai_access(request: Request):
     
     client_ip = get_client_ip(request)
     
-    if not is_ip_in_whitelist(client_ip, config["ai_whitelist"]):
+    matcher = get_compiled_whitelist("ai_whitelist", config["ai_whitelist"])
+    if not matcher.contains(client_ip):
         raise HTTPException(
             status_code=403,
             detail=f"您的 IP ({client_ip}) 无权访问 AI 功能，请联系管理员"
@@ -100,7 +159,8 @@ async def verify_internal_docs_access(request: Request):
     
     client_ip = get_client_ip(request)
     
-    if not is_ip_in_whitelist(client_ip, config["internal_docs_whitelist"]):
+    matcher = get_compiled_whitelist("internal_docs_whitelist", config["internal_docs_whitelist"])
+    if not matcher.contains(client_ip):
         raise HTTPException(
             status_code=403,
             detail=f"您的 IP ({client_ip}) 无权访问内部规章，请联系管理员"
@@ -1,10 +1,11 @@
 """
 法规相关 API 路由
 """
-from fastapi import APIRouter, HTTPException, Query, Depends, Request, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Query, Depends, Request
 from typing import Optional, List
 from app.models import APIResponse, SearchRequest, LawCreate
 from app.services import LawService
+from app.services.job_queue import JobQueue, JOB_VECTORIZE_LAW, job_key, job_summary
 from .auth import verify_admin
 
 router = APIRouter(prefix="/laws", tags=["laws"])
@@ -23,18 +24,21 @@ def get_law_service(request: Request) -> LawService:
 @router.post("/", response_model=APIResponse)
 async def create_law(
     law_in: LawCreate,
-    background_tasks: BackgroundTasks,
     service: LawService = Depends(get_law_service),
 ):
     """
-    手动创建法规（保存后异步触发向量化）
+    手动创建法规（保存后为新增/内容变化的条文提交向量化任务）
     """
     try:
         result = await service.create_law(law_in)
-        # 保存成功后，在后台异步执行向量化（不阻塞响应）
+        # 保存成功后提交向量化任务，由 worker 执行（不阻塞响应）
         law_id = result.get("law_id")
-        if law_id:
-            background_tasks.add_task(service.vectorize_law_articles, law_id)
+        # 条文内容均未变化（且已全部向量化）时无需重新向量化
+        if law_id and result.get("needs_vectorize"):
+            job = await JobQueue(service.db).enqueue(
+                JOB_VECTORIZE_LAW, {"law_id": law_id}, dedupe_key=job_key(JOB_VECTORIZE_LAW, law_id)
+            )
+            result["vectorize_job_id"] = job["job_id"]
         return APIResponse(success=True, data=result)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -49,6 +53,8 @@ async def get_vectorize_status(
     查询法规条文向量化状态
     """
     try:
+        # 任务状态与进度来自任务队列；条文计数反映最终落库结果
+        job = await JobQueue(service.db).latest_job(job_key(JOB_VECTORIZE_LAW, law_id))
         total = await service.articles_collection.count_documents({"law_id": law_id})
         vectorized = await service.articles_collection.count_documents(
             {"law_id": law_id, "embedding": {"$exists": True}}
@@ -58,7 +64,8 @@ async def get_vectorize_status(
             "total": total,
             "vectorized": vectorized,
             "pending": total - vectorized,
-            "complete": total > 0 and vectorized == total
+            "complete": total > 0 and vectorized == total and not (job and job.get("active")),
+            "job": job_summary(job),
         })
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -172,6 +179,21 @@ async def get_total_views(service: LawService = Depends(get_law_service)):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/stats/most-viewed", response_model=APIResponse)
+async def get_most_viewed_laws(
+    limit: int = Query(10, ge=1, le=50),
+    service: LawService = Depends(get_law_service),
+):
+    """
+    获取浏览量最高的法规
+    """
+    try:
+        laws = await service.get_most_viewed_laws(limit)
+        return APIResponse(success=True, data=laws)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 # ==================== 内部规章相关 ====================
 
 @router.get("/internal-docs/check", response_model=APIResponse)
@@ -4,7 +4,10 @@
 from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel, Field
 from typing import Optional, List
+from datetime import datetime, timedelta
 from app.db import get_database
+from app.services.settings_cache import get_settings_cache
+from app.services.usage_aggregator import COLLECTION_TOKEN_USAGE_DAILY, TOKEN_USAGE_FIELDS
 from .auth import verify_admin
 
 router = APIRouter(prefix="/settings", tags=["系统设置"])
@@ -27,6 +30,11 @@ class AISettings(BaseModel):
     rag_enabled: bool = True
     rag_top_k: int = 6
     use_function_calling: bool = True  # 是否使用 Function Calling
+    max_concurrency: Optional[int] = Field(None, ge=1)  # LLM 最大并发数（为空时使用 LLM_CONCURRENCY_* 环境变量）
+    api_urls: List[str] = Field(default_factory=list)  # 额外的同构模型副本地址（与 api_url 组成端点池）
+    hedge_enabled: bool = False  # 是否对交互式对话启用对冲请求
+    hedge_delay_ms: int = Field(0, ge=0)  # 对冲延迟下限（毫秒）；样本不足时作为默认延迟
+    context_token_budget: int = Field(3000, ge=500)  # RAG 检索上下文 token 预算
 
 
 # 预设模型配置
@@ -56,7 +64,7 @@ AI_PRESETS = {
 async def get_popup_settings():
     """获取首页弹窗设置"""
     db = get_database()
-    settings = await db.settings.find_one({"key": "homepage_popup"})
+    settings = await get_settings_cache().get(db, "homepage_popup")
     if settings:
         return PopupSettings(
             enabled=settings.get("enabled", False),
@@ -70,16 +78,14 @@ async def get_popup_settings():
 async def update_popup_settings(data: PopupSettings, _admin: bool = Depends(verify_admin)):
     """更新首页弹窗设置"""
     db = get_database()
-    await db.settings.update_one(
-        {"key": "homepage_popup"},
+    await get_settings_cache().update(
+        db,
+        "homepage_popup",
         {
-            "$set": {
-                "enabled": data.enabled,
-                "title": data.title,
-                "content": data.content,
-            }
+            "enabled": data.enabled,
+            "title": data.title,
+            "content": data.content,
         },
-        upsert=True,
     )
     return {"success": True, "message": "弹窗设置已保存"}
 
@@ -88,7 +94,7 @@ async def update_popup_settings(data: PopupSettings, _admin: bool = Depends(veri
 async def get_ai_settings():
     """获取 AI 模型配置"""
     db = get_database()
-    settings = await db.settings.find_one({"key": "ai_config"})
+    settings = await get_settings_cache().get(db, "ai_config")
     if settings:
         return {
             "provider": settings.get("provider", "deepseek"),
@@ -99,6 +105,11 @@ async def get_ai_settings():
             "rag_enabled": settings.get("rag_enabled", True),
             "rag_top_k": settings.get("rag_top_k", 6),
             "use_function_calling": settings.get("use_function_calling", True),
+            "max_concurrency": settings.get("max_concurrency"),
+            "api_urls": settings.get("api_urls", []),
+            "hedge_enabled": settings.get("hedge_enabled", False),
+            "hedge_delay_ms": settings.get("hedge_delay_ms", 0),
+            "context_token_budget": settings.get("context_token_budget", 3000),
         }
     # 返回默认配置
     return {
@@ -110,6 +121,11 @@ async def get_ai_settings():
         "rag_enabled": True,
         "rag_top_k": 6,
         "use_function_calling": True,
+        "max_concurrency": None,
+        "api_urls": [],
+        "hedge_enabled": False,
+        "hedge_delay_ms": 0,
+        "context_token_budget": 3000,
     }
 
 
@@ -123,21 +139,28 @@ async def get_ai_presets():
 async def update_ai_settings(data: AISettings, _admin: bool = Depends(verify_admin)):
     """更新 AI 模型配置"""
     db = get_database()
-    await db.settings.update_one(
-        {"key": "ai_config"},
+    await get_settings_cache().update(
+        db,
+        "ai_config",
         {
-            "$set": {
-                "provider": data.provider,
-                "api_url": data.api_url,
-                "api_key": data.api_key,
-                "model_name": data.model_name,
-                "skip_ssl_verify": data.skip_ssl_verify,
-                "rag_enabled": data.rag_enabled,
-                "rag_top_k": data.rag_top_k,
-                "use_function_calling": data.use_function_calling,
-            }
+            "provider": data.provider,
+            "api_url": data.api_url,
+            "api_key": data.api_key,
+            "model_name": data.model_name,
+            "skip_ssl_verify": data.skip_ssl_verify,
+            "rag_enabled": data.rag_enabled,
+            "rag_top_k": data.rag_top_k,
+            "use_function_calling": data.use_function_calling,
+            "max_concurrency": data.max_concurrency,
+            "api_urls": [
+                url.strip()
+                for url in data.api_urls
+                if isinstance(url, str) and url.strip()
+            ],
+            "hedge_enabled": data.hedge_enabled,
+            "hedge_delay_ms": data.hedge_delay_ms,
+            "context_token_budget": data.context_token_budget,
         },
-        upsert=True,
     )
     return {"success": True, "message": "AI 配置已保存"}
 
@@ -145,23 +168,33 @@ async def update_ai_settings(data: AISettings, _admin: bool = Depends(verify_adm
 # ==================== AI Token 用量统计 ====================
 
 @router.get("/ai/token-usage")
-async def get_ai_token_usage():
-    """获取 AI Token 累计使用量"""
+async def get_ai_token_usage(days: int = 30):
+    """
+    获取 AI Token 累计使用量及最近 days 天的按天用量
+
+    累计值 = 按天时间序列之和 + 旧版 ai_token_usage 文档中的历史累计
+    """
     db = get_database()
-    settings = await db.settings.find_one({"key": "ai_token_usage"})
-    if settings:
-        return {
-            "prompt_tokens": settings.get("prompt_tokens", 0),
-            "completion_tokens": settings.get("completion_tokens", 0),
-            "total_tokens": settings.get("total_tokens", 0),
-            "call_count": settings.get("call_count", 0),
-        }
-    return {
-        "prompt_tokens": 0,
-        "completion_tokens": 0,
-        "total_tokens": 0,
-        "call_count": 0,
-    }
+    totals = {field: 0 for field in TOKEN_USAGE_FIELDS}
+    totals["call_count"] = 0
+
+    legacy = await db.settings.find_one({"key": "ai_token_usage"})
+    if legacy:
+        for field in totals:
+            totals[field] += legacy.get(field, 0)
+
+    group = {"_id": None, **{field: {"$sum": f"${field}"} for field in totals}}
+    agg = await db[COLLECTION_TOKEN_USAGE_DAILY].aggregate([{"$group": group}]).to_list(length=1)
+    if agg:
+        for field in totals:
+            totals[field] += agg[0].get(field, 0)
+
+    since = (datetime.utcnow() - timedelta(days=max(days, 1) - 1)).strftime("%Y-%m-%d")
+    daily = await db[COLLECTION_TOKEN_USAGE_DAILY].find(
+        {"date": {"$gte": since}}, {"_id": 0, "updated_at": 0}
+    ).sort([("date", 1), ("provider", 1)]).to_list(length=None)
+
+    return {**totals, "daily": daily}
 
 
 # ==================== IP 访问控制配置 ====================
@@ -178,7 +211,7 @@ class IPAccessSettings(BaseModel):
 async def get_ip_access_settings():
     """获取 IP 访问控制配置"""
     db = get_database()
-    settings = await db.settings.find_one({"key": "ip_access_config"})
+    settings = await get_settings_cache().get(db, "ip_access_config")
     if settings:
         return {
             "ai_enabled": settings.get("ai_enabled", False),
@@ -212,17 +245,15 @@ async def update_ip_access_settings(data: IPAccessSettings, _admin: bool = Depen
     if data.internal_docs_enabled and not internal_docs_whitelist:
         raise HTTPException(status_code=400, detail="开启内部规章访问控制时必须配置 IP 白名单")
     db = get_database()
-    await db.settings.update_one(
-        {"key": "ip_access_config"},
+    await get_settings_cache().update(
+        db,
+        "ip_access_config",
         {
-            "$set": {
-                "ai_enabled": data.ai_enabled,
-                "ai_whitelist": ai_whitelist,
-                "internal_docs_enabled": data.internal_docs_enabled,
-                "internal_docs_whitelist": internal_docs_whitelist,
-            }
+            "ai_enabled": data.ai_enabled,
+            "ai_whitelist": ai_whitelist,
+            "internal_docs_enabled": data.internal_docs_enabled,
+            "internal_docs_whitelist": internal_docs_whitelist,
         },
-        upsert=True,
     )
     return {"success": True, "message": "IP 访问控制配置已保存"}
 
@@ -6,8 +6,23 @@ from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import os
 
-from app.db import connect_to_mongo, close_mongo_connection
+from app.db import connect_to_mongo, close_mongo_connection, get_database
 from app.api import api_router
+from app.services.settings_cache import get_settings_cache
+from app.services.llm_dispatcher import get_llm_dispatcher
+from app.services.chat_session_service import ChatSessionService
+from app.services.qa_memory_service import QAMemoryService
+from app.services.qa_memory_index import get_qa_memory_index
+from app.services.usage_aggregator import get_usage_aggregator
+from app.services.view_stats import get_view_stats
+from app.services.job_queue import JobQueue
+from app.services.transcript_service import TranscriptService
+from app.services.document_parser import shutdown_document_parser
+from app.services.search_terms import ensure_search_indexes, start_backfill as start_search_terms_backfill
+
+# 在 API 进程内同时运行任务 worker（默认开启，直接启动 uvicorn 即可执行后台任务）；
+# 部署了独立 worker 进程（docker-compose 中的 worker 服务）时设为 false
+JOB_WORKER_EMBEDDED = os.getenv("JOB_WORKER_EMBEDDED", "true").lower() in ("1", "true", "yes")
 
 
 @asynccontextmanager
@@ -15,7 +30,50 @@ async def lifespan(app: FastAPI):
     """应用生命周期管理"""
     # 启动时连接数据库
     await connect_to_mongo()
+    # 预热配置缓存并启动跨 worker 版本检查
+    await get_settings_cache().start(get_database())
+    # LLM 并发上限与独立 worker 进程共享（跨进程名额租约）
+    await get_llm_dispatcher().start(get_database())
+    # 对话会话索引（含闲置会话 TTL 清理）
+    try:
+        await ChatSessionService(get_database()).ensure_indexes()
+    except Exception as e:
+        print(f"⚠️ 创建对话会话索引失败: {e}")
+    # 预加载 QA 记忆库常驻索引
+    try:
+        await QAMemoryService(get_database()).ensure_indexes()
+        await get_qa_memory_index().ensure_loaded(get_database())
+    except Exception as e:
+        print(f"⚠️ QA 记忆索引加载失败，将在首次查询时重试: {e}")
+    # 计数类写操作（记忆命中、Token 用量）批量写回
+    await get_usage_aggregator().start(get_database())
+    # 法规浏览事件缓冲写库 + 预聚合计数
+    await get_view_stats().start(get_database())
+    # 任务队列索引；按需在本进程内启动 worker
+    worker = None
+    try:
+        await JobQueue(get_database()).ensure_indexes()
+        await TranscriptService(get_database()).ensure_indexes()
+    except Exception as e:
+        print(f"⚠️ 创建任务队列索引失败: {e}")
+    # 笔录/案件关键词检索的 n-gram 索引，历史文档后台补齐
+    try:
+        await ensure_search_indexes(get_database())
+        start_search_terms_backfill(get_database())
+    except Exception as e:
+        print(f"⚠️ 创建检索索引失败: {e}")
+    if JOB_WORKER_EMBEDDED:
+        from app.worker import JobWorker, job_concurrency
+        worker = JobWorker(get_database(), job_concurrency())
+        await worker.start()
     yield
+    if worker is not None:
+        await worker.stop()
+    shutdown_document_parser()
+    await get_view_stats().stop()
+    await get_usage_aggregator().stop()
+    await get_llm_dispatcher().stop()
+    await get_settings_cache().stop()
     # 关闭时断开连接
     await close_mongo_connection()
 
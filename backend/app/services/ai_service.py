@@ -8,6 +8,16 @@ from typing import Optional, Dict, Any, List
 from motor.motor_asyncio import AsyncIOMotorDatabase
 
 from app.services.law_service import LawService, _resolve_law_alias, _normalize_law_name, get_law_weight
+from app.services.law_citation_resolver import (
+    get_law_title_index,
+    law_year as _get_law_year,
+    law_base_name as _get_law_base_name,
+)
+from app.services.settings_cache import get_settings_cache
+from app.services.llm_dispatcher import get_llm_dispatcher, LLMQueueFullError, PRIORITY_CHAT
+from app.services.llm_pool import get_llm_pool
+from app.services.context_builder import ContextBuilder, extract_query_terms, DEFAULT_CONTEXT_TOKEN_BUDGET
+from app.services.chat_session_service import window_history
 
 # 默认配置（当数据库无配置时使用）
 DEFAULT_API_URL = "https://api.deepseek.com/v1/chat/completions"
@@ -17,10 +27,10 @@ DEFAULT_API_KEY = os.getenv("DEEPSEEK_API_KEY", "")
 # 向量搜索最低相似度阈值（低于此值的结果视为不相关）
 VECTOR_SIMILARITY_THRESHOLD = 0.35
 
-# 返回给 LLM 的条文内容最大长度
+# 返回给 LLM 的单条条文内容最大长度（超长条文由上下文构建器按查询词裁剪句子）
 MAX_ARTICLE_CONTENT_LEN = 1500
 
-# 不支持 Function Calling 的 (api_url, model) 组合缓存（进程内）
+# 不支持 Function Calling 的 (端点 URL, model) 组合缓存（进程内，按端点池中的单个端点记录）
 UNSUPPORTED_TOOL_CALLING_MODELS = set()
 
 # LLM 请求超时配置（内网部署 + 并发场景，需预留充足等待时间）
@@ -31,6 +41,9 @@ LLM_TIMEOUT = httpx.Timeout(
     pool=30.0         # 连接池等待超时
 )
 
+# 笔录分析 / 交叉分析超时（输出较多，需要更长的读超时）
+LLM_ANALYSIS_TIMEOUT = httpx.Timeout(connect=30.0, read=300.0, write=30.0, pool=30.0)
+
 # 系统提示词 - 定义 AI 助手人设（Function Calling 版本）
 SYSTEM_PROMPT = """你是一名公安执法辅助中的【法律适用解释助手】，目标是用简洁、准确的方式回答执法人员关于法律适用的问题。
 
@@ -135,8 +148,8 @@ LOOKUP_ARTICLE_TOOL = {
 
 
 async def get_ai_config(db: AsyncIOMotorDatabase) -> dict:
-    """从数据库获取 AI 配置"""
-    settings = await db.settings.find_one({"key": "ai_config"})
+    """获取 AI 配置（读取进程内配置缓存，不访问数据库）"""
+    settings = await get_settings_cache().get(db, "ai_config")
     if settings:
         return {
             "api_url": settings.get("api_url", DEFAULT_API_URL),
@@ -147,6 +160,11 @@ async def get_ai_config(db: AsyncIOMotorDatabase) -> dict:
             "rag_enabled": settings.get("rag_enabled", True),
             "rag_top_k": settings.get("rag_top_k", 6),
             "use_function_calling": settings.get("use_function_calling", True),
+            "max_concurrency": settings.get("max_concurrency"),
+            "api_urls": settings.get("api_urls", []),
+            "hedge_enabled": settings.get("hedge_enabled", False),
+            "hedge_delay_ms": settings.get("hedge_delay_ms", 0),
+            "context_token_budget": settings.get("context_token_budget", DEFAULT_CONTEXT_TOKEN_BUDGET),
         }
     return {
         "api_url": DEFAULT_API_URL,
@@ -157,6 +175,11 @@ async def get_ai_config(db: AsyncIOMotorDatabase) -> dict:
         "rag_enabled": True,
         "rag_top_k": 6,
         "use_function_calling": True,
+        "max_concurrency": None,
+        "api_urls": [],
+        "hedge_enabled": False,
+        "hedge_delay_ms": 0,
+        "context_token_budget": DEFAULT_CONTEXT_TOKEN_BUDGET,
     }
 
 
@@ -388,7 +411,7 @@ async def execute_search_legal_knowledge(
                                 articles.append({
                                     "law_title": item.get("law_title", ""),
                                     "article_display": item.get("article_display", ""),
-                                    "content": content[:MAX_ARTICLE_CONTENT_LEN] if len(content) > MAX_ARTICLE_CONTENT_LEN else content,
+                                    "content": content,
                                 })
                             return {
                                 "found": True,
@@ -467,7 +490,7 @@ async def execute_search_legal_knowledge(
                     articles.append({
                         "law_title": item.get("law_title", ""),
                         "article_display": item.get("article_display", ""),
-                        "content": content[:MAX_ARTICLE_CONTENT_LEN] if len(content) > MAX_ARTICLE_CONTENT_LEN else content,
+                        "content": content,
                     })
                 return await _filter_and_format_results_from_articles(articles, keywords, top_k)
             else:
@@ -550,22 +573,6 @@ async def execute_search_legal_knowledge(
     return await _filter_and_format_results(items, keywords, top_k)
 
 
-def _get_law_year(title: str) -> int:
-    """从法律标题中提取年份"""
-    import re
-    # 支持多种格式：（2018年修正）、（2025年修订）、（2020年）
-    year_pattern = r'[（\(](\d{4})年?[修订正]*[）\)]'
-    match = re.search(year_pattern, title)
-    return int(match.group(1)) if match else 0
-
-
-def _get_law_base_name(title: str) -> str:
-    """提取法律基础名称（去掉年份部分）"""
-    import re
-    year_pattern = r'[（\(]\d{4}年?[修订正]*[）\)]'
-    return re.sub(year_pattern, '', title).strip()
-
-
 def _filter_latest_laws(laws: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """按基础名称分组，保留最新版本的法律"""
     law_by_base = {}
@@ -586,7 +593,6 @@ async def execute_lookup_law_article(
     精准查询某部法律的具体某条（新增的精准检索工具）
     """
     law_service = LawService(db)
-    laws_collection = db["laws"]
     articles_collection = db["law_articles"]
     
     # 使用别名解析找到法律全称
@@ -599,11 +605,10 @@ async def execute_lookup_law_article(
     # 去掉常见前缀以进行模糊匹配
     clean_name = search_name.replace("中华人民共和国", "").strip()
     
-    # 查找法律
-    matching_laws = await laws_collection.find(
-        {"title": {"$regex": clean_name, "$options": "i"}},
-        {"law_id": 1, "title": 1}
-    ).to_list(length=10)
+    # 查找法律（常驻内存的法规名称索引，不访问数据库）
+    title_index = get_law_title_index()
+    await title_index.ensure_loaded(db)
+    matching_laws = title_index.find_laws(clean_name)
     
     if not matching_laws:
         # 尝试更模糊的匹配
@@ -646,7 +651,7 @@ async def execute_lookup_law_article(
             "law_title": law_map.get(article.get("law_id"), ""),
             "article_num": article.get("article_num", 0),
             "article_display": article.get("article_display", ""),
-            "content": content[:MAX_ARTICLE_CONTENT_LEN] if len(content) > MAX_ARTICLE_CONTENT_LEN else content,
+            "content": content,
         })
     
     return {
@@ -702,7 +707,7 @@ async def _filter_and_format_results(
             "law_title": law_title,
             "article_num": item.get("article_num", 0),
             "article_display": article_display,
-            "content": content[:MAX_ARTICLE_CONTENT_LEN] if len(content) > MAX_ARTICLE_CONTENT_LEN else content,
+            "content": content,
         })
     
     return {
@@ -796,6 +801,27 @@ def _build_messages_with_context(
     return messages
 
 
+def _endpoint_urls(config: dict) -> List[str]:
+    """AI 配置中的全部端点：主地址 + 额外副本地址（去重保序）"""
+    urls = []
+    for url in [config.get("api_url", DEFAULT_API_URL)] + list(config.get("api_urls") or []):
+        url = (url or "").strip()
+        if url and url not in urls:
+            urls.append(url)
+    return urls
+
+
+def _llm_call_options(config: dict) -> Dict[str, Any]:
+    """从 AI 配置生成 _call_llm 的调度/端点池参数"""
+    return {
+        "provider": config.get("provider", "default"),
+        "max_concurrency": config.get("max_concurrency"),
+        "extra_urls": config.get("api_urls") or [],
+        "hedge_enabled": config.get("hedge_enabled", False),
+        "hedge_delay_ms": config.get("hedge_delay_ms", 0),
+    }
+
+
 async def _call_llm(
     api_url: str,
     api_key: str,
@@ -804,8 +830,20 @@ async def _call_llm(
     skip_ssl_verify: bool,
     tools: Optional[List[Dict]] = None,
     timeout: httpx.Timeout = LLM_TIMEOUT,
+    max_tokens: int = 2000,
+    provider: str = "default",
+    priority: int = PRIORITY_CHAT,
+    max_concurrency: Optional[int] = None,
+    extra_urls: Optional[List[str]] = None,
+    hedge_enabled: bool = False,
+    hedge_delay_ms: int = 0,
 ) -> Dict[str, Any]:
-    """调用 LLM API（内网部署并发场景，默认 read 超时 180 秒）"""
+    """
+    调用 LLM API（内网部署并发场景，默认 read 超时 180 秒）
+    - 经 LLM 调度器按 provider 限制并发，按 priority 排队（对话 > 笔录分析 > 交叉分析）
+    - api_url + extra_urls 组成端点池：最少在途请求负载均衡，5xx/超时自动切换端点
+    - 交互式对话可开启对冲请求：超过 p95 延迟仍未返回时向另一端点再发一次
+    """
     headers = {"Content-Type": "application/json"}
     if api_key:
         headers["Authorization"] = f"Bearer {api_key}"
@@ -814,46 +852,44 @@ async def _call_llm(
         "model": model,
         "messages": messages,
         "temperature": 0,
-        "max_tokens": 2000,
+        "max_tokens": max_tokens,
     }
     
     if tools:
         payload["tools"] = tools
         payload["tool_choice"] = "auto"
-    
-    async with httpx.AsyncClient(timeout=timeout, verify=not skip_ssl_verify) as client:
-        try:
-            response = await client.post(api_url, headers=headers, json=payload)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as e:
-            # 某些 OpenAI 兼容实现不接受 tool_choice 字段：降级重试一次
-            if tools and e.response.status_code == 400 and payload.get("tool_choice") is not None:
-                retry_payload = dict(payload)
-                retry_payload.pop("tool_choice", None)
-                retry_response = await client.post(api_url, headers=headers, json=retry_payload)
-                retry_response.raise_for_status()
-                return retry_response.json()
-            raise
 
+    async def send(url: str) -> Dict[str, Any]:
+        async with httpx.AsyncClient(timeout=timeout, verify=not skip_ssl_verify) as client:
+            try:
+                response = await client.post(url, headers=headers, json=payload)
+                response.raise_for_status()
+                return response.json()
+            except httpx.HTTPStatusError as e:
+                # 某些 OpenAI 兼容实现不接受 tool_choice 字段：降级重试一次
+                if tools and e.response.status_code == 400 and payload.get("tool_choice") is not None:
+                    retry_payload = dict(payload)
+                    retry_payload.pop("tool_choice", None)
+                    retry_response = await client.post(url, headers=headers, json=retry_payload)
+                    retry_response.raise_for_status()
+                    return retry_response.json()
+                raise
+
+    pool = get_llm_pool(provider, [api_url] + list(extra_urls or []))
+    # 带工具调用时跳过已知不支持 Function Calling 的端点
+    exclude = {url for url in pool.urls if (url, model) in UNSUPPORTED_TOOL_CALLING_MODELS} if tools else set()
+    # 仅交互式对话启用对冲（分析类请求耗时长，对冲只会加倍负载）
+    hedge_delay = pool.hedge_delay(priority, hedge_delay_ms) if hedge_enabled and priority == PRIORITY_CHAT else None
 
-def _format_tool_result(result: Dict[str, Any]) -> str:
-    """格式化工具调用结果为人类可读的文本"""
-    if not result.get("found"):
-        return result.get("message", "未检索到相关法规")
-    
-    articles = result.get("articles", [])
-    if not articles:
-        return "未检索到相关法规"
-    
-    formatted = []
-    for i, article in enumerate(articles, 1):
-        law_title = article.get("law_title", "")
-        article_display = article.get("article_display", "")
-        content = article.get("content", "")
-        formatted.append(f"[{i}] 《{law_title}》{article_display}：{content}")
-    
-    return "\n\n".join(formatted)
+    dispatcher = get_llm_dispatcher()
+    async with dispatcher.slot(provider, priority, limit=max_concurrency):
+        return await pool.request(
+            send,
+            exclude=exclude,
+            hedge_delay=hedge_delay,
+            sample_key=priority,
+            hedge_slot=lambda: dispatcher.try_acquire(provider, limit=max_concurrency, priority=priority),
+        )
 
 
 async def chat_with_ai(
@@ -871,7 +907,11 @@ async def chat_with_ai(
     1. 第一轮：发送用户问题 + 工具定义，让 AI 决定是否调用工具
     2. 如果 AI 调用工具：执行检索，获取结果
     3. 第二轮：将检索结果作为上下文，让 AI 生成最终回答
+
+    history 会按 token 预算截取最近的若干轮，prompt 大小不随对话长度增长
     """
+    history = window_history(history)
+
     # ========== 第 0 步：查询记忆库 ==========
     if db is not None:
         from app.services.qa_memory_service import QAMemoryService
@@ -912,8 +952,9 @@ async def chat_with_ai(
     skip_ssl_verify = config.get("skip_ssl_verify", False)
     provider_id = config.get("provider", "default")
     use_function_calling = config.get("use_function_calling", True)
+    llm_options = _llm_call_options(config)
     top_k = rag_top_k if rag_top_k is not None else config.get("rag_top_k", 6)
-    tool_model_key = (api_url, model)
+    endpoint_urls = _endpoint_urls(config)
     
     total_usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
     rag_sources = []
@@ -938,8 +979,8 @@ async def chat_with_ai(
     
     try:
         if use_rag and use_function_calling and db is not None:
-            # 已知不支持 tools 的模型直接走回退模式，避免每次先触发 400
-            if tool_model_key in UNSUPPORTED_TOOL_CALLING_MODELS:
+            # 端点池中所有端点均已知不支持 tools 时直接走回退模式，避免每次先触发 400
+            if all((url, model) in UNSUPPORTED_TOOL_CALLING_MODELS for url in endpoint_urls):
                 print(f"[AI Service] 模型已标记不支持Function Calling，直接回退: model={model}")
                 return await _fallback_chat(
                     message, history, db, config, top_k
@@ -954,7 +995,8 @@ async def chat_with_ai(
             try:
                 data = await _call_llm(
                     api_url, api_key, model, messages, skip_ssl_verify,
-                    tools=[LEGAL_SEARCH_TOOL, LOOKUP_ARTICLE_TOOL]
+                    tools=[LEGAL_SEARCH_TOOL, LOOKUP_ARTICLE_TOOL],
+                    **llm_options,
                 )
                 print(f"[AI Service] LLM 响应: tool_calls={data.get('choices', [{}])[0].get('message', {}).get('tool_calls')}")
             except httpx.HTTPStatusError as e:
@@ -967,8 +1009,9 @@ async def chat_with_ai(
                 print(f"[AI Service] HTTP 错误 {e.response.status_code}，回退到普通模式。响应摘要: {response_text}")
                 if e.response.status_code in (400, 500, 502, 503):
                     if e.response.status_code == 400:
-                        UNSUPPORTED_TOOL_CALLING_MODELS.add(tool_model_key)
-                        print(f"[AI Service] 已标记模型不支持Function Calling: model={model}")
+                        failed_url = getattr(e, "llm_endpoint", api_url)
+                        UNSUPPORTED_TOOL_CALLING_MODELS.add((failed_url, model))
+                        print(f"[AI Service] 已标记端点不支持Function Calling: url={failed_url}, model={model}")
                     return await _fallback_chat(
                         message, history, db, config, top_k
                     )
@@ -989,7 +1032,12 @@ async def chat_with_ai(
             if tool_calls:
                 # AI 决定调用工具（支持多次调用）
                 print(f"[AI Service] AI 调用了工具: {len(tool_calls)} 个")
-                all_tool_results = []
+                # 按 token 预算组装检索结果（跨工具调用去重、按相关度取舍、超长条文按查询词裁剪）
+                context_builder = ContextBuilder(
+                    token_budget=config.get("context_token_budget") or DEFAULT_CONTEXT_TOKEN_BUDGET,
+                    query_terms=extract_query_terms(message),
+                    max_article_chars=MAX_ARTICLE_CONTENT_LEN,
+                )
                 
                 for tool_call in tool_calls:
                     func = tool_call.get("function", {})
@@ -1010,6 +1058,7 @@ async def chat_with_ai(
                         result = await execute_search_legal_knowledge(
                             db, keywords, law_name, article_num, top_k
                         )
+                        tool_terms = extract_query_terms(keywords)
                         
                     elif func_name == "lookup_law_article":
                         law_name = args.get("law_name", "")
@@ -1020,26 +1069,30 @@ async def chat_with_ai(
                         result = await execute_lookup_law_article(
                             db, law_name, article_num
                         )
+                        tool_terms = []
                     else:
                         print(f"[AI Service] 未知工具: {func_name}")
                         continue
                     
                     print(f"[AI Service] 检索结果: found={result.get('found')}, articles_count={len(result.get('articles', []))}")
-                    
-                    # 记录来源
-                    for article in result.get("articles", []):
-                        rag_sources.append({
-                            "law_id": article.get("law_id", ""),
-                            "law_title": article.get("law_title", ""),
-                            "article_num": article.get("article_num", 0),
-                            "article_display": article.get("article_display", ""),
-                        })
-                    
-                    formatted = _format_tool_result(result)
-                    if formatted:
-                        all_tool_results.append(formatted)
+                    context_builder.add_result(result, extra_terms=tool_terms)
                 
-                tool_result_text = "\n\n".join(all_tool_results) if all_tool_results else "未检索到相关法规"
+                tool_result_text, selected_articles, context_stats = context_builder.build()
+                print(
+                    f"[AI Service] 上下文构建: 条文 {context_stats['articles_selected']}/{context_stats['articles_total']}，"
+                    f"裁剪 {context_stats['articles_trimmed']} 条，约 {context_stats['context_tokens']} tokens"
+                    f"（原始约 {context_stats['raw_tokens']}，节省 {context_stats['saved_tokens']}）"
+                )
+                total_usage["prompt_tokens_saved"] = context_stats["saved_tokens"]
+                
+                # 记录来源（仅记录实际传给 LLM 的条文）
+                for article in selected_articles:
+                    rag_sources.append({
+                        "law_id": article.get("law_id", ""),
+                        "law_title": article.get("law_title", ""),
+                        "article_num": article.get("article_num", 0),
+                        "article_display": article.get("article_display", ""),
+                    })
                 has_db_results = len(rag_sources) > 0
                 
                 # 第二轮：带检索结果生成回答
@@ -1047,7 +1100,8 @@ async def chat_with_ai(
                 print(f"[AI Service] 知识库是否有结果: {has_db_results}")
                 messages2 = _build_messages_with_context(message, history, tool_result_text, has_results=has_db_results, related_memory=related_memory_context)
                 data2 = await _call_llm(
-                    api_url, api_key, model, messages2, skip_ssl_verify
+                    api_url, api_key, model, messages2, skip_ssl_verify,
+                    **llm_options,
                 )
                 
                 # 累计 token 使用
@@ -1071,6 +1125,8 @@ async def chat_with_ai(
             "sources": rag_sources,
         }
         
+    except LLMQueueFullError:
+        raise
     except httpx.HTTPStatusError as e:
         error_msg = f"AI 服务请求失败: {e.response.status_code}"
         if e.response.status_code == 401:
@@ -1131,7 +1187,10 @@ async def _fallback_chat(
         messages.extend(history)
     messages.append({"role": "user", "content": message})
     
-    data = await _call_llm(api_url, api_key, model, messages, skip_ssl_verify)
+    data = await _call_llm(
+        api_url, api_key, model, messages, skip_ssl_verify,
+        **_llm_call_options(config),
+    )
     
     reply = data.get("choices", [{}])[0].get("message", {}).get("content", "")
     usage = data.get("usage", {})
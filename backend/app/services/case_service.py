@@ -7,6 +7,7 @@ from typing import Optional, List, Dict, Any
 from motor.motor_asyncio import AsyncIOMotorDatabase
 
 from app.db import COLLECTION_CASES, COLLECTION_TRANSCRIPTS
+from app.services.search_terms import case_search_terms, keyword_query, CASE_SEARCH_FIELDS
 
 
 class CaseService:
@@ -33,8 +34,10 @@ class CaseService:
             "created_at": now,
             "updated_at": now,
         }
+        case_doc["search_terms"] = case_search_terms(case_doc)
         await self.cases.insert_one(case_doc)
         case_doc.pop("_id", None)
+        case_doc.pop("search_terms", None)
         return case_doc
 
     async def get_case_list(
@@ -52,18 +55,13 @@ class CaseService:
         if case_type:
             query["case_type"] = case_type
         if keyword:
-            import re
-            safe_kw = re.escape(keyword)
-            query["$or"] = [
-                {"case_name": {"$regex": safe_kw, "$options": "i"}},
-                {"case_number": {"$regex": safe_kw, "$options": "i"}},
-                {"tags": {"$regex": safe_kw, "$options": "i"}},
-            ]
+            # search_terms n-gram 索引取候选 + 正则校验
+            query.update(keyword_query(keyword, CASE_SEARCH_FIELDS))
 
         total = await self.cases.count_documents(query)
         skip = (page - 1) * page_size
 
-        cursor = self.cases.find(query, {"_id": 0}).sort(
+        cursor = self.cases.find(query, {"_id": 0, "search_terms": 0, "cross_analysis_state": 0}).sort(
             [("status", 1), ("updated_at", -1)]
         ).skip(skip).limit(page_size)
 
@@ -80,7 +78,7 @@ class CaseService:
 
     async def get_case_detail(self, case_id: str) -> Optional[dict]:
         """获取案件详情"""
-        case = await self.cases.find_one({"case_id": case_id}, {"_id": 0})
+        case = await self.cases.find_one({"case_id": case_id}, {"_id": 0, "search_terms": 0, "cross_analysis_state": 0})
         if not case:
             return None
 
@@ -139,8 +137,20 @@ class CaseService:
             {"case_id": case_id},
             {"$set": update_fields}
         )
+        if result.matched_count and any(f in update_fields for f in CASE_SEARCH_FIELDS):
+            await self._refresh_search_terms(case_id)
         return result.matched_count > 0
 
+    async def _refresh_search_terms(self, case_id: str):
+        """案件名称/编号/标签变化后重建检索字段"""
+        case = await self.cases.find_one(
+            {"case_id": case_id}, {"_id": 0, **{f: 1 for f in CASE_SEARCH_FIELDS}}
+        )
+        if case:
+            await self.cases.update_one(
+                {"case_id": case_id}, {"$set": {"search_terms": case_search_terms(case)}}
+            )
+
     async def archive_case(self, case_id: str, archive: bool = True) -> bool:
         """归档/取消归档案件"""
         new_status = "archived" if archive else "active"
@@ -0,0 +1,225 @@
+"""
+AI 对话会话服务 - 服务端保存多轮对话，控制传给 LLM 的历史长度
+
+- 每个会话以 session_id 标识，对话轮次保存在 chat_sessions 集合中，客户端每次只需发送新消息
+- 构建历史时只取最近若干轮，并按 token 预算滚动截断（不论对话多长，prompt 大小有上限）
+- 未压缩的轮次过多时，后台将较早的轮次压缩为一段摘要，以系统消息形式带入后续对话
+"""
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+
+from app.services.context_builder import estimate_tokens
+
+
+# 传给 LLM 的对话历史 token 预算（不含会话摘要）
+HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "2000"))
+# 会话摘要的最大字数
+SUMMARY_MAX_CHARS = int(os.getenv("CHAT_SUMMARY_MAX_CHARS", "800"))
+# 未压缩的消息条数达到该值时触发后台压缩
+COMPACT_TRIGGER_TURNS = int(os.getenv("CHAT_COMPACT_TRIGGER_TURNS", "12"))
+# 压缩后保留的最近消息条数（不并入摘要）
+COMPACT_KEEP_RECENT_TURNS = int(os.getenv("CHAT_COMPACT_KEEP_RECENT_TURNS", "6"))
+# 会话文档中最多保存的消息条数（更早的只保留在摘要中）
+MAX_STORED_TURNS = int(os.getenv("CHAT_MAX_STORED_TURNS", "200"))
+# 会话闲置多少天后自动过期
+SESSION_TTL_DAYS = int(os.getenv("CHAT_SESSION_TTL_DAYS", "7"))
+
+COMPACTION_PROMPT = """你是对话摘要助手。请将以下法律咨询对话压缩为一段简明摘要，供后续对话参考。
+要求：
+1. 保留用户的核心问题、案情事实、涉及的人物和关键时间
+2. 保留已经给出的主要结论及引用的法规名称和条号
+3. 不要添加对话中没有的内容
+4. 摘要不超过 {max_chars} 字，直接输出摘要正文"""
+
+
+def window_history(history: Optional[List[Dict[str, str]]], token_budget: int = HISTORY_TOKEN_BUDGET) -> List[Dict[str, str]]:
+    """
+    按 token 预算从最新一轮往前截取对话历史（保持原顺序）。
+    system 消息（会话摘要）原样保留在最前面，不计入预算；
+    单条消息超出剩余预算时停止，避免历史中出现断裂的上下文。
+    """
+    if not history:
+        return []
+    system_messages = [m for m in history if m.get("role") == "system"]
+    turns = [m for m in history if m.get("role") != "system"]
+
+    selected: List[Dict[str, str]] = []
+    used = 0
+    for turn in reversed(turns):
+        content = turn.get("content") or ""
+        tokens = estimate_tokens(content) + 4  # 角色等消息开销
+        if used + tokens > token_budget:
+            break
+        selected.append({"role": turn.get("role", "user"), "content": content})
+        used += tokens
+    selected.reverse()
+    # 历史不以 assistant 回复开头，避免模型看到没有问题的回答
+    while selected and selected[0]["role"] != "user":
+        selected.pop(0)
+    return system_messages + selected
+
+
+def _format_turns(turns: List[Dict[str, Any]]) -> str:
+    lines = []
+    for turn in turns:
+        speaker = "用户" if turn.get("role") == "user" else "助手"
+        lines.append(f"{speaker}：{turn.get('content', '')}")
+    return "\n".join(lines)
+
+
+class ChatSessionService:
+    """对话会话服务"""
+
+    COLLECTION_NAME = "chat_sessions"
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.db = db
+        self.collection = db[self.COLLECTION_NAME]
+
+    async def ensure_indexes(self):
+        """确保索引存在（updated_at 上的 TTL 索引用于清理闲置会话）"""
+        await self.collection.create_index("session_id", unique=True)
+        await self.collection.create_index(
+            "updated_at", expireAfterSeconds=int(timedelta(days=SESSION_TTL_DAYS).total_seconds())
+        )
+
+    @staticmethod
+    def new_session_id() -> str:
+        return uuid.uuid4().hex
+
+    async def get_session(self, session_id: str, max_turns: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """获取会话；max_turns 指定时只加载最近的若干条消息"""
+        projection = {"_id": 0}
+        if max_turns:
+            projection["turns"] = {"$slice": -max_turns}
+        return await self.collection.find_one({"session_id": session_id}, projection)
+
+    async def build_history(self, session_id: str) -> List[Dict[str, str]]:
+        """
+        构建传给 LLM 的历史消息：会话摘要（如有）+ 按 token 预算截取的最近消息。
+        已并入摘要的消息不会重复带入。
+        """
+        session = await self.get_session(session_id, max_turns=COMPACT_TRIGGER_TURNS + COMPACT_KEEP_RECENT_TURNS)
+        if not session:
+            return []
+
+        compacted_seq = session.get("compacted_seq", 0)
+        recent = [
+            {"role": t["role"], "content": t["content"]}
+            for t in session.get("turns", []) if t.get("seq", 0) > compacted_seq
+        ]
+        messages = []
+        summary = session.get("summary")
+        if summary:
+            messages.append({
+                "role": "system",
+                "content": f"以下是本次咨询之前对话的摘要，请结合摘要理解用户的后续问题：\n{summary}",
+            })
+        messages.extend(window_history(recent))
+        return messages
+
+    async def append_turns(self, session_id: str, user_message: str, reply: str) -> Dict[str, Any]:
+        """
+        追加一问一答两条消息，返回 {"turn_count", "pending_turns"}。
+        pending_turns 为尚未压缩的消息条数，调用方据此决定是否调度压缩。
+        """
+        now = datetime.utcnow()
+        session = await self.collection.find_one_and_update(
+            {"session_id": session_id},
+            {
+                "$inc": {"turn_count": 2},
+                "$set": {"updated_at": now},
+                "$setOnInsert": {"created_at": now, "compacted_seq": 0, "summary": ""},
+            },
+            upsert=True,
+            projection={"_id": 0, "turn_count": 1, "compacted_seq": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        turn_count = session["turn_count"]
+        turns = [
+            {"seq": turn_count - 1, "role": "user", "content": user_message, "created_at": now},
+            {"seq": turn_count, "role": "assistant", "content": reply, "created_at": now},
+        ]
+        await self.collection.update_one(
+            {"session_id": session_id},
+            {"$push": {"turns": {"$each": turns, "$sort": {"seq": 1}, "$slice": -MAX_STORED_TURNS}}},
+        )
+        return {
+            "turn_count": turn_count,
+            "pending_turns": turn_count - session.get("compacted_seq", 0),
+        }
+
+    @staticmethod
+    def needs_compaction(pending_turns: int) -> bool:
+        return pending_turns >= COMPACT_TRIGGER_TURNS
+
+    async def compact(self, session_id: str) -> bool:
+        """
+        将较早的未压缩消息与已有摘要合并为新摘要（后台任务调用）。
+        以 compacted_seq 做条件更新，并发压缩时只有一个生效。
+        """
+        from app.services.ai_service import get_ai_config, _call_llm, _llm_call_options, LLM_ANALYSIS_TIMEOUT
+        from app.services.llm_dispatcher import PRIORITY_SESSION_COMPACTION
+
+        session = await self.get_session(session_id, max_turns=MAX_STORED_TURNS)
+        if not session:
+            return False
+        compacted_seq = session.get("compacted_seq", 0)
+        pending = [t for t in session.get("turns", []) if t.get("seq", 0) > compacted_seq]
+        if len(pending) < COMPACT_TRIGGER_TURNS:
+            return False
+
+        to_compact = pending[:-COMPACT_KEEP_RECENT_TURNS] if COMPACT_KEEP_RECENT_TURNS else pending
+        # 保持问答成对：压缩边界落在 assistant 回复之后
+        while to_compact and to_compact[-1].get("role") != "assistant":
+            to_compact.pop()
+        if not to_compact:
+            return False
+
+        content = _format_turns(to_compact)
+        previous_summary = session.get("summary") or ""
+        if previous_summary:
+            content = f"【此前摘要】\n{previous_summary}\n\n【后续对话】\n{content}"
+
+        try:
+            config = await get_ai_config(self.db)
+            data = await _call_llm(
+                config.get("api_url", ""),
+                config.get("api_key", "") or "",
+                config.get("model_name", ""),
+                [
+                    {"role": "system", "content": COMPACTION_PROMPT.format(max_chars=SUMMARY_MAX_CHARS)},
+                    {"role": "user", "content": content},
+                ],
+                config.get("skip_ssl_verify", False),
+                timeout=LLM_ANALYSIS_TIMEOUT,
+                max_tokens=1000,
+                priority=PRIORITY_SESSION_COMPACTION,
+                **_llm_call_options(config),
+            )
+        except Exception as e:
+            print(f"[ChatSession] ⚠️ 会话 {session_id} 摘要压缩失败: {e}")
+            return False
+
+        summary = (data.get("choices", [{}])[0].get("message", {}).get("content") or "").strip()
+        if not summary:
+            return False
+        summary = summary[:SUMMARY_MAX_CHARS]
+
+        new_seq = to_compact[-1]["seq"]
+        result = await self.collection.update_one(
+            {"session_id": session_id, "compacted_seq": compacted_seq},
+            {"$set": {"summary": summary, "compacted_seq": new_seq, "compacted_at": datetime.utcnow()}},
+        )
+        if result.modified_count:
+            print(f"[ChatSession] 🗜️ 会话 {session_id} 已压缩 {len(to_compact)} 条消息")
+        return result.modified_count > 0
+
+    async def delete_session(self, session_id: str) -> bool:
+        result = await self.collection.delete_one({"session_id": session_id})
+        return result.deleted_count > 0
@@ -0,0 +1,211 @@
+"""
+RAG 上下文构建器 - 按 token 预算组装传给 LLM 的法规条文
+
+- 估算每个条文块的 token 数
+- 跨多次工具调用按 (法规, 条号) 去重
+- 按相关度（检索排名 + 命中查询词）排序后填充 token 预算
+- 超长条文只保留包含查询词的句子，而不是简单截取前缀
+"""
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+
+# 默认 RAG 上下文 token 预算
+DEFAULT_CONTEXT_TOKEN_BUDGET = 3000
+# 按剩余预算裁剪条文时的最小保留长度（字符），再短就不如不放
+MIN_TRIMMED_ARTICLE_CHARS = 100
+
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]")
+_SENTENCE_PATTERN = re.compile(r"[^。；;！!？?\n]+[。；;！!？?\n]?")
+_TERM_SPLIT_PATTERN = re.compile(r"[\s,，、;；。:：《》()（）\"'“”‘’]+")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算 token 数：中文字符（含全角标点）按 1 个 token 计，其余按约 4 个字符 1 个 token 计。
+    偏保守，宁可高估也不超出预算。
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    other = len(text) - cjk
+    return cjk + (other + 3) // 4
+
+
+def extract_query_terms(*texts: Optional[str]) -> List[str]:
+    """从用户问题 / 工具参数中提取查询词（长度 ≥ 2，去重保序）"""
+    terms: List[str] = []
+    for text in texts:
+        if not text:
+            continue
+        for term in _TERM_SPLIT_PATTERN.split(str(text)):
+            term = term.strip()
+            if len(term) >= 2 and term not in terms:
+                terms.append(term)
+    return terms
+
+
+def _term_bigrams(terms: List[str]) -> List[str]:
+    grams: List[str] = []
+    for term in terms:
+        if len(term) <= 2:
+            candidates = [term]
+        else:
+            candidates = [term[i:i + 2] for i in range(len(term) - 1)]
+        for gram in candidates:
+            if gram not in grams:
+                grams.append(gram)
+    return grams
+
+
+def _relevance_hits(text: str, terms: List[str], grams: List[str]) -> int:
+    """命中完整查询词计 3 分，命中查询词二元片段计 1 分"""
+    if not text:
+        return 0
+    return sum(3 for t in terms if t in text) + sum(1 for g in grams if g in text)
+
+
+def trim_to_relevant_sentences(content: str, terms: List[str], max_chars: int) -> str:
+    """
+    将超长条文裁剪为包含查询词的句子（保持原顺序，首句保留作为上下文）。
+    没有任何句子命中查询词时退化为前缀截断。
+    """
+    if len(content) <= max_chars:
+        return content
+
+    sentences = [s for s in _SENTENCE_PATTERN.findall(content) if s.strip()]
+    grams = _term_bigrams(terms)
+    scored = [
+        (idx, _relevance_hits(sentence, terms, grams))
+        for idx, sentence in enumerate(sentences)
+    ]
+    if not grams or not any(score for _, score in scored):
+        return content[:max_chars].rstrip() + "..."
+
+    keep = set()
+    used = 0
+    for idx, score in sorted(scored, key=lambda x: (-x[1], x[0])):
+        if score <= 0:
+            break
+        if used + len(sentences[idx]) > max_chars:
+            continue
+        keep.add(idx)
+        used += len(sentences[idx])
+    if not keep:
+        return content[:max_chars].rstrip() + "..."
+    # 预算允许时保留首句（通常是条文主旨）
+    if 0 not in keep and used + len(sentences[0]) <= max_chars:
+        keep.add(0)
+
+    parts = []
+    prev = -1
+    for idx in sorted(keep):
+        if idx != prev + 1:
+            parts.append("……")
+        parts.append(sentences[idx].strip())
+        prev = idx
+    if prev < len(sentences) - 1:
+        parts.append("……")
+    return "".join(parts)
+
+
+class ContextBuilder:
+    """按 token 预算组装多次工具调用的检索结果"""
+
+    def __init__(self, token_budget: int, query_terms: List[str], max_article_chars: int):
+        self.token_budget = token_budget
+        self.query_terms = query_terms
+        self.max_article_chars = max_article_chars
+        self._articles: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._messages: List[str] = []
+        self._seq = 0
+        # 旧实现（每条按 max_article_chars 截取前缀、不去重）发送的上下文 token 数，作为节省量的基准
+        self.raw_tokens = 0
+
+    def add_result(self, result: Dict[str, Any], extra_terms: Optional[List[str]] = None):
+        """加入一次工具调用的检索结果"""
+        articles = result.get("articles", []) if result.get("found") else []
+        if not articles:
+            message = result.get("message", "未检索到相关法规")
+            self._messages.append(message)
+            self.raw_tokens += estimate_tokens(message)
+            return
+
+        terms = list(self.query_terms)
+        for term in extra_terms or []:
+            if term not in terms:
+                terms.append(term)
+        grams = _term_bigrams(terms)
+
+        for rank, article in enumerate(articles):
+            law_title = article.get("law_title", "")
+            article_display = article.get("article_display", "")
+            content = article.get("content", "")
+            baseline = content[:self.max_article_chars]
+            self.raw_tokens += estimate_tokens(f"[{rank + 1}] 《{law_title}》{article_display}：{baseline}")
+
+            key = (article.get("law_id") or law_title, article_display)
+            score = 1.0 / (rank + 1) + _relevance_hits(content, terms, grams)
+            existing = self._articles.get(key)
+            if existing:
+                # 多个工具调用命中同一条文：提高相关度
+                existing["score"] = max(existing["score"], score) + 0.5
+                existing["terms"] = list(dict.fromkeys(existing["terms"] + terms))
+                continue
+            self._articles[key] = {
+                "article": article,
+                "score": score,
+                "terms": terms,
+                "seq": self._seq,
+            }
+            self._seq += 1
+
+    def build(self) -> Tuple[str, List[Dict[str, Any]], Dict[str, int]]:
+        """
+        按相关度填充预算，返回 (上下文文本, 实际入选的条文, 统计信息)
+        """
+        ranked = sorted(self._articles.values(), key=lambda e: (-e["score"], e["seq"]))
+        blocks: List[str] = []
+        selected: List[Dict[str, Any]] = []
+        used_tokens = 0
+        trimmed_count = 0
+
+        for entry in ranked:
+            article = entry["article"]
+            content = article.get("content", "")
+            trimmed = trim_to_relevant_sentences(content, entry["terms"], self.max_article_chars)
+            prefix = f"[{len(blocks) + 1}] 《{article.get('law_title', '')}》{article.get('article_display', '')}："
+            block_tokens = estimate_tokens(prefix + trimmed)
+            remaining = self.token_budget - used_tokens
+            if block_tokens > remaining:
+                # 超出剩余预算：按剩余预算进一步裁剪（中文约 1 字 1 token）；
+                # 剩余太少则跳过，但第一条始终保留，保证至少有一条依据
+                allowed_chars = remaining - estimate_tokens(prefix)
+                if allowed_chars < MIN_TRIMMED_ARTICLE_CHARS:
+                    if blocks:
+                        continue
+                    allowed_chars = MIN_TRIMMED_ARTICLE_CHARS
+                trimmed = trim_to_relevant_sentences(content, entry["terms"], allowed_chars)
+                block_tokens = estimate_tokens(prefix + trimmed)
+            block = prefix + trimmed
+            if trimmed != content:
+                trimmed_count += 1
+            blocks.append(block)
+            selected.append(article)
+            used_tokens += block_tokens
+
+        if not blocks:
+            text = "\n\n".join(self._messages) if self._messages else "未检索到相关法规"
+            used_tokens = estimate_tokens(text)
+        else:
+            text = "\n\n".join(blocks)
+
+        stats = {
+            "raw_tokens": self.raw_tokens,
+            "context_tokens": used_tokens,
+            "saved_tokens": max(self.raw_tokens - used_tokens, 0),
+            "articles_total": len(self._articles),
+            "articles_selected": len(selected),
+            "articles_trimmed": trimmed_count,
+        }
+        return text, selected, stats
@@ -0,0 +1,313 @@
+"""
+笔录文件解析 - 在事件循环之外执行
+
+- .docx / .txt 解析在有界进程池中执行（python-docx 解析大文件是纯 CPU 操作，会阻塞事件循环）
+- .doc 通过 asyncio.create_subprocess_exec 调用 antiword，直接读取落盘的上传文件
+- 同时解析的文件数不超过进程池大小，排队过长时快速拒绝（换班时集中上传不拖慢检索等其他请求）
+- 记录解析耗时、排队等待时间与队列深度，供管理接口查看
+- 解析进程异常退出（如超大文件 OOM）导致进程池损坏时，丢弃旧进程池，下次解析时重建
+- 上传文件分块写入临时文件（超过大小上限立即拒绝）并增量计算 sha256，解析器直接读取文件路径，
+  不在内存中保留完整文件内容
+"""
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+
+from fastapi import UploadFile
+
+
+# 解析进程数
+DOCUMENT_PARSE_WORKERS = int(os.getenv("DOCUMENT_PARSE_WORKERS", "2"))
+# 允许排队等待解析的最大文件数，超过则直接拒绝
+DOCUMENT_PARSE_MAX_QUEUE = int(os.getenv("DOCUMENT_PARSE_MAX_QUEUE", "32"))
+# antiword 解析超时（秒）
+ANTIWORD_TIMEOUT = float(os.getenv("ANTIWORD_TIMEOUT", "30"))
+
+# 上传笔录文件大小上限
+UPLOAD_MAX_BYTES = int(float(os.getenv("TRANSCRIPT_UPLOAD_MAX_MB", "30")) * 1024 * 1024)
+# 上传文件每次读取/写入的块大小
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# OLE2 魔数：旧版 .doc 二进制格式的文件头
+OLE2_MAGIC = b'\xD0\xCF\x11\xE0\xA1\xB1\x1A\xE1'
+
+_DOCUMENT_PARSER = None
+
+
+class ParseRetryableError(RuntimeError):
+    """解析暂时不可用，可稍后重试"""
+
+
+class ParseQueueFullError(ParseRetryableError):
+    """解析队列已满"""
+
+
+class ParserCrashedError(ParseRetryableError):
+    """解析进程异常退出，进程池已重建"""
+
+
+class UploadTooLargeError(RuntimeError):
+    """上传文件超过大小上限"""
+
+
+class _NotDocx(Exception):
+    """内容不是有效的 DOCX，需要回退到 antiword"""
+
+
+def is_ole2(file_bytes: bytes) -> bool:
+    """检测文件是否为 OLE2 格式（旧版 .doc）"""
+    return file_bytes[:8] == OLE2_MAGIC
+
+
+def _read_head(path: str, size: int = 8) -> bytes:
+    with open(path, "rb") as f:
+        return f.read(size)
+
+
+def _remove_file(path: str):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+# ==================== 上传文件落盘 ====================
+
+class SpooledUpload:
+    """已写入临时文件的上传文件"""
+
+    def __init__(self, path: str, file_name: str):
+        self.path = path
+        self.file_name = file_name
+        self.size = 0
+        self.sha256 = ""
+
+
+async def write_upload(file: UploadFile, path: str, max_bytes: int = UPLOAD_MAX_BYTES) -> SpooledUpload:
+    """
+    将上传文件分块写入 path，同时计算 sha256；超过 max_bytes 立即停止并抛出 UploadTooLargeError。
+    """
+    limit_mb = max_bytes / 1024 / 1024
+    # multipart 解析时已知大小的，直接拒绝
+    if file.size is not None and file.size > max_bytes:
+        raise UploadTooLargeError(f"文件大小不能超过 {limit_mb:.0f}MB")
+
+    spooled = SpooledUpload(path, file.filename or "")
+    digest = hashlib.sha256()
+    out = await asyncio.to_thread(open, path, "wb")
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            spooled.size += len(chunk)
+            if spooled.size > max_bytes:
+                raise UploadTooLargeError(f"文件大小不能超过 {limit_mb:.0f}MB")
+            digest.update(chunk)
+            await asyncio.to_thread(out.write, chunk)
+    finally:
+        await asyncio.to_thread(out.close)
+    spooled.sha256 = digest.hexdigest()
+    return spooled
+
+
+@asynccontextmanager
+async def spool_upload(file: UploadFile, max_bytes: int = UPLOAD_MAX_BYTES) -> AsyncIterator[SpooledUpload]:
+    """将上传文件写入临时文件（见 write_upload），退出上下文时删除"""
+    ext = os.path.splitext(file.filename or "")[1]
+    fd, path = await asyncio.to_thread(tempfile.mkstemp, ext, "upload_")
+    os.close(fd)
+    try:
+        yield await write_upload(file, path, max_bytes)
+    finally:
+        await asyncio.to_thread(_remove_file, path)
+
+
+# ==================== 进程池内执行的解析函数 ====================
+
+def _parse_docx_path(path: str) -> str:
+    try:
+        from docx import Document
+    except ImportError:
+        raise RuntimeError("python-docx 未安装，无法解析 DOCX 文件")
+    try:
+        doc = Document(path)
+    except Exception as e:
+        raise _NotDocx(str(e))
+    paragraphs = [p.text for p in doc.paragraphs if p.text.strip()]
+    return "\n".join(paragraphs)
+
+
+def _decode_text_path(path: str) -> str:
+    with open(path, "rb") as f:
+        file_bytes = f.read()
+    for encoding in ["utf-8", "gbk", "gb2312", "utf-16"]:
+        try:
+            return file_bytes.decode(encoding)
+        except (UnicodeDecodeError, Exception):
+            continue
+    raise RuntimeError("无法识别文件编码")
+
+
+class DocumentParser:
+    """有界进程池 + 异步 antiword 的文件解析器"""
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._slots = asyncio.Semaphore(self.workers)
+        self.active = 0
+        self.queued = 0
+        self.stats: Dict[str, Dict[str, float]] = {}
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def _stat(self, ext: str) -> Dict[str, float]:
+        if ext not in self.stats:
+            self.stats[ext] = {
+                "files": 0,
+                "failed": 0,
+                "rejected": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "total_wait_ms": 0.0,
+                "max_wait_ms": 0.0,
+            }
+        return self.stats[ext]
+
+    async def parse(self, path: str, ext: str) -> str:
+        """
+        按扩展名解析文件内容（doc / docx / txt），path 为已落盘的文件路径。
+        解析失败抛出 RuntimeError，排队已满 / 解析进程崩溃抛出 ParseRetryableError（可重试）。
+        """
+        stat = self._stat(ext)
+        if self.queued >= self.max_queue:
+            stat["rejected"] += 1
+            print(f"[DocumentParser] ⛔ 解析排队已满（{self.queued}），拒绝 .{ext} 文件")
+            raise ParseQueueFullError("文件解析繁忙，请稍后重试")
+
+        enqueued_at = time.monotonic()
+        self.queued += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queued -= 1
+        waited_ms = (time.monotonic() - enqueued_at) * 1000
+        self.active += 1
+        started = time.monotonic()
+        try:
+            return await self._parse(path, ext)
+        except Exception:
+            stat["failed"] += 1
+            raise
+        finally:
+            self.active -= 1
+            self._slots.release()
+            elapsed_ms = (time.monotonic() - started) * 1000
+            stat["files"] += 1
+            stat["total_ms"] += elapsed_ms
+            stat["max_ms"] = max(stat["max_ms"], elapsed_ms)
+            stat["total_wait_ms"] += waited_ms
+            stat["max_wait_ms"] = max(stat["max_wait_ms"], waited_ms)
+            if elapsed_ms + waited_ms > 5000:
+                print(f"[DocumentParser] ⏳ .{ext} 文件 {os.path.getsize(path) / 1024:.0f}KB 解析 {elapsed_ms:.0f}ms，排队 {waited_ms:.0f}ms")
+
+    async def _run_in_pool(self, fn, path: str) -> str:
+        """在进程池中执行解析函数；进程池损坏时丢弃（下次调用重建）并抛出可重试的错误"""
+        executor = self._get_executor()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, fn, path)
+        except BrokenProcessPool:
+            # 同一进程池上并发失败的请求只重建一次
+            if self._executor is executor:
+                self._executor = None
+                executor.shutdown(wait=False, cancel_futures=True)
+                print("[DocumentParser] ⚠️ 解析进程异常退出，进程池将重建")
+            raise ParserCrashedError("文件解析进程异常退出，请稍后重试")
+
+    async def _parse(self, path: str, ext: str) -> str:
+        if ext == "txt":
+            return await self._run_in_pool(_decode_text_path, path)
+        if ext == "doc" or is_ole2(await asyncio.to_thread(_read_head, path)):
+            # 检测伪装的 .doc 文件（扩展名是 .docx 但实际是 OLE2 格式）
+            return await self._parse_doc(path)
+        try:
+            return await self._run_in_pool(_parse_docx_path, path)
+        except _NotDocx as e:
+            # 最后兜底：尝试用 antiword 解析
+            try:
+                return await self._parse_doc(path)
+            except Exception:
+                raise RuntimeError(f"DOCX 解析失败: {e}")
+
+    async def _parse_doc(self, path: str) -> str:
+        """解析 DOC（旧版 Word）文件内容，使用 antiword 子进程"""
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                "antiword", path,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+        except FileNotFoundError:
+            raise RuntimeError("antiword 未安装，无法解析 .doc 文件")
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=ANTIWORD_TIMEOUT)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            raise RuntimeError(".doc 文件解析超时")
+        if proc.returncode != 0:
+            raise RuntimeError(f"antiword 解析失败: {stderr.decode('utf-8', errors='replace')}")
+        # antiword 输出可能是 utf-8 或 latin-1
+        text = stdout.decode("utf-8", errors="replace")
+        lines = [line for line in text.splitlines() if line.strip()]
+        return "\n".join(lines)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """解析耗时与队列深度指标"""
+        by_ext = {}
+        for ext, stat in sorted(self.stats.items()):
+            files = stat["files"]
+            by_ext[ext] = {
+                "files": int(files),
+                "failed": int(stat["failed"]),
+                "rejected": int(stat["rejected"]),
+                "avg_ms": round(stat["total_ms"] / files, 1) if files else 0.0,
+                "max_ms": round(stat["max_ms"], 1),
+                "avg_wait_ms": round(stat["total_wait_ms"] / files, 1) if files else 0.0,
+                "max_wait_ms": round(stat["max_wait_ms"], 1),
+            }
+        return {
+            "workers": self.workers,
+            "active": self.active,
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+            "types": by_ext,
+        }
+
+
+def get_document_parser() -> DocumentParser:
+    global _DOCUMENT_PARSER
+    if _DOCUMENT_PARSER is None:
+        _DOCUMENT_PARSER = DocumentParser(DOCUMENT_PARSE_WORKERS, DOCUMENT_PARSE_MAX_QUEUE)
+    return _DOCUMENT_PARSER
+
+
+def shutdown_document_parser():
+    if _DOCUMENT_PARSER is not None:
+        _DOCUMENT_PARSER.shutdown()
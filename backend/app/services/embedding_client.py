@@ -14,12 +14,11 @@ async def get_embedding(text: str) -> Optional[List[float]]:
     result = await get_embeddings([text])
     return result[0] if result else None
 
-async def get_embeddings(texts: List[str], timeout: float = 120.0) -> Optional[List[List[float]]]:
-    """批量获取文本向量（带重试）"""
+async def get_embeddings(texts: List[str], timeout: float = 120.0, max_retries: int = 2) -> Optional[List[List[float]]]:
+    """批量获取文本向量（带重试，max_retries=0 时只请求一次）"""
     if not texts:
         return []
     
-    max_retries = 2
     for attempt in range(max_retries + 1):
         try:
             async with httpx.AsyncClient(timeout=timeout) as client:
@@ -0,0 +1,358 @@
+"""
+持久化任务队列 - 基于 MongoDB jobs 集合
+
+- 笔录分析、交叉分析、法规向量化等耗时任务写入 jobs 集合，由 worker 领取执行
+  （默认运行在 API 进程内；JOB_WORKER_EMBEDDED=false 时由独立进程 python -m app.worker 执行）
+- 领取任务时加租约（lease），执行期间定期续约；worker 崩溃或重启后，租约过期的任务会被重新放回队列
+- 失败自动重试（指数退避），超过最大尝试次数后标记为 failed
+- 同一对象（如同一份笔录）同时只允许一个未完成任务：重复提交合并到排队中的任务；
+  任务已在执行（输入已读取）时标记 rerun_requested，执行结束后按合并后的参数重新排队一次
+- 任务进度写在 progress 字段中，供状态查询接口读取
+"""
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument, ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+
+COLLECTION_JOBS = "jobs"
+
+# 任务类型
+JOB_ANALYZE_TRANSCRIPT = "analyze_transcript"
+JOB_CROSS_ANALYZE = "cross_analyze"
+JOB_VECTORIZE_LAW = "vectorize_law"
+
+# 任务状态
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+# 租约时长（秒），worker 每 LEASE_SECONDS/3 续约一次
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "60"))
+# 默认最大尝试次数
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# 重试退避基数（秒）：第 n 次失败后等待 base * 2^(n-1)
+JOB_RETRY_BACKOFF = float(os.getenv("JOB_RETRY_BACKOFF", "10"))
+# 已完成任务保留天数
+JOB_RETENTION_DAYS = int(os.getenv("JOB_RETENTION_DAYS", "30"))
+
+
+# 重新排队时（失败重试 / 租约过期回收）把 rerun_upgrade 合并进 payload 并清除重跑标记：重试会重新读取输入
+FOLD_RERUN_STAGES = [
+    {"$set": {"payload": {"$mergeObjects": ["$payload", {"$ifNull": ["$rerun_upgrade", {}]}]}}},
+    {"$unset": ["rerun_requested", "rerun_upgrade"]},
+]
+
+
+def job_key(job_type: str, target_id: str) -> str:
+    """任务去重键：同一类型 + 同一对象"""
+    return f"{job_type}:{target_id}"
+
+
+class JobQueue:
+    """MongoDB 任务队列"""
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.db = db
+        self.jobs = db[COLLECTION_JOBS]
+
+    async def ensure_indexes(self):
+        """确保索引存在"""
+        await self.jobs.create_index("job_id", unique=True)
+        await self.jobs.create_index([("status", ASCENDING), ("type", ASCENDING), ("available_at", ASCENDING)])
+        await self.jobs.create_index([("dedupe_key", ASCENDING), ("created_at", DESCENDING)])
+        # 同一去重键只允许一个未完成任务
+        await self.jobs.create_index(
+            "dedupe_key",
+            name="dedupe_key_active",
+            unique=True,
+            partialFilterExpression={"active": True},
+        )
+        # 已完成任务定期清理
+        await self.jobs.create_index(
+            "finished_at", expireAfterSeconds=int(timedelta(days=JOB_RETENTION_DAYS).total_seconds())
+        )
+
+    # ==================== 提交 / 查询 ====================
+
+    def _new_job(
+        self, job_type: str, payload: Dict[str, Any], dedupe_key: Optional[str], max_attempts: int
+    ) -> Dict[str, Any]:
+        now = datetime.utcnow()
+        return {
+            "job_id": str(uuid.uuid4()),
+            "type": job_type,
+            "payload": payload,
+            "dedupe_key": dedupe_key or f"{job_type}:{uuid.uuid4()}",
+            "status": JOB_QUEUED,
+            "active": True,
+            "attempts": 0,
+            "max_attempts": max_attempts,
+            "progress": {},
+            "result": None,
+            "error": None,
+            "worker_id": None,
+            "lease_until": None,
+            "available_at": now,
+            "created_at": now,
+            "updated_at": now,
+            "started_at": None,
+            "finished_at": None,
+        }
+
+    async def enqueue(
+        self,
+        job_type: str,
+        payload: Dict[str, Any],
+        dedupe_key: Optional[str] = None,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+        upgrade: Optional[Dict[str, Any]] = None,
+        rerun_if_running: bool = True,
+    ) -> Dict[str, Any]:
+        """
+        提交任务。dedupe_key 相同且尚未完成的任务已存在时返回已有任务：
+        - 排队中：upgrade 中的字段（如 {"full": True}）合并到其 payload，避免新提交的要求被去重吞掉
+        - 执行中：其输入已在领取时读取，标记 rerun_requested（upgrade 记入 rerun_upgrade），
+          结束后重新排队一次；rerun_if_running=False 时（如启动时补交遗留任务）不标记
+        """
+        doc = self._new_job(job_type, payload, dedupe_key, max_attempts)
+        try:
+            await self.jobs.insert_one(doc)
+        except DuplicateKeyError:
+            now = datetime.utcnow()
+            upgrade = upgrade or {}
+            query = {"dedupe_key": doc["dedupe_key"], "active": True}
+            existing = await self.jobs.find_one_and_update(
+                {**query, "status": JOB_QUEUED},
+                {"$set": {**{f"payload.{k}": v for k, v in upgrade.items()}, "updated_at": now}},
+                projection={"_id": 0},
+                return_document=ReturnDocument.AFTER,
+            )
+            if existing is None and rerun_if_running:
+                existing = await self.jobs.find_one_and_update(
+                    {**query, "status": JOB_RUNNING},
+                    {"$set": {
+                        "rerun_requested": True,
+                        **{f"rerun_upgrade.{k}": v for k, v in upgrade.items()},
+                        "updated_at": now,
+                    }},
+                    projection={"_id": 0},
+                    return_document=ReturnDocument.AFTER,
+                )
+            elif existing is None:
+                existing = await self.jobs.find_one(query, {"_id": 0})
+            if existing:
+                return existing
+            # 已有任务恰好在此期间完成：重新提交
+            return await self.enqueue(job_type, payload, dedupe_key, max_attempts, upgrade, rerun_if_running)
+        doc.pop("_id", None)
+        return doc
+
+    async def enqueue_many(
+        self,
+        job_type: str,
+        jobs: List[Tuple[Dict[str, Any], Optional[str]]],
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+    ) -> List[Dict[str, Any]]:
+        """
+        批量提交任务（一次 insert_many），jobs 为 [(payload, dedupe_key)]，返回与之等长的任务列表。
+        与未完成任务重复的，返回已有任务。
+        """
+        docs = [self._new_job(job_type, payload, key, max_attempts) for payload, key in jobs]
+        if not docs:
+            return []
+        duplicated = set()
+        try:
+            await self.jobs.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                if error.get("code") != 11000:
+                    raise
+                duplicated.add(error["index"])
+        result = []
+        for index, doc in enumerate(docs):
+            if index in duplicated:
+                doc = await self.enqueue(job_type, doc["payload"], doc["dedupe_key"], max_attempts)
+            doc.pop("_id", None)
+            result.append(doc)
+        return result
+
+    async def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await self.jobs.find_one({"job_id": job_id}, {"_id": 0})
+
+    async def latest_job(self, dedupe_key: str) -> Optional[Dict[str, Any]]:
+        """某对象最近一次任务（未完成的优先）"""
+        active = await self.jobs.find_one({"dedupe_key": dedupe_key, "active": True}, {"_id": 0})
+        if active:
+            return active
+        return await self.jobs.find_one({"dedupe_key": dedupe_key}, {"_id": 0}, sort=[("created_at", DESCENDING)])
+
+    # ==================== worker 侧 ====================
+
+    async def claim(self, job_types: List[str], worker_id: str, lease_seconds: int = JOB_LEASE_SECONDS) -> Optional[Dict[str, Any]]:
+        """领取一个可执行的任务（原子操作），并加租约"""
+        now = datetime.utcnow()
+        return await self.jobs.find_one_and_update(
+            {"status": JOB_QUEUED, "type": {"$in": job_types}, "available_at": {"$lte": now}},
+            {
+                "$set": {
+                    "status": JOB_RUNNING,
+                    "worker_id": worker_id,
+                    "lease_until": now + timedelta(seconds=lease_seconds),
+                    "started_at": now,
+                    "updated_at": now,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("available_at", ASCENDING)],
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def heartbeat(self, job_id: str, worker_id: str, lease_seconds: int = JOB_LEASE_SECONDS) -> bool:
+        """续约；返回 False 表示任务已不属于该 worker（租约过期被回收）"""
+        now = datetime.utcnow()
+        result = await self.jobs.update_one(
+            {"job_id": job_id, "worker_id": worker_id, "status": JOB_RUNNING},
+            {"$set": {"lease_until": now + timedelta(seconds=lease_seconds), "updated_at": now}},
+        )
+        return result.matched_count > 0
+
+    async def report_progress(self, job_id: str, progress: Dict[str, Any]):
+        """更新任务进度"""
+        await self.jobs.update_one(
+            {"job_id": job_id},
+            {"$set": {"progress": progress, "updated_at": datetime.utcnow()}},
+        )
+
+    async def _enqueue_rerun(self, job: Optional[Dict[str, Any]]):
+        """任务执行期间有新的提交（rerun_requested）：结束后按合并后的参数重新排队"""
+        if not job or not job.get("rerun_requested"):
+            return
+        payload = {**(job.get("payload") or {}), **(job.get("rerun_upgrade") or {})}
+        await self.enqueue(job["type"], payload, job["dedupe_key"], job.get("max_attempts", JOB_MAX_ATTEMPTS))
+
+    async def complete(self, job_id: str, worker_id: str, result: Any = None):
+        now = datetime.utcnow()
+        job = await self.jobs.find_one_and_update(
+            {"job_id": job_id, "worker_id": worker_id},
+            {"$set": {
+                "status": JOB_SUCCEEDED,
+                "active": False,
+                "result": result,
+                "error": None,
+                "lease_until": None,
+                "finished_at": now,
+                "updated_at": now,
+            }},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+        await self._enqueue_rerun(job)
+
+    async def fail(self, job: Dict[str, Any], worker_id: str, error: str) -> bool:
+        """
+        记录任务失败。未超过最大尝试次数时按指数退避重新排队。
+        返回 True 表示任务已最终失败（不再重试）。
+        """
+        now = datetime.utcnow()
+        attempts = job.get("attempts", 1)
+        final = attempts >= job.get("max_attempts", JOB_MAX_ATTEMPTS)
+        if final:
+            update = {
+                "status": JOB_FAILED,
+                "active": False,
+                "finished_at": now,
+            }
+        else:
+            delay = JOB_RETRY_BACKOFF * (2 ** (attempts - 1))
+            update = {
+                "status": JOB_QUEUED,
+                "available_at": now + timedelta(seconds=delay),
+                "worker_id": None,
+            }
+        update.update({"error": error, "lease_until": None, "updated_at": now})
+        pipeline = [{"$set": {k: {"$literal": v} for k, v in update.items()}}]
+        if not final:
+            pipeline += FOLD_RERUN_STAGES
+        updated = await self.jobs.find_one_and_update(
+            {"job_id": job["job_id"], "worker_id": worker_id},
+            pipeline,
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+        if final:
+            await self._enqueue_rerun(updated)
+        return final
+
+    async def recover_stale(self) -> List[Dict[str, Any]]:
+        """
+        回收租约已过期的任务（worker 崩溃 / 重启）：
+        未超过最大尝试次数的重新排队，否则标记为 failed。返回最终失败的任务列表。
+        """
+        now = datetime.utcnow()
+        stale = {"status": JOB_RUNNING, "lease_until": {"$lt": now}}
+        exhausted = {**stale, "$expr": {"$gte": ["$attempts", "$max_attempts"]}}
+
+        failed_jobs = await self.jobs.find(exhausted, {"_id": 0}).to_list(length=None)
+        if failed_jobs:
+            await self.jobs.update_many(
+                {"job_id": {"$in": [j["job_id"] for j in failed_jobs]}, "status": JOB_RUNNING},
+                {"$set": {
+                    "status": JOB_FAILED,
+                    "active": False,
+                    "error": "任务执行超时（worker 租约过期）",
+                    "lease_until": None,
+                    "finished_at": now,
+                    "updated_at": now,
+                }},
+            )
+            for job in failed_jobs:
+                await self._enqueue_rerun(job)
+        result = await self.jobs.update_many(
+            stale,
+            [{"$set": {
+                "status": JOB_QUEUED,
+                "worker_id": None,
+                "lease_until": None,
+                "available_at": {"$literal": now},
+                "error": "worker 租约过期，重新排队",
+                "updated_at": {"$literal": now},
+            }}] + FOLD_RERUN_STAGES,
+        )
+        if result.modified_count or failed_jobs:
+            print(f"[JobQueue] ♻️ 回收过期租约：重新排队 {result.modified_count} 个，最终失败 {len(failed_jobs)} 个")
+        return failed_jobs
+
+    async def get_stats(self) -> Dict[str, Any]:
+        """按类型、状态统计未完成任务"""
+        rows = await self.jobs.aggregate([
+            {"$match": {"active": True}},
+            {"$group": {"_id": {"type": "$type", "status": "$status"}, "count": {"$sum": 1}}},
+        ]).to_list(length=None)
+        stats: Dict[str, Dict[str, int]] = {}
+        for row in rows:
+            stats.setdefault(row["_id"]["type"], {})[row["_id"]["status"]] = row["count"]
+        return stats
+
+
+def job_summary(job: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """状态接口返回的任务信息"""
+    if not job:
+        return None
+    return {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "progress": job.get("progress") or {},
+        "attempts": job.get("attempts", 0),
+        "max_attempts": job.get("max_attempts", JOB_MAX_ATTEMPTS),
+        "error": job.get("error"),
+        "created_at": job.get("created_at"),
+        "started_at": job.get("started_at"),
+        "finished_at": job.get("finished_at"),
+    }
@@ -6,17 +6,19 @@ from typing import Any, Dict, List, Tuple
 from motor.motor_asyncio import AsyncIOMotorDatabase
 
 from app.services.law_service import LawService
+from app.services.law_citation_resolver import LawCitationResolver
 
 
 class KnowledgeBaseService:
     def __init__(self, db: AsyncIOMotorDatabase):
         self.db = db
         self.law_service = LawService(db)
+        self.citation_resolver = LawCitationResolver(db)
 
     async def retrieve(self, query: str, top_k: int = 6) -> Dict[str, Any]:
         items = await self.law_service.search_for_rag(query, top_k=top_k)
         context, sources = self._build_context(items, max_chars=2000, max_item_chars=600)
-        direct_answer = self._build_direct_answer(query, items)
+        direct_answer = await self._build_direct_answer(query)
         return {
             "items": items,
             "context": context,
@@ -71,11 +73,9 @@ class KnowledgeBaseService:
         context = "\n".join(f"[{idx + 1}] {text}" for idx, text in enumerate(blocks))
         return context, sources
 
-    def _build_direct_answer(self, query: str, items: List[Dict[str, Any]]) -> str:
-        if not items:
-            return ""
-
-        article_num = self.law_service.parse_article_input(query)
+    async def _build_direct_answer(self, query: str) -> str:
+        """问题明确指向某部法律的某一条时，按引用直接取回条文原文"""
+        article_num, sub_index = self.law_service.parse_article_input(query)
         if not article_num:
             return ""
 
@@ -83,25 +83,16 @@ class KnowledgeBaseService:
         if not law_keyword:
             return ""
 
-        matched = None
-        for item in items:
-            if item.get("article_num") != article_num:
-                continue
-            law_title = item.get("law_title") or ""
-            if law_keyword and law_keyword not in law_title and law_title not in law_keyword:
-                continue
-            matched = item
-            break
-
-        if not matched:
+        article_display = f"第{article_num}条{sub_index or ''}"
+        resolved = await self.citation_resolver.resolve(
+            [{"law_title": law_keyword, "article_display": article_display}]
+        )
+        law, article = resolved[0]["law"], resolved[0]["article"]
+        if not law or not article:
             return ""
 
-        law_title = matched.get("law_title") or ""
-        article_display = matched.get("article_display") or ""
-        if not article_display and article_num is not None:
-            article_display = f"第{article_num}条"
-        content = (matched.get("content") or "").strip()
+        content = (article.get("content") or "").strip()
         if not content:
             return ""
 
-        return f"《{law_title}》{article_display}：{content}"
+        return f"《{law['title']}》{article['article_display']}：{content}"
@@ -0,0 +1,226 @@
+"""
+法条引用批量解析 - 常驻内存的法规名称索引 + 单次查询取条文
+
+- 法规名称索引：laws 集合的 law_id / title / category 常驻内存，按规范化名称（去前缀、去年份括号）建索引，
+  别名（data/law_aliases.json）、全称/简称、包含关系都在内存中解析，不再对 laws.title 逐条做正则查询
+- 一批引用（法规名称 + 条号）先在内存中解析出 law_id，再用一次 $or/$in 查询取回全部条文
+- 法规增删后递增 settings 中的版本号，各 worker 据此重新加载；另按 LAW_TITLE_INDEX_MAX_AGE 定期重载，
+  覆盖爬虫脚本直接写库的情况
+"""
+import asyncio
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from app.services.law_service import LawService, _normalize_law_name, _resolve_law_alias
+
+
+# settings 中记录法规名称索引版本号的 key
+LAW_TITLE_INDEX_VERSION_KEY = "law_title_index"
+# 索引最长使用时间（秒），超过后重新加载
+LAW_TITLE_INDEX_MAX_AGE = float(os.getenv("LAW_TITLE_INDEX_MAX_AGE", "600"))
+
+_YEAR_PATTERN = re.compile(r'[（\(](\d{4})年?[修订正]*[）\)]')
+_ARTICLE_PATTERN = re.compile(r'第([零一二三四五六七八九十百千\d]+)条(之[零一二三四五六七八九十]+)?')
+
+_LAW_TITLE_INDEX = None
+
+
+def law_year(title: str) -> int:
+    """从法律标题中提取年份，如（2018年修正）、（2025年修订）、（2020年）"""
+    match = _YEAR_PATTERN.search(title or "")
+    return int(match.group(1)) if match else 0
+
+
+def law_base_name(title: str) -> str:
+    """提取法律基础名称（去掉年份部分）"""
+    return _YEAR_PATTERN.sub('', title or '').strip()
+
+
+def _index_name(title: str) -> str:
+    """索引用规范化名称：去年份括号、去书名号与标点、去"中华人民共和国"等前缀"""
+    return _normalize_law_name(law_base_name(re.sub(r'[《》]', '', title or '')))
+
+
+class LawTitleIndex:
+    """常驻内存的法规名称索引"""
+
+    def __init__(self):
+        self._laws: Dict[str, Dict[str, Any]] = {}
+        # 规范化名称 -> law_id 列表（同一法律的多个版本）
+        self._by_name: Dict[str, List[str]] = {}
+        self._loaded_at = 0.0
+        self._loaded = False
+        self._stale = False
+        self._version = -1
+        self._local_update = False
+        self._lock = asyncio.Lock()
+
+    # ==================== 加载与同步 ====================
+
+    def on_settings_change(self, key: str, doc: Optional[dict]):
+        """配置缓存回调：其他 worker 增删了法规时标记索引过期"""
+        if key != LAW_TITLE_INDEX_VERSION_KEY or self._local_update:
+            return
+        if self._loaded and (doc or {}).get("version", 0) != self._version:
+            self._stale = True
+
+    async def ensure_loaded(self, db: AsyncIOMotorDatabase):
+        expired = time.monotonic() - self._loaded_at > LAW_TITLE_INDEX_MAX_AGE
+        if self._loaded and not self._stale and not expired:
+            return
+        async with self._lock:
+            expired = time.monotonic() - self._loaded_at > LAW_TITLE_INDEX_MAX_AGE
+            if self._loaded and not self._stale and not expired:
+                return
+            await self._load(db)
+
+    async def _load(self, db: AsyncIOMotorDatabase):
+        from app.services.settings_cache import get_settings_cache
+
+        started = time.monotonic()
+        version = get_settings_cache().get_version(LAW_TITLE_INDEX_VERSION_KEY)
+        laws: Dict[str, Dict[str, Any]] = {}
+        by_name: Dict[str, List[str]] = {}
+        cursor = db.laws.find({}, {"_id": 0, "law_id": 1, "title": 1, "category": 1, "level": 1})
+        async for law in cursor:
+            if not law.get("law_id") or not law.get("title"):
+                continue
+            laws[law["law_id"]] = law
+            name = _index_name(law["title"])
+            if name:
+                by_name.setdefault(name, []).append(law["law_id"])
+        self._laws, self._by_name = laws, by_name
+        self._version = version
+        self._loaded = True
+        self._stale = False
+        self._loaded_at = time.monotonic()
+        print(f"[LawTitleIndex] ✅ 已加载 {len(laws)} 部法规名称索引，耗时 {(time.monotonic() - started) * 1000:.0f}ms")
+
+    async def mark_changed(self, db: AsyncIOMotorDatabase):
+        """本进程增删法规后递增版本号（其他 worker 据此重新加载），本进程下次查询时重新加载"""
+        from app.services.settings_cache import get_settings_cache
+
+        self._stale = True
+        self._local_update = True
+        try:
+            await get_settings_cache().update(db, LAW_TITLE_INDEX_VERSION_KEY, {"updated_at": time.time()})
+        except Exception as e:
+            print(f"[LawTitleIndex] ⚠️ 更新法规索引版本号失败: {e}")
+        finally:
+            self._local_update = False
+
+    # ==================== 查询 ====================
+
+    def _latest(self, law_ids: List[str]) -> Optional[Dict[str, Any]]:
+        laws = [self._laws[i] for i in law_ids if i in self._laws]
+        if not laws:
+            return None
+        return max(laws, key=lambda law: law_year(law["title"]))
+
+    def resolve_title(self, title: str) -> Optional[Dict[str, Any]]:
+        """
+        将引用中的法规名称解析为一部法规（同名多版本取最新版本）：
+        1. 规范化名称或别名精确命中
+        2. 库中名称包含引用名称（引用为简称），取名称最短的
+        """
+        names = []
+        for name in (_index_name(title), _index_name(_resolve_law_alias(title))):
+            if name and name not in names:
+                names.append(name)
+        if not names:
+            return None
+
+        for name in names:
+            if name in self._by_name:
+                return self._latest(self._by_name[name])
+
+        for name in names:
+            contains = [n for n in self._by_name if name in n]
+            if contains:
+                return self._latest(self._by_name[min(contains, key=len)])
+        return None
+
+    def find_laws(self, keyword: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """名称包含关键词（规范化后）的法规，精确命中的排在前面"""
+        name = _index_name(keyword)
+        if not name:
+            return []
+        exact = self._by_name.get(name, [])
+        partial = [i for n, ids in self._by_name.items() if name in n and n != name for i in ids]
+        return [self._laws[i] for i in (exact + partial)[:limit]]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"laws": len(self._laws), "names": len(self._by_name), "loaded": self._loaded}
+
+
+def get_law_title_index() -> LawTitleIndex:
+    global _LAW_TITLE_INDEX
+    if _LAW_TITLE_INDEX is None:
+        from app.services.settings_cache import get_settings_cache
+        _LAW_TITLE_INDEX = LawTitleIndex()
+        get_settings_cache().add_listener(_LAW_TITLE_INDEX.on_settings_change)
+    return _LAW_TITLE_INDEX
+
+
+class LawCitationResolver:
+    """批量解析 (法规名称, 条号) 引用"""
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.db = db
+        self.law_service = LawService(db)
+        self.index = get_law_title_index()
+
+    def canonical_article_display(self, article_display: str) -> Optional[str]:
+        """将条号统一为库中 article_display 的写法，如 "第264条"、"第二百六十四条第一款" → "第二百六十四条" """
+        match = _ARTICLE_PATTERN.search(article_display or "")
+        if not match:
+            return None
+        number, sub_index = match.group(1), match.group(2) or ""
+        if number.isdigit():
+            number = self.law_service._arabic_to_chinese(int(number))
+        return f"第{number}条{sub_index}"
+
+    async def resolve_laws(self, titles: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """批量解析法规名称（纯内存）"""
+        await self.index.ensure_loaded(self.db)
+        return [self.index.resolve_title(t) if t else None for t in titles]
+
+    async def fetch_articles(self, pairs: List[Tuple[str, str]]) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        """用一次 $or/$in 查询取回多个 (law_id, article_display) 对应的条文"""
+        by_law: Dict[str, set] = {}
+        for law_id, display in pairs:
+            if law_id and display:
+                by_law.setdefault(law_id, set()).add(display)
+        if not by_law:
+            return {}
+        query = {"$or": [
+            {"law_id": law_id, "article_display": {"$in": sorted(displays)}}
+            for law_id, displays in by_law.items()
+        ]}
+        cursor = self.db.law_articles.find(
+            query, {"_id": 0, "law_id": 1, "article_num": 1, "article_display": 1, "content": 1}
+        )
+        articles: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        async for article in cursor:
+            articles.setdefault((article["law_id"], article["article_display"].strip()), article)
+        return articles
+
+    async def resolve(self, citations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        批量解析引用，citations 为 [{"law_title": ..., "article_display": ...}]。
+        返回等长列表 [{"law": 法规或 None, "article": 条文或 None}]。
+        """
+        laws = await self.resolve_laws([(c.get("law_title") or "").strip() for c in citations])
+        keys: List[Optional[Tuple[str, str]]] = []
+        for citation, law in zip(citations, laws):
+            display = self.canonical_article_display(citation.get("article_display") or "")
+            keys.append((law["law_id"], display) if law and display else None)
+        articles = await self.fetch_articles([k for k in keys if k])
+        return [
+            {"law": law, "article": articles.get(key) if key else None}
+            for law, key in zip(laws, keys)
+        ]
@@ -9,10 +9,23 @@ from pathlib import Path
 import json
 from app.services.search_engine import get_search_engine
 from app.services import embedding_client
+from app.services.view_stats import (
+    get_view_stats,
+    COLLECTION_VIEW_COUNTERS,
+    COLLECTION_LAW_VIEW_COUNTS,
+    TOTAL_COUNTER_ID,
+)
 import hashlib
 import re
 import math
 
+from pymongo import DeleteOne, InsertOne, UpdateOne
+
+
+def _article_content_hash(content: str) -> str:
+    """条文内容指纹（内容变化才需要重新向量化）"""
+    return hashlib.sha256((content or "").strip().encode("utf-8")).hexdigest()
+
 
 # 法律权重配置（权重越大排序越靠前）
 LAW_WEIGHT_CONFIG = {
@@ -154,40 +167,90 @@ class LawService:
             {"law_id": law_id}, law_data, upsert=True
         )
         
-        # 3. 准备条文数据
-        # 先删除旧条文
-        await self.articles_collection.delete_many({"law_id": law_id})
-        
-        article_docs = []
+        # 3. 条文按 article_num 与库中已有条文比对，只写入变化部分（一次 bulk_write）
+        #    内容未变的条文保留 embedding；新增/内容变化的条文没有 embedding，由向量化任务补齐
+        existing = {}
+        cursor = self.articles_collection.find(
+            {"law_id": law_id},
+            {"_id": 1, "article_num": 1, "article_display": 1, "content": 1, "content_hash": 1,
+             "chapter": 1, "section": 1, "has_embedding": {"$ne": [{"$type": "$embedding"}, "missing"]}}
+        )
+        async for doc in cursor:
+            existing[doc["article_num"]] = doc
+
+        ops = []
+        stats = {"inserted": 0, "updated": 0, "unchanged": 0, "deleted": 0}
+        seen = set()
         for art in law_in.articles:
-            art_doc = {
-                "law_id": law_id,
-                "article_num": art["article_num"],
+            article_num = art["article_num"]
+            if article_num in seen:
+                continue
+            seen.add(article_num)
+            content_hash = _article_content_hash(art["content"])
+            fields = {
                 "article_display": art["article_display"],
                 "content": art["content"],
+                "content_hash": content_hash,
                 "chapter": art.get("chapter", ""),
                 "section": art.get("section", ""),
-                "keywords": [] # TODO: 提取关键词
             }
-            article_docs.append(art_doc)
-            
-        if article_docs:
-            # 先入库，不等向量化（向量化由后台任务异步完成）
-            await self.articles_collection.insert_many(article_docs)
-            
-        return {"law_id": law_id, "article_count": len(article_docs), "message": f"成功导入 {len(article_docs)} 条条文"}
+            old = existing.get(article_num)
+            if old is None:
+                ops.append(InsertOne({
+                    "law_id": law_id,
+                    "article_num": article_num,
+                    **fields,
+                    "keywords": [],  # TODO: 提取关键词
+                }))
+                stats["inserted"] += 1
+            elif (old.get("content_hash") or _article_content_hash(old.get("content", ""))) != content_hash:
+                ops.append(UpdateOne({"_id": old["_id"]}, {"$set": fields, "$unset": {"embedding": ""}}))
+                stats["updated"] += 1
+            elif any(old.get(k, "") != v for k, v in fields.items()):
+                # 仅章节、条号写法等变化（或旧数据缺少 content_hash）：保留 embedding
+                ops.append(UpdateOne({"_id": old["_id"]}, {"$set": fields}))
+                stats["unchanged"] += 1
+            else:
+                stats["unchanged"] += 1
+        for article_num, old in existing.items():
+            if article_num not in seen:
+                ops.append(DeleteOne({"_id": old["_id"]}))
+                stats["deleted"] += 1
+
+        if ops:
+            await self.articles_collection.bulk_write(ops, ordered=False)
+
+        # 新增或内容变化的条文，以及此前未完成向量化的条文
+        needs_vectorize = stats["inserted"] + stats["updated"] > 0 or any(
+            not old.get("has_embedding") for num, old in existing.items() if num in seen
+        )
+        article_count = len(seen)
+        print(
+            f"[LawService] 📥 导入法规 {law_in.title}: 新增 {stats['inserted']}，更新 {stats['updated']}，"
+            f"未变 {stats['unchanged']}，删除 {stats['deleted']}"
+        )
 
-    async def vectorize_law_articles(self, law_id: str) -> Dict[str, Any]:
+        await self._mark_law_titles_changed()
+        return {
+            "law_id": law_id,
+            "article_count": article_count,
+            **stats,
+            "needs_vectorize": needs_vectorize,
+            "message": f"成功导入 {article_count} 条条文（新增 {stats['inserted']}，更新 {stats['updated']}，删除 {stats['deleted']}）",
+        }
+
+    async def vectorize_law_articles(self, law_id: str, progress=None) -> Dict[str, Any]:
         """
-        为指定法规的条文异步生成向量（后台任务调用）
-        分批处理，每批10条，带重试
+        为指定法规的条文生成向量（由任务队列 worker 执行）
+        分批处理，每批10条，带重试；progress 回调用于上报进度
+        向量服务不可用时抛出异常，由任务队列稍后重试
         """
         BATCH_SIZE = 10
         
         # 检查向量服务是否可用
         if not await embedding_client.check_health():
-            print(f"[LawService] ⚠️ 向量服务不可用，跳过 {law_id} 的向量化")
-            return {"law_id": law_id, "status": "skipped", "reason": "向量服务不可用"}
+            print(f"[LawService] ⚠️ 向量服务不可用，{law_id} 的向量化稍后重试")
+            raise RuntimeError("向量服务不可用")
         
         # 查询该法规下未向量化的条文
         cursor = self.articles_collection.find(
@@ -224,6 +287,8 @@ class LawService:
             except Exception as e:
                 failed += len(batch)
                 print(f"[LawService] ⚠️ 批次 {batch_start // BATCH_SIZE + 1} 异常: {e}")
+            if progress:
+                await progress({"total": total, "vectorized": vectorized, "failed": failed})
         
         status = "done" if failed == 0 else ("partial" if vectorized > 0 else "failed")
         msg = f"[LawService] {'✅' if status == 'done' else '⚠️'} 后台向量化完成 {law_id}: 成功 {vectorized}/{total}"
@@ -311,6 +376,8 @@ class LawService:
             {"law_id": law_id},
             {"$set": filtered_data}
         )
+        if "category" in filtered_data and result.modified_count:
+            await self._mark_law_titles_changed()
         return result.matched_count > 0
 
     async def delete_law(self, law_id: str) -> bool:
@@ -326,8 +393,14 @@ class LawService:
         await self.articles_collection.delete_many({"law_id": law_id})
         # 删除法规主记录
         await self.laws_collection.delete_one({"law_id": law_id})
+        await self._mark_law_titles_changed()
         return True
 
+    async def _mark_law_titles_changed(self):
+        """法规增删后通知各 worker 重新加载法规名称索引"""
+        from app.services.law_citation_resolver import get_law_title_index
+        await get_law_title_index().mark_changed(self.db)
+
     async def get_law_articles(
         self, law_id: str, chapter: Optional[str] = None
     ) -> List[Dict[str, Any]]:
@@ -1014,23 +1087,44 @@ class LawService:
         return sorted(levels)
 
     async def record_view(self, law_id: str) -> bool:
-        """记录一次法规浏览"""
-        doc = {
-            "law_id": law_id,
-            "viewed_at": datetime.utcnow()
-        }
-        await self.view_logs_collection.insert_one(doc)
+        """记录一次法规浏览（内存缓冲，批量写库）"""
+        get_view_stats().record(law_id)
         return True
 
     async def get_today_views(self) -> int:
-        """获取今日浏览总数"""
-        # 获取今天 UTC 0点
-        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-        count = await self.view_logs_collection.count_documents({
-            "viewed_at": {"$gte": today}
-        })
-        return count
+        """获取今日浏览总数（UTC 日期，读取预聚合的每日计数）"""
+        today = datetime.utcnow().strftime("%Y-%m-%d")
+        doc = await self.db[COLLECTION_VIEW_COUNTERS].find_one({"_id": f"day:{today}"})
+        return (doc or {}).get("views", 0) + get_view_stats().pending_counts()["today"]
 
     async def get_total_views(self) -> int:
         """Get total view count."""
-        return await self.view_logs_collection.count_documents({})
+        doc = await self.db[COLLECTION_VIEW_COUNTERS].find_one({"_id": TOTAL_COUNTER_ID})
+        return (doc or {}).get("views", 0) + get_view_stats().pending_counts()["total"]
+
+    async def get_most_viewed_laws(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """获取浏览量最高的法规（读取每部法规的预聚合计数）"""
+        pending = get_view_stats().pending_counts()["by_law"]
+        counts = await self.db[COLLECTION_LAW_VIEW_COUNTS].find(
+            {}, {"_id": 0, "law_id": 1, "views": 1, "last_viewed_at": 1}
+        ).sort("views", -1).limit(limit + len(pending)).to_list(length=limit + len(pending))
+
+        merged = {c["law_id"]: c for c in counts}
+        for law_id, n in pending.items():
+            entry = merged.setdefault(law_id, {"law_id": law_id, "views": 0, "last_viewed_at": None})
+            entry["views"] += n
+        ranked = sorted(merged.values(), key=lambda c: c["views"], reverse=True)[:limit]
+
+        law_docs = await self.laws_collection.find(
+            {"law_id": {"$in": [c["law_id"] for c in ranked]}},
+            {"_id": 0, "law_id": 1, "title": 1, "category": 1, "level": 1}
+        ).to_list(length=len(ranked))
+        law_map = {law["law_id"]: law for law in law_docs}
+
+        result = []
+        for c in ranked:
+            law = law_map.get(c["law_id"])
+            if not law:
+                continue  # 法规已删除
+            result.append({**law, "views": c["views"], "last_viewed_at": c.get("last_viewed_at")})
+        return result
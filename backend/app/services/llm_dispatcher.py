@@ -0,0 +1,285 @@
+"""
+LLM 调度器 - 控制对外 LLM 调用的并发与优先级
+
+- 每个 provider 独立的并发上限（内网模型并发过高时性能急剧下降）
+- 优先级：交互式对话 > 笔录分析 > 交叉分析 > 会话摘要压缩，空出的并发名额优先分配给高优先级请求
+- 排队过长时快速拒绝，避免请求在队列中耗尽超时时间；队列已满时先挤出优先级更低的等待者，不拒绝交互式对话
+- 记录排队等待时间等指标，供管理接口查看
+- start(db) 后并发上限跨进程生效：名额同时在 MongoDB 中以租约登记（见 llm_slot_lease），
+  API 进程与独立 worker 进程合计不超过上限，优先级同样跨进程生效；MongoDB 异常时退化为仅进程内限流
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from pymongo.errors import PyMongoError
+
+from app.services.llm_slot_lease import LLMSlotLeases
+
+
+# 优先级（数值越小越优先）
+PRIORITY_CHAT = 0
+PRIORITY_TRANSCRIPT_ANALYSIS = 1
+PRIORITY_CROSS_ANALYSIS = 2
+PRIORITY_SESSION_COMPACTION = 3
+
+PRIORITY_NAMES = {
+    PRIORITY_CHAT: "chat",
+    PRIORITY_TRANSCRIPT_ANALYSIS: "transcript_analysis",
+    PRIORITY_CROSS_ANALYSIS: "cross_analysis",
+    PRIORITY_SESSION_COMPACTION: "session_compaction",
+}
+
+# 默认每个 provider 的并发上限，可用 LLM_CONCURRENCY_<PROVIDER> 单独覆盖（如 LLM_CONCURRENCY_RUIZHI=2）
+DEFAULT_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY_DEFAULT", "4"))
+# 每个 provider 允许排队的最大请求数，超过则直接拒绝
+DEFAULT_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "32"))
+# 并发上限是否跨进程生效（API 进程与独立 worker 共享名额）
+LLM_SHARED_CONCURRENCY = os.getenv("LLM_SHARED_CONCURRENCY", "true").lower() in ("1", "true", "yes")
+
+_LLM_DISPATCHER = None
+
+
+class LLMQueueFullError(Exception):
+    """LLM 调度队列已满"""
+
+
+class _ProviderQueue:
+    """单个 provider 的并发槽位 + 优先级等待队列"""
+
+    def __init__(self, provider: str, limit: int):
+        self.provider = provider
+        self.limit = max(1, limit)
+        self.active = 0
+        self.waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self.stats: Dict[int, Dict[str, float]] = {}
+
+    def stat(self, priority: int) -> Dict[str, float]:
+        if priority not in self.stats:
+            self.stats[priority] = {
+                "requests": 0,
+                "rejected": 0,
+                "total_wait": 0.0,
+                "max_wait": 0.0,
+            }
+        return self.stats[priority]
+
+
+class LLMDispatcher:
+    """按 provider 限流、按优先级排队的 LLM 调度器"""
+
+    def __init__(self, default_limit: int, max_queue: int):
+        self.default_limit = default_limit
+        self.max_queue = max_queue
+        self._queues: Dict[str, _ProviderQueue] = {}
+        self._seq = itertools.count()
+        self._leases: Optional[LLMSlotLeases] = None
+        self._background: Set[asyncio.Task] = set()
+
+    async def start(self, db):
+        """绑定跨进程名额租约（应用 / worker 启动时调用）"""
+        if not LLM_SHARED_CONCURRENCY or self._leases is not None:
+            return
+        leases = LLMSlotLeases(db)
+        try:
+            await leases.ensure_indexes()
+        except Exception as e:
+            print(f"[LLMDispatcher] ⚠️ 创建名额租约索引失败: {e}")
+        leases.start()
+        self._leases = leases
+        print("[LLMDispatcher] ✅ LLM 并发上限跨进程生效")
+
+    async def stop(self):
+        """停止续约并归还持有的名额（应用 / worker 关闭时调用）"""
+        if self._leases is not None:
+            await self._leases.stop()
+            self._leases = None
+
+    async def _acquire_lease(self, queue: _ProviderQueue, priority: int) -> Optional[str]:
+        """在进程内名额之外再占用一个跨进程名额；未绑定或 MongoDB 异常时返回 None（仅进程内限流）"""
+        if self._leases is None:
+            return None
+        try:
+            return await self._leases.acquire(queue.provider, queue.limit, priority)
+        except PyMongoError as e:
+            print(f"[LLMDispatcher] ⚠️ 获取跨进程名额失败，仅按进程内上限限流: {e}")
+            return None
+
+    async def _release_lease(self, token: Optional[str]):
+        if token is None or self._leases is None:
+            return
+        try:
+            await self._leases.release(token)
+        except PyMongoError as e:
+            print(f"[LLMDispatcher] ⚠️ 归还跨进程名额失败（租约到期后自动回收）: {e}")
+
+    def _get_queue(self, provider: str, limit: Optional[int] = None) -> _ProviderQueue:
+        queue = self._queues.get(provider)
+        if queue is None:
+            env_limit = os.getenv(f"LLM_CONCURRENCY_{provider.upper()}")
+            initial = limit or (int(env_limit) if env_limit else self.default_limit)
+            queue = _ProviderQueue(provider, initial)
+            self._queues[provider] = queue
+        elif limit and limit != queue.limit:
+            queue.limit = max(1, limit)
+            self._wake(queue)
+        return queue
+
+    def _wake(self, queue: _ProviderQueue):
+        """将空出的并发名额分配给优先级最高的等待者"""
+        while queue.waiters and queue.active < queue.limit:
+            _, _, future = heapq.heappop(queue.waiters)
+            if future.done():
+                continue
+            queue.active += 1
+            future.set_result(None)
+
+    def _evict_lower(self, queue: _ProviderQueue, priority: int) -> bool:
+        """
+        队列已满时为更高优先级的请求腾位：拒绝优先级最低（同优先级中最晚排队）的等待者。
+        没有比 priority 更低的等待者时返回 False。
+        """
+        queue.waiters = [w for w in queue.waiters if not w[2].done()]
+        heapq.heapify(queue.waiters)
+        if len(queue.waiters) < self.max_queue:
+            return True
+        victim = max(queue.waiters, key=lambda w: (w[0], w[1]))
+        if victim[0] <= priority:
+            return False
+        queue.waiters.remove(victim)
+        heapq.heapify(queue.waiters)
+        victim[2].set_exception(LLMQueueFullError("AI 服务繁忙，请稍后重试"))
+        print(f"[LLMDispatcher] ⛔ {queue.provider} 排队已满，{PRIORITY_NAMES.get(victim[0], victim[0])} 请求让位于 {PRIORITY_NAMES.get(priority, priority)} 请求")
+        return True
+
+    def _release(self, queue: _ProviderQueue):
+        queue.active -= 1
+        self._wake(queue)
+
+    @asynccontextmanager
+    async def slot(self, provider: str, priority: int = PRIORITY_CHAT, limit: Optional[int] = None):
+        """
+        获取一个 LLM 并发名额（async with 使用）。
+        队列已满时抛出 LLMQueueFullError。
+        """
+        queue = self._get_queue(provider or "default", limit)
+        stat = queue.stat(priority)
+        enqueued_at = time.monotonic()
+
+        if queue.active < queue.limit and not queue.waiters:
+            queue.active += 1
+        else:
+            if len(queue.waiters) >= self.max_queue and not self._evict_lower(queue, priority):
+                stat["rejected"] += 1
+                print(f"[LLMDispatcher] ⛔ {queue.provider} 排队已满（{len(queue.waiters)}），拒绝 {PRIORITY_NAMES.get(priority, priority)} 请求")
+                raise LLMQueueFullError("AI 服务繁忙，请稍后重试")
+            future = asyncio.get_running_loop().create_future()
+            entry = (priority, next(self._seq), future)
+            heapq.heappush(queue.waiters, entry)
+            try:
+                await future
+            except LLMQueueFullError:
+                # 排队期间被更高优先级的请求挤出
+                stat["rejected"] += 1
+                raise
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # 名额已分配但调用方被取消：归还名额
+                    self._release(queue)
+                elif entry in queue.waiters:
+                    queue.waiters.remove(entry)
+                    heapq.heapify(queue.waiters)
+                raise
+
+        try:
+            token = await self._acquire_lease(queue, priority)
+        except BaseException:
+            self._release(queue)
+            raise
+        waited = time.monotonic() - enqueued_at
+        stat["requests"] += 1
+        stat["total_wait"] += waited
+        stat["max_wait"] = max(stat["max_wait"], waited)
+        if waited > 1:
+            print(f"[LLMDispatcher] ⏳ {queue.provider} {PRIORITY_NAMES.get(priority, priority)} 请求排队 {waited:.1f}s")
+        try:
+            yield
+        finally:
+            self._release(queue)
+            await self._release_lease(token)
+
+    async def try_acquire(
+        self, provider: str, limit: Optional[int] = None, priority: int = PRIORITY_CHAT
+    ) -> Optional[Callable[[], None]]:
+        """
+        非阻塞获取一个并发名额（对冲请求使用）：进程内与跨进程均有空闲名额且无人排队时占用并返回释放回调，
+        否则返回 None。
+        """
+        queue = self._get_queue(provider or "default", limit)
+        if queue.active >= queue.limit or queue.waiters:
+            return None
+        queue.active += 1
+        token = None
+        if self._leases is not None:
+            try:
+                token = await self._leases.try_acquire(queue.provider, queue.limit, priority)
+            except PyMongoError as e:
+                print(f"[LLMDispatcher] ⚠️ 获取跨进程名额失败，仅按进程内上限限流: {e}")
+            except BaseException:
+                self._release(queue)
+                raise
+            else:
+                if token is None:
+                    self._release(queue)
+                    return None
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self._release(queue)
+                if token is not None:
+                    task = asyncio.create_task(self._release_lease(token))
+                    self._background.add(task)
+                    task.add_done_callback(self._background.discard)
+
+        return release
+
+    def get_limit(self, provider: str, limit: Optional[int] = None) -> int:
+        """provider 当前的并发上限（批量提交子请求时据此限制同时排队的数量）"""
+        return self._get_queue(provider or "default", limit).limit
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取各 provider 的并发与排队指标"""
+        result = {}
+        for provider, queue in self._queues.items():
+            by_priority = {}
+            for priority, stat in sorted(queue.stats.items()):
+                requests = stat["requests"]
+                by_priority[PRIORITY_NAMES.get(priority, str(priority))] = {
+                    "requests": int(requests),
+                    "rejected": int(stat["rejected"]),
+                    "avg_wait_ms": round(stat["total_wait"] / requests * 1000, 1) if requests else 0.0,
+                    "max_wait_ms": round(stat["max_wait"] * 1000, 1),
+                }
+            result[provider] = {
+                "limit": queue.limit,
+                "active": queue.active,
+                "queued": sum(1 for _, _, f in queue.waiters if not f.done()),
+                "max_queue": self.max_queue,
+                "shared": self._leases is not None,
+                "priorities": by_priority,
+            }
+        return result
+
+
+def get_llm_dispatcher() -> LLMDispatcher:
+    global _LLM_DISPATCHER
+    if _LLM_DISPATCHER is None:
+        _LLM_DISPATCHER = LLMDispatcher(DEFAULT_CONCURRENCY, DEFAULT_MAX_QUEUE)
+    return _LLM_DISPATCHER
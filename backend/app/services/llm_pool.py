@@ -0,0 +1,258 @@
+"""
+LLM 多端点池 - 同一 provider 下多个同构 OpenAI 兼容副本的负载均衡
+
+- 最少在途请求（least outstanding requests）选择端点
+- 健康跟踪：连续失败达到阈值的端点暂时摘除，冷却后自动恢复
+- 5xx / 429 / 超时 / 连接错误时自动切换到其他端点重试
+- 可选对冲请求（hedged request）：首个请求超过历史 p95 延迟仍未返回时，向另一端点再发一次，取先返回者
+"""
+import asyncio
+import math
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+import httpx
+
+
+# 连续失败多少次后摘除端点
+UNHEALTHY_FAILURE_THRESHOLD = 3
+# 摘除后的冷却时间（秒）
+UNHEALTHY_COOLDOWN = 30.0
+# 对冲延迟使用的延迟分位数
+HEDGE_PERCENTILE = 95
+# 计算分位数所需的最少样本数（不足时使用配置的默认对冲延迟）
+HEDGE_MIN_SAMPLES = 20
+# 每类请求保留的延迟样本数
+LATENCY_WINDOW = 200
+
+_LLM_POOLS: Dict[str, "LLMEndpointPool"] = {}
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    """判断错误是否应切换到其他端点重试"""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500 or error.response.status_code == 429
+    return isinstance(error, (httpx.TimeoutException, httpx.TransportError))
+
+
+class _Endpoint:
+    """单个 LLM 端点的运行状态"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.unhealthy_until = 0.0
+        self.requests = 0
+        self.errors = 0
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.unhealthy_until
+
+    def record_success(self):
+        self.requests += 1
+        self.consecutive_failures = 0
+        self.unhealthy_until = 0.0
+
+    def record_failure(self):
+        self.requests += 1
+        self.errors += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= UNHEALTHY_FAILURE_THRESHOLD:
+            self.unhealthy_until = time.monotonic() + UNHEALTHY_COOLDOWN
+            print(f"[LLMPool] ⚠️ 端点连续失败 {self.consecutive_failures} 次，暂时摘除 {UNHEALTHY_COOLDOWN:.0f}s: {self.url}")
+
+
+class LLMEndpointPool:
+    """单个 provider 的端点池"""
+
+    def __init__(self, provider: str, urls: List[str]):
+        self.provider = provider
+        self._endpoints: Dict[str, _Endpoint] = {}
+        self._latencies: Dict[Any, deque] = {}
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.hedge_skipped = 0
+        self.update_urls(urls)
+
+    @property
+    def urls(self) -> List[str]:
+        return list(self._endpoints.keys())
+
+    def update_urls(self, urls: Iterable[str]):
+        """同步端点列表（配置变化时保留已有端点的运行状态）"""
+        ordered = []
+        for url in urls:
+            url = (url or "").strip()
+            if url and url not in ordered:
+                ordered.append(url)
+        if ordered == self.urls:
+            return
+        self._endpoints = {
+            url: self._endpoints.get(url) or _Endpoint(url) for url in ordered
+        }
+
+    def _pick(self, exclude: Iterable[str] = ()) -> Optional[_Endpoint]:
+        """按最少在途请求选择端点；全部不健康时退化为在剩余端点中选择"""
+        excluded = set(exclude)
+        candidates = [ep for url, ep in self._endpoints.items() if url not in excluded]
+        if not candidates:
+            return None
+        healthy = [ep for ep in candidates if ep.healthy]
+        pool = healthy or candidates
+        least = min(ep.outstanding for ep in pool)
+        return random.choice([ep for ep in pool if ep.outstanding == least])
+
+    def hedge_delay(self, sample_key: Any, default_ms: Optional[int]) -> Optional[float]:
+        """计算对冲延迟（秒）：样本充足时取 p95，否则使用配置的默认值"""
+        samples = self._latencies.get(sample_key)
+        if samples and len(samples) >= HEDGE_MIN_SAMPLES:
+            ordered = sorted(samples)
+            idx = min(len(ordered) - 1, math.ceil(len(ordered) * HEDGE_PERCENTILE / 100) - 1)
+            delay = ordered[idx]
+            if default_ms:
+                delay = max(delay, default_ms / 1000)
+            return delay
+        return default_ms / 1000 if default_ms else None
+
+    async def _run(self, send: Callable[[str], Awaitable[Any]], endpoint: _Endpoint, sample_key: Any) -> Any:
+        endpoint.outstanding += 1
+        started = time.monotonic()
+        try:
+            result = await send(endpoint.url)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if is_retryable_error(e):
+                endpoint.record_failure()
+            else:
+                endpoint.record_success()  # 4xx 说明端点本身可用
+            e.llm_endpoint = endpoint.url
+            raise
+        finally:
+            endpoint.outstanding -= 1
+        endpoint.record_success()
+        self._latencies.setdefault(sample_key, deque(maxlen=LATENCY_WINDOW)).append(
+            time.monotonic() - started
+        )
+        return result
+
+    async def _run_hedged(
+        self,
+        send: Callable[[str], Awaitable[Any]],
+        primary: _Endpoint,
+        delay: float,
+        tried: set,
+        exclude: Iterable[str],
+        sample_key: Any,
+        hedge_slot: Optional[Callable[[], Awaitable[Optional[Callable[[], None]]]]] = None,
+    ) -> Any:
+        first = asyncio.create_task(self._run(send, primary, sample_key))
+        tasks = {first}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                return first.result()
+
+            backup = self._pick(set(exclude) | tried)
+            if backup is None:
+                return await first
+            # 对冲请求同样占用一个调度并发名额；没有空闲名额时不对冲，保证并发不超过上限
+            release = await hedge_slot() if hedge_slot else None
+            if hedge_slot and release is None:
+                self.hedge_skipped += 1
+                return await first
+            tried.add(backup.url)
+            self.hedged += 1
+            print(f"[LLMPool] 🔀 {self.provider} 请求超过 {delay:.1f}s 未返回，对冲到 {backup.url}")
+            second = asyncio.create_task(self._run(send, backup, sample_key))
+            if release:
+                second.add_done_callback(lambda _: release())
+            tasks.add(second)
+
+            pending = set(tasks)
+            last_error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.hedge_wins += 1
+                        return task.result()
+                    last_error = task.exception()
+            raise last_error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def request(
+        self,
+        send: Callable[[str], Awaitable[Any]],
+        exclude: Iterable[str] = (),
+        hedge_delay: Optional[float] = None,
+        sample_key: Any = None,
+        hedge_slot: Optional[Callable[[], Awaitable[Optional[Callable[[], None]]]]] = None,
+    ) -> Any:
+        """
+        在端点池上执行一次逻辑请求。
+        send(url) 负责实际的 HTTP 调用；可重试错误会切换到尚未尝试过的端点。
+        await hedge_slot() 为对冲请求获取额外的并发名额，返回释放回调；返回 None 时跳过对冲。
+        """
+        excluded = set(exclude)
+        tried: set = set()
+        last_error: Optional[BaseException] = None
+        while True:
+            endpoint = self._pick(excluded | tried)
+            if endpoint is None:
+                if last_error is not None:
+                    raise last_error
+                raise RuntimeError(f"{self.provider} 没有可用的 LLM 端点")
+            tried.add(endpoint.url)
+            try:
+                if hedge_delay is not None and self._pick(excluded | tried) is not None:
+                    return await self._run_hedged(send, endpoint, hedge_delay, tried, excluded, sample_key, hedge_slot)
+                return await self._run(send, endpoint, sample_key)
+            except Exception as e:
+                if not is_retryable_error(e):
+                    raise
+                last_error = e
+                if self._pick(excluded | tried) is not None:
+                    print(f"[LLMPool] ⚠️ {getattr(e, 'llm_endpoint', endpoint.url)} 请求失败（{type(e).__name__}），切换端点重试")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取端点池状态"""
+        return {
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "hedge_skipped": self.hedge_skipped,
+            "endpoints": [
+                {
+                    "url": ep.url,
+                    "healthy": ep.healthy,
+                    "outstanding": ep.outstanding,
+                    "requests": ep.requests,
+                    "errors": ep.errors,
+                    "consecutive_failures": ep.consecutive_failures,
+                }
+                for ep in self._endpoints.values()
+            ],
+        }
+
+
+def get_llm_pool(provider: str, urls: List[str]) -> LLMEndpointPool:
+    """获取（或创建）provider 对应的端点池，并同步最新的端点列表"""
+    pool = _LLM_POOLS.get(provider)
+    if pool is None:
+        pool = LLMEndpointPool(provider, urls)
+        _LLM_POOLS[provider] = pool
+    else:
+        pool.update_urls(urls)
+    return pool
+
+
+def get_llm_pool_stats() -> Dict[str, Any]:
+    return {provider: pool.get_stats() for provider, pool in _LLM_POOLS.items()}
@@ -0,0 +1,170 @@
+"""
+LLM 并发名额的跨进程租约 - 基于 MongoDB llm_slots 集合
+
+- 每个 provider 的并发上限对应 limit 个名额文档，API 进程与独立 worker 进程共同争抢，合计不超过上限
+- 名额带租约（lease_until），持有期间定期续约；进程崩溃后租约过期，名额被重新分配
+- 没有空闲名额时登记到 llm_slot_waiters 并轮询；存在更高优先级的等待者时让行，
+  空出的名额优先分配给交互式对话（与进程内调度器的优先级一致）
+"""
+import asyncio
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+
+
+COLLECTION_LLM_SLOTS = "llm_slots"
+COLLECTION_LLM_SLOT_WAITERS = "llm_slot_waiters"
+
+# 名额租约时长（秒），持有期间每 LEASE/3 续约一次
+LLM_SLOT_LEASE_SECONDS = float(os.getenv("LLM_SLOT_LEASE_SECONDS", "30"))
+# 没有空闲名额时的轮询间隔（秒）
+LLM_SLOT_POLL_INTERVAL = float(os.getenv("LLM_SLOT_POLL_INTERVAL", "0.2"))
+# 等待者登记的有效期（秒），等待期间每次轮询刷新；进程崩溃后过期的登记不再阻挡低优先级请求
+LLM_SLOT_WAITER_TTL = float(os.getenv("LLM_SLOT_WAITER_TTL", "5"))
+
+
+class LLMSlotLeases:
+    """跨进程的 provider 并发名额（租约式信号量）"""
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.slots = db[COLLECTION_LLM_SLOTS]
+        self.waiters = db[COLLECTION_LLM_SLOT_WAITERS]
+        self.owner = f"{socket.gethostname()}-{os.getpid()}"
+        # token -> 名额文档 _id
+        self._held: Dict[str, str] = {}
+        # provider -> 已创建的名额文档数
+        self._provisioned: Dict[str, int] = {}
+        self._renew_task: Optional[asyncio.Task] = None
+
+    async def ensure_indexes(self):
+        await self.slots.create_index([("provider", ASCENDING), ("index", ASCENDING)])
+        await self.waiters.create_index([("provider", ASCENDING), ("priority", ASCENDING), ("expires_at", ASCENDING)])
+        # 残留的等待者登记（进程崩溃）定期清理
+        await self.waiters.create_index("expires_at", expireAfterSeconds=60)
+
+    async def _provision(self, provider: str, limit: int):
+        """确保 provider 的前 limit 个名额文档存在"""
+        if self._provisioned.get(provider, 0) >= limit:
+            return
+        for index in range(limit):
+            try:
+                await self.slots.update_one(
+                    {"_id": f"{provider}:{index}"},
+                    {"$setOnInsert": {"provider": provider, "index": index, "holder": None, "lease_until": None}},
+                    upsert=True,
+                )
+            except DuplicateKeyError:
+                pass  # 其他进程同时创建
+        self._provisioned[provider] = limit
+
+    async def _claim(self, provider: str, limit: int, priority: int, token: str) -> bool:
+        """有空闲（或租约过期）的名额且没有更高优先级的等待者时占用一个"""
+        now = datetime.utcnow()
+        ahead = await self.waiters.find_one(
+            {"provider": provider, "priority": {"$lt": priority}, "expires_at": {"$gt": now}}, {"_id": 1}
+        )
+        if ahead:
+            return False
+        slot = await self.slots.find_one_and_update(
+            {
+                "provider": provider,
+                "index": {"$lt": limit},
+                "$or": [{"holder": None}, {"lease_until": {"$lt": now}}],
+            },
+            {"$set": {
+                "holder": token,
+                "priority": priority,
+                "lease_until": now + timedelta(seconds=LLM_SLOT_LEASE_SECONDS),
+            }},
+            projection={"_id": 1},
+        )
+        if slot is None:
+            return False
+        self._held[token] = slot["_id"]
+        return True
+
+    def _new_token(self) -> str:
+        return f"{self.owner}-{uuid.uuid4().hex[:12]}"
+
+    async def try_acquire(self, provider: str, limit: int, priority: int) -> Optional[str]:
+        """非阻塞占用一个名额，成功返回 token，否则返回 None"""
+        await self._provision(provider, limit)
+        token = self._new_token()
+        return token if await self._claim(provider, limit, priority, token) else None
+
+    async def acquire(self, provider: str, limit: int, priority: int) -> str:
+        """占用一个名额（没有空闲名额时登记等待并轮询），返回 token"""
+        await self._provision(provider, limit)
+        token = self._new_token()
+        if await self._claim(provider, limit, priority, token):
+            return token
+        try:
+            while True:
+                await self.waiters.update_one(
+                    {"_id": token},
+                    {"$set": {
+                        "provider": provider,
+                        "priority": priority,
+                        "expires_at": datetime.utcnow() + timedelta(seconds=LLM_SLOT_WAITER_TTL),
+                    }},
+                    upsert=True,
+                )
+                await asyncio.sleep(LLM_SLOT_POLL_INTERVAL)
+                # 自己的登记优先级相同，不会阻挡自己
+                if await self._claim(provider, limit, priority, token):
+                    return token
+        finally:
+            try:
+                await self.waiters.delete_one({"_id": token})
+            except Exception:
+                pass  # 登记到期后不再生效
+
+    async def release(self, token: str):
+        slot_id = self._held.pop(token, None)
+        if slot_id is not None:
+            await self.slots.update_one(
+                {"_id": slot_id, "holder": token},
+                {"$set": {"holder": None, "lease_until": None}},
+            )
+
+    async def _renew_loop(self):
+        """为本进程持有的名额续约"""
+        interval = max(1.0, LLM_SLOT_LEASE_SECONDS / 3)
+        while True:
+            await asyncio.sleep(interval)
+            if not self._held:
+                continue
+            try:
+                await self.slots.update_many(
+                    {"holder": {"$in": list(self._held)}},
+                    {"$set": {"lease_until": datetime.utcnow() + timedelta(seconds=LLM_SLOT_LEASE_SECONDS)}},
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[LLMSlotLeases] ⚠️ 名额续约失败: {e}")
+
+    def start(self):
+        if self._renew_task is None or self._renew_task.done():
+            self._renew_task = asyncio.create_task(self._renew_loop())
+
+    async def stop(self):
+        """停止续约并归还本进程持有的名额"""
+        if self._renew_task is not None:
+            self._renew_task.cancel()
+            try:
+                await self._renew_task
+            except asyncio.CancelledError:
+                pass
+            self._renew_task = None
+        for token in list(self._held):
+            try:
+                await self.release(token)
+            except Exception:
+                pass  # 租约到期后自动回收
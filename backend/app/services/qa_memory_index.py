@@ -0,0 +1,404 @@
+"""
+QA 记忆库常驻索引 - 进程内维护全部记忆条目的相似度索引
+
+- 标准化问题的 2-gram 集合 + MinHash 签名，LSH 分桶快速召回候选，再用精确 Jaccard 校验
+- 标准化问题的向量（embedding-service），用于召回措辞不同但语义相近的问题
+- save_good_answer / mark_bad_answer 等写操作同步更新本进程索引，并在配置缓存文档中追加变更日志（op + question_hash），
+  其他 worker 按日志增量更新（新增/更新的条目只查询该条），日志不连续时才全量重新加载
+- 查找只在内存中进行，不再每次从 MongoDB 拉取 use_count 前 200 条，覆盖全部记忆
+"""
+import asyncio
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+
+# MinHash 签名长度及 LSH 分桶（32 个 band × 每 band 2 行：Jaccard 0.3 的候选召回率约 95%）
+MINHASH_NUM_PERM = 64
+LSH_BANDS = 32
+LSH_ROWS = MINHASH_NUM_PERM // LSH_BANDS
+_MERSENNE_PRIME = (1 << 31) - 1
+
+# 向量召回的候选数量
+EMBEDDING_TOP_K = 10
+# 向量服务不可用后暂停调用的时间（秒）
+EMBEDDING_RETRY_INTERVAL = 60.0
+# 查询向量的总时限（秒）：对话路径上只请求一次，不重试
+EMBEDDING_QUERY_TIMEOUT = 1.5
+# 查询向量 LRU 缓存大小（同一问题 find_match / find_related 只请求一次）
+QUERY_EMBEDDING_CACHE_SIZE = 256
+# 加载时补算向量的批大小
+EMBEDDING_BACKFILL_BATCH = 64
+
+# 跨 worker 同步使用的配置缓存 key
+QA_MEMORY_VERSION_KEY = "qa_memory_index"
+# 配置文档中保留的变更日志条数（其他 worker 落后超过该条数时全量重新加载）
+QA_MEMORY_CHANGE_LOG_SIZE = 200
+
+_rng = np.random.RandomState(20240517)
+_PERM_A = _rng.randint(1, _MERSENNE_PRIME, size=MINHASH_NUM_PERM).astype(np.uint64)
+_PERM_B = _rng.randint(0, _MERSENNE_PRIME, size=MINHASH_NUM_PERM).astype(np.uint64)
+
+_QA_MEMORY_INDEX = None
+
+
+def question_bigrams(normalized: str) -> Set[str]:
+    """标准化问题的 2-gram 集合（与 _char_similarity 口径一致）"""
+    if len(normalized) > 1:
+        return {normalized[i:i + 2] for i in range(len(normalized) - 1)}
+    return {normalized} if normalized else set()
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    union = len(a | b)
+    return len(a & b) / union if union else 0.0
+
+
+def minhash_signature(grams: Iterable[str]) -> np.ndarray:
+    """计算 MinHash 签名（crc32 作为基础哈希，进程间稳定）"""
+    hashes = np.array([zlib.crc32(g.encode("utf-8")) for g in grams], dtype=np.uint64)
+    if hashes.size == 0:
+        return np.full(MINHASH_NUM_PERM, _MERSENNE_PRIME, dtype=np.uint64)
+    permuted = (_PERM_A[:, None] * hashes[None, :] + _PERM_B[:, None]) % _MERSENNE_PRIME
+    return permuted.min(axis=1)
+
+
+def _band_keys(signature: np.ndarray) -> List[Tuple[int, bytes]]:
+    return [
+        (band, signature[band * LSH_ROWS:(band + 1) * LSH_ROWS].tobytes())
+        for band in range(LSH_BANDS)
+    ]
+
+
+class _Entry:
+    __slots__ = ("question_hash", "normalized", "grams", "bands", "row")
+
+    def __init__(self, question_hash: str, normalized: str):
+        self.question_hash = question_hash
+        self.normalized = normalized
+        self.grams = question_bigrams(normalized)
+        self.bands = _band_keys(minhash_signature(self.grams))
+        self.row: Optional[int] = None  # 向量矩阵中的行号（无向量时为 None）
+
+
+class QAMemoryIndex:
+    """QA 记忆库的进程内索引"""
+
+    def __init__(self):
+        self._entries: Dict[str, _Entry] = {}
+        self._buckets: List[Dict[bytes, Set[str]]] = [dict() for _ in range(LSH_BANDS)]
+        # 向量矩阵（行已归一化），按需扩容；_row_hashes[i] 为第 i 行对应的 question_hash
+        self._vectors: Optional[np.ndarray] = None
+        self._row_hashes: List[str] = []
+        self._query_embeddings: "OrderedDict[str, Optional[np.ndarray]]" = OrderedDict()
+        self._embedding_disabled_until = 0.0
+        self._loaded = False
+        self._stale = False
+        self._version = -1
+        self._local_update = False
+        # 其他 worker 新增/更新、待从数据库读取的条目
+        self._pending_upserts: Set[str] = set()
+        self._lock = asyncio.Lock()
+        self._backfill_task: Optional[asyncio.Task] = None
+
+    # ==================== 加载与同步 ====================
+
+    def on_settings_change(self, key: str, doc: Optional[dict]):
+        """配置缓存回调：其他 worker 修改了记忆库时按变更日志增量更新索引"""
+        if key != QA_MEMORY_VERSION_KEY or self._local_update or not self._loaded:
+            return
+        self._apply_changes(doc)
+
+    def _apply_changes(self, doc: Optional[dict], own: int = 0):
+        """
+        应用变更日志中本进程尚未见过的条目（own 为日志末尾本进程自己写入、已应用的条数）。
+        每次修改恰好递增一次版本号并追加一条日志，因此缺失的条目就是日志末尾的 version - self._version 条；
+        本进程的条目已提前应用，但需排在其他 worker 的变更之后重放（重放是幂等的），保证顺序一致；
+        日志已被截断时标记过期，下次查询全量重新加载。
+        """
+        version = (doc or {}).get("version", 0)
+        missed = version - self._version - own
+        if missed <= 0:
+            self._version = max(self._version, version)
+            return
+        changes = (doc or {}).get("changes") or []
+        if self._version < 0 or missed + own > len(changes):
+            self._stale = True
+            return
+        for change in changes[len(changes) - missed - own:]:
+            op, qhash = change.get("op"), change.get("question_hash")
+            if op == "upsert":
+                self._pending_upserts.add(qhash)
+            elif op == "remove":
+                self._pending_upserts.discard(qhash)
+                self._remove(qhash)
+            elif op == "clear":
+                self._pending_upserts.clear()
+                self.clear()
+            else:
+                self._stale = True
+                return
+        self._version = version
+
+    async def ensure_loaded(self, db: AsyncIOMotorDatabase):
+        if self._loaded and not self._stale and not self._pending_upserts:
+            return
+        async with self._lock:
+            if not self._loaded or self._stale:
+                await self._load(db)
+            elif self._pending_upserts:
+                await self._load_pending(db)
+
+    async def _load_pending(self, db: AsyncIOMotorDatabase):
+        """只读取其他 worker 新增/更新的条目（已被删除的从索引中移除）"""
+        from app.services.qa_memory_service import _normalize_question
+
+        hashes = list(self._pending_upserts)
+        found = set()
+        cursor = db.qa_memory.find(
+            {"question_hash": {"$in": hashes}},
+            {"_id": 0, "question_hash": 1, "question": 1, "question_embedding": 1},
+        )
+        async for doc in cursor:
+            self._add(doc["question_hash"], _normalize_question(doc.get("question", "")), doc.get("question_embedding"))
+            found.add(doc["question_hash"])
+        for qhash in hashes:
+            if qhash not in found:
+                self._remove(qhash)
+        # 读取期间新到达的变更留到下次
+        self._pending_upserts.difference_update(hashes)
+
+    async def _load(self, db: AsyncIOMotorDatabase):
+        from app.services.settings_cache import get_settings_cache
+        from app.services.qa_memory_service import _normalize_question
+
+        started = time.monotonic()
+        version = get_settings_cache().get_version(QA_MEMORY_VERSION_KEY)
+        self._entries = {}
+        self._buckets = [dict() for _ in range(LSH_BANDS)]
+        self._vectors = None
+        self._row_hashes = []
+        self._pending_upserts = set()
+
+        missing: List[Tuple[str, str]] = []
+        cursor = db.qa_memory.find({}, {"_id": 0, "question_hash": 1, "question": 1, "question_embedding": 1})
+        async for doc in cursor:
+            normalized = _normalize_question(doc.get("question", ""))
+            self._add(doc["question_hash"], normalized, doc.get("question_embedding"))
+            if not doc.get("question_embedding"):
+                missing.append((doc["question_hash"], normalized))
+
+        self._version = version
+        self._loaded = True
+        self._stale = False
+        print(f"[QAMemoryIndex] ✅ 已加载 {len(self._entries)} 条记忆（{len(self._row_hashes)} 条带向量），耗时 {time.monotonic() - started:.2f}s")
+
+        if missing and (self._backfill_task is None or self._backfill_task.done()):
+            self._backfill_task = asyncio.create_task(self._backfill_embeddings(db, missing))
+
+    async def _backfill_embeddings(self, db: AsyncIOMotorDatabase, items: List[Tuple[str, str]]):
+        """为缺少向量的记忆补算向量并写回数据库"""
+        from app.services import embedding_client
+
+        filled = 0
+        for i in range(0, len(items), EMBEDDING_BACKFILL_BATCH):
+            batch = items[i:i + EMBEDDING_BACKFILL_BATCH]
+            embeddings = await embedding_client.get_embeddings([n for _, n in batch])
+            if not embeddings or len(embeddings) != len(batch):
+                print(f"[QAMemoryIndex] ⚠️ 向量服务不可用，剩余 {len(items) - i} 条记忆暂不补算向量")
+                return
+            for (qhash, _), embedding in zip(batch, embeddings):
+                await db.qa_memory.update_one({"question_hash": qhash}, {"$set": {"question_embedding": embedding}})
+                if qhash in self._entries:
+                    self._set_vector(qhash, embedding)
+                    filled += 1
+        if filled:
+            print(f"[QAMemoryIndex] ✅ 已补算 {filled} 条记忆的问题向量")
+
+    async def mark_changed(self, db: AsyncIOMotorDatabase, op: str, question_hash: Optional[str] = None):
+        """
+        本进程修改记忆库后递增版本号并追加变更日志（op: upsert / remove / clear），其他 worker 据此增量更新。
+        期间其他 worker 的修改同样从日志中补上。
+        """
+        from app.services.settings_cache import get_settings_cache
+
+        self._local_update = True
+        try:
+            doc = await get_settings_cache().update(
+                db,
+                QA_MEMORY_VERSION_KEY,
+                {"updated_at": time.time()},
+                push={"changes": {"op": op, "question_hash": question_hash}},
+                push_limit=QA_MEMORY_CHANGE_LOG_SIZE,
+            )
+            if self._loaded:
+                self._apply_changes(doc, own=1)
+            else:
+                self._version = doc.get("version", self._version)
+        except Exception as e:
+            print(f"[QAMemoryIndex] ⚠️ 更新记忆库版本号失败: {e}")
+        finally:
+            self._local_update = False
+
+    # ==================== 索引维护 ====================
+
+    def _add(self, question_hash: str, normalized: str, embedding: Optional[List[float]] = None):
+        if question_hash in self._entries:
+            self._remove(question_hash)
+        entry = _Entry(question_hash, normalized)
+        self._entries[question_hash] = entry
+        for band, key in entry.bands:
+            self._buckets[band].setdefault(key, set()).add(question_hash)
+        if embedding:
+            self._set_vector(question_hash, embedding)
+
+    def _set_vector(self, question_hash: str, embedding: List[float]):
+        entry = self._entries[question_hash]
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        if norm == 0:
+            return
+        vec = vec / norm
+        if self._vectors is not None and self._vectors.shape[1] != vec.shape[0]:
+            # 向量模型更换导致维度变化：丢弃旧向量
+            for qhash in self._row_hashes:
+                self._entries[qhash].row = None
+            self._vectors = None
+            self._row_hashes = []
+        if entry.row is None:
+            count = len(self._row_hashes)
+            if self._vectors is None:
+                self._vectors = np.zeros((max(64, count + 1), vec.shape[0]), dtype=np.float32)
+            elif count >= self._vectors.shape[0]:
+                grown = np.zeros((self._vectors.shape[0] * 2, vec.shape[0]), dtype=np.float32)
+                grown[:count] = self._vectors[:count]
+                self._vectors = grown
+            entry.row = count
+            self._row_hashes.append(question_hash)
+        self._vectors[entry.row] = vec
+
+    def _remove(self, question_hash: str):
+        entry = self._entries.pop(question_hash, None)
+        if entry is None:
+            return
+        for band, key in entry.bands:
+            bucket = self._buckets[band].get(key)
+            if bucket is not None:
+                bucket.discard(question_hash)
+                if not bucket:
+                    del self._buckets[band][key]
+        if entry.row is not None:
+            # 用最后一行填补空位，保持矩阵紧凑
+            last = len(self._row_hashes) - 1
+            if entry.row != last:
+                moved = self._row_hashes[last]
+                self._vectors[entry.row] = self._vectors[last]
+                self._row_hashes[entry.row] = moved
+                self._entries[moved].row = entry.row
+            self._row_hashes.pop()
+
+    def add(self, question_hash: str, normalized: str, embedding: Optional[List[float]] = None):
+        if self._loaded:
+            self._add(question_hash, normalized, embedding)
+
+    def remove(self, question_hash: str):
+        if self._loaded:
+            self._remove(question_hash)
+
+    def clear(self):
+        self._entries = {}
+        self._buckets = [dict() for _ in range(LSH_BANDS)]
+        self._vectors = None
+        self._row_hashes = []
+
+    # ==================== 查询 ====================
+
+    async def embed(self, normalized: str) -> Optional[np.ndarray]:
+        """获取标准化问题的向量（带 LRU 缓存；向量服务不可用时暂停调用一段时间）"""
+        from app.services import embedding_client
+
+        if normalized in self._query_embeddings:
+            self._query_embeddings.move_to_end(normalized)
+            return self._query_embeddings[normalized]
+        if time.monotonic() < self._embedding_disabled_until:
+            return None
+        try:
+            # 对话路径：只请求一次，总时限 EMBEDDING_QUERY_TIMEOUT，超时则本次只用字面召回
+            embeddings = await asyncio.wait_for(
+                embedding_client.get_embeddings([normalized], timeout=EMBEDDING_QUERY_TIMEOUT, max_retries=0),
+                EMBEDDING_QUERY_TIMEOUT,
+            )
+        except asyncio.TimeoutError:
+            embeddings = None
+        if not embeddings:
+            self._embedding_disabled_until = time.monotonic() + EMBEDDING_RETRY_INTERVAL
+            return None
+        vec = np.asarray(embeddings[0], dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        vec = vec / norm if norm else None
+        self._query_embeddings[normalized] = vec
+        if len(self._query_embeddings) > QUERY_EMBEDDING_CACHE_SIZE:
+            self._query_embeddings.popitem(last=False)
+        return vec
+
+    def exact(self, question_hash: str) -> bool:
+        return question_hash in self._entries
+
+    def lexical_candidates(self, normalized: str, min_similarity: float) -> List[Tuple[str, float]]:
+        """LSH 召回 + 精确 Jaccard 校验，返回 [(question_hash, similarity)]（降序）"""
+        grams = question_bigrams(normalized)
+        if not grams:
+            return []
+        candidates: Set[str] = set()
+        for band, key in _band_keys(minhash_signature(grams)):
+            bucket = self._buckets[band].get(key)
+            if bucket:
+                candidates |= bucket
+        scored = []
+        for qhash in candidates:
+            score = 1.0 if self._entries[qhash].normalized == normalized else jaccard(grams, self._entries[qhash].grams)
+            if score >= min_similarity:
+                scored.append((qhash, score))
+        scored.sort(key=lambda x: x[1], reverse=True)
+        return scored
+
+    def semantic_candidates(self, query_vec: Optional[np.ndarray], min_similarity: float, top_k: int = EMBEDDING_TOP_K) -> List[Tuple[str, float]]:
+        """向量余弦相似度召回，返回 [(question_hash, cosine)]（降序）"""
+        count = len(self._row_hashes)
+        if query_vec is None or self._vectors is None or count == 0 or query_vec.shape[0] != self._vectors.shape[1]:
+            return []
+        scores = self._vectors[:count] @ query_vec
+        k = min(top_k, count)
+        top = np.argpartition(-scores, k - 1)[:k]
+        result = [(self._row_hashes[i], float(scores[i])) for i in top if scores[i] >= min_similarity]
+        result.sort(key=lambda x: x[1], reverse=True)
+        return result
+
+    def lexical_similarity(self, question_hash: str, normalized: str) -> float:
+        entry = self._entries.get(question_hash)
+        if entry is None:
+            return 0.0
+        return jaccard(question_bigrams(normalized), entry.grams)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "loaded": self._loaded,
+            "entries": len(self._entries),
+            "with_embedding": len(self._row_hashes),
+            "version": self._version,
+        }
+
+
+def get_qa_memory_index() -> QAMemoryIndex:
+    global _QA_MEMORY_INDEX
+    if _QA_MEMORY_INDEX is None:
+        from app.services.settings_cache import get_settings_cache
+        _QA_MEMORY_INDEX = QAMemoryIndex()
+        get_settings_cache().add_listener(_QA_MEMORY_INDEX.on_settings_change)
+    return _QA_MEMORY_INDEX
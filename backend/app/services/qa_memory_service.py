@@ -5,15 +5,28 @@ QA 记忆服务 - 验证问答缓存/记忆库
 2. 新问题进来 → 先查记忆库中是否有相似问题
 3. 命中记忆 → 直接返回验证过的答案（或注入 prompt 作为参考）
 4. 管理接口 → 查看/删除记忆条目
+
+相似问题查找走进程内常驻索引（见 qa_memory_index），覆盖全部记忆条目
 """
 import hashlib
 from datetime import datetime
 from typing import Optional, Dict, Any, List
 from motor.motor_asyncio import AsyncIOMotorDatabase
 
+from app.services.qa_memory_index import get_qa_memory_index
+from app.services.usage_aggregator import get_usage_aggregator
+
 
 # 文本相似度阈值（用于简单字符匹配判断是否为"相同问题"）
 EXACT_MATCH_THRESHOLD = 0.90
+# 相关记忆（few-shot 参考）的字符相似度下限
+RELATED_THRESHOLD = 0.3
+# 向量相似度达到该值、且字符相似度不低于 SEMANTIC_MATCH_MIN_CHAR 时视为"相同问题"
+# （只看向量容易把金额、情节不同的问题判成同一个，因此同时要求一定的字面重合）
+SEMANTIC_MATCH_THRESHOLD = 0.95
+SEMANTIC_MATCH_MIN_CHAR = 0.5
+# 相关记忆的向量相似度下限
+SEMANTIC_RELATED_THRESHOLD = 0.80
 
 
 def _normalize_question(q: str) -> str:
@@ -68,58 +81,75 @@ class QAMemoryService:
 
     # ==================== 核心功能 ====================
 
+    async def _find_candidates(self, question: str, min_similarity: float) -> List[tuple]:
+        """
+        在常驻索引中查找相似问题，返回 [(question_hash, 综合相似度, 字符相似度)]（降序）。
+        字符相似度候选来自 MinHash/LSH，语义候选来自问题向量。
+        """
+        index = get_qa_memory_index()
+        await index.ensure_loaded(self.db)
+        normalized = _normalize_question(question)
+
+        scores: Dict[str, List[float]] = {}
+        for qhash, char_score in index.lexical_candidates(normalized, min(min_similarity, RELATED_THRESHOLD)):
+            scores[qhash] = [char_score, char_score]
+
+        query_vec = await index.embed(normalized)
+        for qhash, cosine in index.semantic_candidates(query_vec, SEMANTIC_RELATED_THRESHOLD):
+            char_score = scores[qhash][1] if qhash in scores else index.lexical_similarity(qhash, normalized)
+            scores[qhash] = [max(char_score, cosine), char_score]
+
+        ranked = [(qhash, s[0], s[1]) for qhash, s in scores.items()]
+        ranked.sort(key=lambda x: x[1], reverse=True)
+        return ranked
+
+    def _record_use(self, memory_id):
+        """记录命中次数（由写回聚合器批量写库，不阻塞返回）"""
+        get_usage_aggregator().record_memory_use(memory_id)
+
     async def find_match(self, question: str) -> Optional[Dict[str, Any]]:
         """
         查找记忆库中是否有匹配的已验证问答。
         策略：
         1. 精确 hash 匹配（完全相同的问题）
-        2. 遍历记忆库计算字符相似度（应对微小措辞差异）
+        2. 常驻索引查找字符相似度 ≥ EXACT_MATCH_THRESHOLD 的问题（应对微小措辞差异）
+        3. 向量相似度足够高且字面有一定重合的问题
         
         返回匹配的记忆条目，或 None
         """
         if not question or not question.strip():
             return None
 
+        index = get_qa_memory_index()
+        await index.ensure_loaded(self.db)
+
         # 第一步：精确 hash 匹配
         qhash = _question_hash(question)
-        exact = await self.collection.find_one({"question_hash": qhash})
-        if exact:
-            # 更新使用次数
-            await self.collection.update_one(
-                {"_id": exact["_id"]},
-                {"$inc": {"use_count": 1}, "$set": {"last_used_at": datetime.utcnow()}}
+        if index.exact(qhash):
+            exact = await self.collection.find_one({"question_hash": qhash}, {"question_embedding": 0})
+            if exact:
+                self._record_use(exact["_id"])
+                exact["_id"] = str(exact["_id"])
+                exact["match_type"] = "exact"
+                return exact
+
+        # 第二步：相似问题匹配
+        for candidate_hash, score, char_score in await self._find_candidates(question, EXACT_MATCH_THRESHOLD):
+            is_match = char_score >= EXACT_MATCH_THRESHOLD or (
+                score >= SEMANTIC_MATCH_THRESHOLD and char_score >= SEMANTIC_MATCH_MIN_CHAR
             )
-            exact["_id"] = str(exact["_id"])
-            exact["match_type"] = "exact"
-            return exact
-
-        # 第二步：字符相似度匹配（只对记忆库较小时可行）
-        # 限制扫描量，避免性能问题
-        cursor = self.collection.find(
-            {},
-            {"question": 1, "answer": 1, "sources": 1, "question_hash": 1, "use_count": 1}
-        ).sort("use_count", -1).limit(200)
-        
-        memories = await cursor.to_list(length=200)
-        
-        best_match = None
-        best_score = 0.0
-        
-        for mem in memories:
-            score = _char_similarity(question, mem.get("question", ""))
-            if score > best_score:
-                best_score = score
-                best_match = mem
-        
-        if best_match and best_score >= EXACT_MATCH_THRESHOLD:
-            # 更新使用次数
-            await self.collection.update_one(
-                {"_id": best_match["_id"]},
-                {"$inc": {"use_count": 1}, "$set": {"last_used_at": datetime.utcnow()}}
+            if not is_match:
+                continue
+            best_match = await self.collection.find_one(
+                {"question_hash": candidate_hash},
+                {"question": 1, "answer": 1, "sources": 1, "question_hash": 1, "use_count": 1}
             )
+            if not best_match:
+                continue
+            self._record_use(best_match["_id"])
             best_match["_id"] = str(best_match["_id"])
-            best_match["match_type"] = "similar"
-            best_match["similarity"] = best_score
+            best_match["match_type"] = "similar" if char_score >= EXACT_MATCH_THRESHOLD else "semantic"
+            best_match["similarity"] = score
             return best_match
 
         return None
@@ -132,23 +162,26 @@ class QAMemoryService:
         if not question or not question.strip():
             return []
 
-        cursor = self.collection.find(
-            {},
-            {"question": 1, "answer": 1, "sources": 1, "use_count": 1}
-        ).sort("use_count", -1).limit(200)
-        
-        memories = await cursor.to_list(length=200)
-        
-        scored = []
-        for mem in memories:
-            score = _char_similarity(question, mem.get("question", ""))
-            if score >= 0.3 and score < EXACT_MATCH_THRESHOLD:
-                mem["_id"] = str(mem["_id"])
-                mem["similarity"] = score
-                scored.append(mem)
-        
-        scored.sort(key=lambda x: x["similarity"], reverse=True)
-        return scored[:top_k]
+        qhash = _question_hash(question)
+        related = [
+            (candidate_hash, score)
+            for candidate_hash, score, char_score in await self._find_candidates(question, RELATED_THRESHOLD)
+            if candidate_hash != qhash and char_score < EXACT_MATCH_THRESHOLD
+        ][:top_k]
+        if not related:
+            return []
+
+        similarity = dict(related)
+        docs = await self.collection.find(
+            {"question_hash": {"$in": list(similarity)}},
+            {"question": 1, "answer": 1, "sources": 1, "use_count": 1, "question_hash": 1}
+        ).to_list(length=len(similarity))
+
+        for mem in docs:
+            mem["_id"] = str(mem["_id"])
+            mem["similarity"] = similarity[mem["question_hash"]]
+        docs.sort(key=lambda x: x["similarity"], reverse=True)
+        return docs
 
     # ==================== 反馈写入 ====================
 
@@ -162,7 +195,12 @@ class QAMemoryService:
         保存一个"好答案"到记忆库
         如果问题已存在，会更新答案
         """
+        from app.services import embedding_client
+
         qhash = _question_hash(question)
+        normalized = _normalize_question(question)
+        embeddings = await embedding_client.get_embeddings([normalized])
+        embedding = embeddings[0] if embeddings else None
         
         doc = {
             "question_hash": qhash,
@@ -173,6 +211,8 @@ class QAMemoryService:
             "last_used_at": datetime.utcnow(),
             "use_count": 0,
         }
+        if embedding:
+            doc["question_embedding"] = embedding
         
         result = await self.collection.update_one(
             {"question_hash": qhash},
@@ -180,6 +220,10 @@ class QAMemoryService:
             upsert=True,
         )
         
+        index = get_qa_memory_index()
+        index.add(qhash, normalized, embedding)
+        await index.mark_changed(self.db, "upsert", qhash)
+        
         action = "updated" if result.matched_count > 0 else "created"
         return {"success": True, "action": action, "question_hash": qhash}
 
@@ -190,6 +234,10 @@ class QAMemoryService:
         """
         qhash = _question_hash(question)
         result = await self.collection.delete_one({"question_hash": qhash})
+        if result.deleted_count > 0:
+            index = get_qa_memory_index()
+            index.remove(qhash)
+            await index.mark_changed(self.db, "remove", qhash)
         return {
             "success": True,
             "deleted": result.deleted_count > 0,
@@ -206,7 +254,7 @@ class QAMemoryService:
         total_pages = math.ceil(total / page_size) if total > 0 else 0
         skip = (page - 1) * page_size
 
-        cursor = self.collection.find({}).sort("use_count", -1).skip(skip).limit(page_size)
+        cursor = self.collection.find({}, {"question_embedding": 0}).sort("use_count", -1).skip(skip).limit(page_size)
         items = await cursor.to_list(length=page_size)
         
         for item in items:
@@ -225,11 +273,18 @@ class QAMemoryService:
     async def delete_memory(self, question_hash: str) -> bool:
         """删除单条记忆"""
         result = await self.collection.delete_one({"question_hash": question_hash})
+        if result.deleted_count > 0:
+            index = get_qa_memory_index()
+            index.remove(question_hash)
+            await index.mark_changed(self.db, "remove", question_hash)
         return result.deleted_count > 0
 
     async def clear_all(self) -> int:
         """清空所有记忆"""
         result = await self.collection.delete_many({})
+        index = get_qa_memory_index()
+        index.clear()
+        await index.mark_changed(self.db, "clear")
         return result.deleted_count
 
     async def get_stats(self) -> Dict[str, Any]:
@@ -246,4 +301,5 @@ class QAMemoryService:
             "total_entries": total,
             "entries_used": total_used,
             "total_hits": total_hits,
+            "index": get_qa_memory_index().get_stats(),
         }
@@ -0,0 +1,140 @@
+"""
+笔录 / 案件关键词检索的字符 n-gram 索引
+
+- 文档写入时把可检索字段切成字符二元组（bigram），存入 search_terms 数组并建多键索引
+- 检索时关键词同样切成二元组，用 {"search_terms": {"$all": grams}} 走索引取候选，
+  再用原有的正则条件校验（二元组都出现不代表连续出现），结果与原正则检索一致
+- 单字关键词无法切出二元组，仍走正则检索
+- 尚未生成 search_terms 的历史文档在启动时后台补齐，补齐完成前检索会额外包含这些文档（按正则校验）
+"""
+import asyncio
+import re
+import unicodedata
+from typing import Any, Dict, Iterable, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+
+from app.db import COLLECTION_CASES, COLLECTION_TRANSCRIPTS
+
+
+SEARCH_TERMS_FIELD = "search_terms"
+# 历史文档补齐时每批处理的文档数
+BACKFILL_BATCH_SIZE = 200
+
+# 参与检索的字段（与原正则检索的字段一致）
+TRANSCRIPT_SEARCH_FIELDS = ["content", "keywords", "analysis.summary", "title"]
+CASE_SEARCH_FIELDS = ["case_name", "case_number", "tags"]
+
+_backfill_task: Optional[asyncio.Task] = None
+
+
+def _normalize(text: str) -> str:
+    """全角转半角、转小写、去空白"""
+    return re.sub(r"\s+", "", unicodedata.normalize("NFKC", text or "").lower())
+
+
+def text_grams(text: str) -> List[str]:
+    """字符二元组（去重）"""
+    normalized = _normalize(text)
+    return list(dict.fromkeys(normalized[i:i + 2] for i in range(len(normalized) - 1)))
+
+
+def _field_values(doc: Dict[str, Any], path: str) -> Iterable[str]:
+    value: Any = doc
+    for part in path.split("."):
+        value = value.get(part) if isinstance(value, dict) else None
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, list):
+        return [v for v in value if isinstance(v, str)]
+    return []
+
+
+def build_search_terms(doc: Dict[str, Any], fields: List[str]) -> List[str]:
+    """由文档的可检索字段生成 search_terms（各字段分别切分，不跨字段拼接）"""
+    terms: Dict[str, None] = {}
+    for path in fields:
+        for value in _field_values(doc, path):
+            for gram in text_grams(value):
+                terms[gram] = None
+    return list(terms)
+
+
+def transcript_search_terms(doc: Dict[str, Any]) -> List[str]:
+    return build_search_terms(doc, TRANSCRIPT_SEARCH_FIELDS)
+
+
+def case_search_terms(doc: Dict[str, Any]) -> List[str]:
+    return build_search_terms(doc, CASE_SEARCH_FIELDS)
+
+
+def keyword_query(keyword: str, fields: List[str]) -> Dict[str, Any]:
+    """
+    关键词检索条件：n-gram 索引取候选 + 正则校验。
+    关键词不足两个字符时只能走正则。
+    """
+    safe_kw = re.escape(keyword)
+    verify = [{f: {"$regex": safe_kw, "$options": "i"}} for f in fields]
+    grams = text_grams(keyword)
+    if not grams:
+        return {"$or": verify}
+    # 顶层 $or 的两个分支都能走 search_terms 索引
+    return {"$or": [
+        {SEARCH_TERMS_FIELD: {"$all": grams}, "$or": verify},
+        # 尚未补齐 search_terms 的历史文档
+        {SEARCH_TERMS_FIELD: {"$exists": False}, "$or": verify},
+    ]}
+
+
+async def ensure_search_indexes(db: AsyncIOMotorDatabase):
+    await db[COLLECTION_TRANSCRIPTS].create_index(SEARCH_TERMS_FIELD)
+    await db[COLLECTION_CASES].create_index(SEARCH_TERMS_FIELD)
+
+
+async def _backfill_collection(db: AsyncIOMotorDatabase, collection: str, fields: List[str]) -> int:
+    coll = db[collection]
+    projection = {"_id": 1, **{f: 1 for f in fields}}
+    updated = 0
+    while True:
+        docs = await coll.find(
+            {SEARCH_TERMS_FIELD: {"$exists": False}}, projection
+        ).limit(BACKFILL_BATCH_SIZE).to_list(length=BACKFILL_BATCH_SIZE)
+        if not docs:
+            return updated
+        ops = [
+            UpdateOne(
+                {"_id": d["_id"], SEARCH_TERMS_FIELD: {"$exists": False}},
+                {"$set": {SEARCH_TERMS_FIELD: build_search_terms(d, fields)}},
+            )
+            for d in docs
+        ]
+        await coll.bulk_write(ops, ordered=False)
+        updated += len(ops)
+        await asyncio.sleep(0)
+
+
+async def backfill_search_terms(db: AsyncIOMotorDatabase) -> Dict[str, int]:
+    """为尚未生成 search_terms 的历史笔录和案件补齐索引字段"""
+    result = {
+        "transcripts": await _backfill_collection(db, COLLECTION_TRANSCRIPTS, TRANSCRIPT_SEARCH_FIELDS),
+        "cases": await _backfill_collection(db, COLLECTION_CASES, CASE_SEARCH_FIELDS),
+    }
+    if result["transcripts"] or result["cases"]:
+        print(f"[SearchTerms] ✅ 已补齐检索索引字段: 笔录 {result['transcripts']} 份，案件 {result['cases']} 个")
+    return result
+
+
+def start_backfill(db: AsyncIOMotorDatabase):
+    """后台补齐历史文档（应用启动时调用，不阻塞启动）"""
+    global _backfill_task
+    if _backfill_task is not None and not _backfill_task.done():
+        return
+
+    async def run():
+        try:
+            await backfill_search_terms(db)
+        except Exception as e:
+            print(f"[SearchTerms] ⚠️ 补齐检索索引字段失败: {e}")
+
+    _backfill_task = asyncio.create_task(run())
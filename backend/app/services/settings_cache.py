@@ -0,0 +1,179 @@
+"""
+系统设置缓存 - 进程内缓存 settings 集合中的配置文档
+
+- 每个配置文档带有递增的 version 字段，PUT 接口写库时同步 $inc 并立即更新本进程缓存
+- 多 worker 部署时，后台任务定期只拉取 {key, version} 做廉价版本比对，版本变化才重新加载整份文档
+- 热路径（AI 对话、IP 校验、首页弹窗）读取配置不再访问 MongoDB
+"""
+import asyncio
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+
+
+# 需要缓存的配置 key（ai_token_usage 等计数类文档变化频繁，不缓存）
+# qa_memory_index / law_title_index 只记录版本号，用于通知各 worker 重新加载 QA 记忆索引 / 法规名称索引
+CACHED_SETTING_KEYS = ["ai_config", "ip_access_config", "homepage_popup", "qa_memory_index", "law_title_index"]
+
+# 跨 worker 版本检查间隔（秒）
+SETTINGS_REFRESH_INTERVAL = float(os.getenv("SETTINGS_CACHE_REFRESH_INTERVAL", "5"))
+
+_SETTINGS_CACHE = None
+
+
+class SettingsCache:
+    """带版本号的配置缓存"""
+
+    def __init__(self, keys: List[str], refresh_interval: float):
+        self.keys = list(keys)
+        self.refresh_interval = refresh_interval
+        # key -> {"version": int, "doc": Optional[dict], "checked_at": float}
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._listeners: List[Callable[[str, Optional[dict]], None]] = []
+        self._lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def add_listener(self, callback: Callable[[str, Optional[dict]], None]):
+        """注册配置变更回调（用于派生缓存，如预编译的 IP 白名单）"""
+        self._listeners.append(callback)
+
+    def _store(self, key: str, doc: Optional[dict]):
+        """写入本进程缓存，版本变化时通知监听者"""
+        version = (doc or {}).get("version", 0)
+        previous = self._entries.get(key)
+        self._entries[key] = {
+            "version": version,
+            "doc": doc,
+            "checked_at": time.monotonic(),
+        }
+        if previous is None or previous["version"] != version or previous["doc"] != doc:
+            for callback in self._listeners:
+                try:
+                    callback(key, doc)
+                except Exception as e:
+                    print(f"[SettingsCache] ⚠️ 配置变更回调异常: {e}")
+
+    def get_version(self, key: str) -> int:
+        """获取当前缓存中某项配置的版本号（未加载时为 -1）"""
+        entry = self._entries.get(key)
+        return entry["version"] if entry else -1
+
+    async def get(self, db: AsyncIOMotorDatabase, key: str) -> Optional[dict]:
+        """
+        读取配置文档。
+        命中缓存直接返回；后台刷新任务未运行时（如脚本环境），超过刷新间隔的条目会重新加载。
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            refresher_running = self._refresh_task is not None and not self._refresh_task.done()
+            if refresher_running or time.monotonic() - entry["checked_at"] < self.refresh_interval:
+                return dict(entry["doc"]) if entry["doc"] else None
+
+        async with self._lock:
+            doc = await db.settings.find_one({"key": key}, {"_id": 0})
+            self._store(key, doc)
+        return dict(doc) if doc else None
+
+    async def update(
+        self,
+        db: AsyncIOMotorDatabase,
+        key: str,
+        fields: Dict[str, Any],
+        push: Optional[Dict[str, Any]] = None,
+        push_limit: int = 0,
+    ) -> dict:
+        """
+        写入配置并递增版本号，同步更新本进程缓存。
+        push 中的值追加到对应数组字段（与版本号递增在同一次原子更新中），push_limit > 0 时只保留最近的条目。
+        """
+        update: Dict[str, Any] = {"$set": fields, "$inc": {"version": 1}}
+        if push:
+            update["$push"] = {
+                field: {"$each": [value], **({"$slice": -push_limit} if push_limit > 0 else {})}
+                for field, value in push.items()
+            }
+        doc = await db.settings.find_one_and_update(
+            {"key": key},
+            update,
+            upsert=True,
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+        self._store(key, doc)
+        return dict(doc)
+
+    async def refresh(self, db: AsyncIOMotorDatabase) -> int:
+        """
+        跨 worker 同步：只拉取 key + version 比对，版本变化的配置才重新加载。
+        返回重新加载的配置数量。
+        """
+        cursor = db.settings.find(
+            {"key": {"$in": self.keys}}, {"_id": 0, "key": 1, "version": 1}
+        )
+        remote_versions = {d["key"]: d.get("version", 0) async for d in cursor}
+
+        reloaded = 0
+        for key in self.keys:
+            entry = self._entries.get(key)
+            if key not in remote_versions:
+                # 库中不存在（未配置或已删除）
+                if entry is None or entry["doc"] is not None:
+                    self._store(key, None)
+                    reloaded += 1
+                else:
+                    entry["checked_at"] = time.monotonic()
+                continue
+            if entry is None or entry["version"] != remote_versions[key] or entry["doc"] is None:
+                doc = await db.settings.find_one({"key": key}, {"_id": 0})
+                self._store(key, doc)
+                reloaded += 1
+            else:
+                entry["checked_at"] = time.monotonic()
+        return reloaded
+
+    async def _refresh_loop(self, db: AsyncIOMotorDatabase):
+        """后台版本检查循环"""
+        while True:
+            try:
+                reloaded = await self.refresh(db)
+                if reloaded:
+                    print(f"[SettingsCache] 🔄 检测到 {reloaded} 项配置变更，已重新加载")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[SettingsCache] ⚠️ 配置版本检查失败: {e}")
+            await asyncio.sleep(self.refresh_interval)
+
+    async def start(self, db: AsyncIOMotorDatabase):
+        """预热缓存并启动后台刷新任务（应用启动时调用）"""
+        try:
+            await self.refresh(db)
+            print(f"[SettingsCache] ✅ 配置缓存已预热: {', '.join(self.keys)}")
+        except Exception as e:
+            print(f"[SettingsCache] ⚠️ 配置缓存预热失败，将按需加载: {e}")
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh_loop(db))
+
+    async def stop(self):
+        """停止后台刷新任务（应用关闭时调用）"""
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+
+    def clear(self):
+        """清空本进程缓存"""
+        self._entries.clear()
+
+
+def get_settings_cache() -> SettingsCache:
+    global _SETTINGS_CACHE
+    if _SETTINGS_CACHE is None:
+        _SETTINGS_CACHE = SettingsCache(CACHED_SETTING_KEYS, SETTINGS_REFRESH_INTERVAL)
+    return _SETTINGS_CACHE
@@ -0,0 +1,245 @@
+"""
+长笔录分块分析（map-reduce）辅助函数
+
+- 按"问/答"轮次边界切分笔录，每块不超过指定字数，避免把一问一答拆到两块
+- 切分点由轮次自身内容决定（内容定义分块），修改某处只影响所在分块，其余分块不变、分块缓存仍可命中
+- 合并各块的结构化分析结果：人员、时间线、地点、关键事实、物品金额、关联法条、规范性检查
+- 偏移索引：记录人名/事件词在笔录原文中的出现位置，按位置截取原文片段（交叉分析矛盾点比对用）
+"""
+import hashlib
+import re
+from typing import Any, Dict, List, Optional
+
+
+# 识别"问/答"轮次起始行：问：、问:、问 ：、Q：、讯问人问：等
+_QUESTION_LINE = re.compile(r"^\s*(?:[一-鿿]{0,4}问|Q)\s*[:：]")
+_ANY_TURN_LINE = re.compile(r"^\s*(?:[一-鿿]{0,4}[问答]|Q|A)\s*[:：]")
+
+_CONFIDENCE_RANK = {"high": 3, "medium": 2, "low": 1}
+# 规范性检查：任一分块确认通过即视为通过（如权利告知只出现在开头部分）
+_COMPLIANCE_RANK = {"pass": 3, "warning": 2, "fail": 1}
+
+
+def _is_cut_point(piece: str, target_chars: int) -> bool:
+    """
+    内容定义的切分点：只由该轮次自身的文本决定（与前文无关），
+    概率与轮次长度成正比，平均每 target_chars 字出现一个切分点。
+    """
+    digest = hashlib.blake2b(piece.strip().encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") / 2 ** 64 < len(piece) / target_chars
+
+
+def split_transcript_turns(content: str, max_chars: int) -> List[str]:
+    """
+    将笔录按问答轮次切分为若干块（每块 ≤ max_chars，单个超长轮次按段落再切）。
+    无法识别问答格式时按段落切分。
+    分块边界落在内容定义的切分点上（平均约 max_chars / 2 字一块，不足 max_chars / 8 字不切），
+    而非贪心填满 max_chars：前面的修改不会让后面所有分块的边界随之移动。
+    """
+    lines = content.splitlines()
+    turns: List[str] = []
+    current: List[str] = []
+    has_turn_format = any(_ANY_TURN_LINE.match(line) for line in lines)
+    for line in lines:
+        starts_turn = _QUESTION_LINE.match(line) if has_turn_format else not line.strip()
+        if starts_turn and current:
+            turns.append("\n".join(current))
+            current = []
+        current.append(line)
+    if current:
+        turns.append("\n".join(current))
+
+    target_chars = max(1, max_chars // 2)
+    min_chars = max_chars // 8
+    chunks: List[str] = []
+    buffer = ""
+    for turn in turns:
+        pieces = [turn] if len(turn) <= max_chars else _split_long_text(turn, max_chars)
+        for piece in pieces:
+            if buffer and len(buffer) + len(piece) + 1 > max_chars:
+                chunks.append(buffer)
+                buffer = ""
+            buffer = f"{buffer}\n{piece}" if buffer else piece
+            if len(buffer) >= min_chars and _is_cut_point(piece, target_chars):
+                chunks.append(buffer)
+                buffer = ""
+    if buffer.strip():
+        chunks.append(buffer)
+    return [c.strip("\n") for c in chunks if c.strip()]
+
+
+def _split_long_text(text: str, max_chars: int) -> List[str]:
+    """单个轮次超长时按句末标点切分"""
+    sentences = re.findall(r"[^。！？!?\n]*[。！？!?\n]?", text)
+    pieces: List[str] = []
+    buffer = ""
+    for sentence in sentences:
+        if not sentence:
+            continue
+        if buffer and len(buffer) + len(sentence) > max_chars:
+            pieces.append(buffer)
+            buffer = ""
+        while len(sentence) > max_chars:
+            pieces.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        buffer += sentence
+    if buffer:
+        pieces.append(buffer)
+    return pieces
+
+
+def chunk_cache_key(chunk: str, header: str, prompt_version: str, model: str) -> str:
+    """分块分析缓存键：分块内容 + 笔录元信息 + 提示词版本 + 模型"""
+    raw = "\x1f".join([prompt_version, model or "", header, chunk])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _norm(value: Any) -> str:
+    return re.sub(r"\s+", "", str(value or "")).lower()
+
+
+def _merge_into(target: Dict[str, Any], item: Dict[str, Any]):
+    """用 item 中的非空字段补全 target 的空字段"""
+    for key, value in item.items():
+        if value and not target.get(key):
+            target[key] = value
+
+
+def _dedupe(items: List[Dict[str, Any]], key_fields: List[str]) -> List[Dict[str, Any]]:
+    merged: Dict[tuple, Dict[str, Any]] = {}
+    order: List[tuple] = []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        key = tuple(_norm(item.get(f)) for f in key_fields)
+        if not any(key):
+            continue
+        if key in merged:
+            _merge_into(merged[key], item)
+        else:
+            merged[key] = dict(item)
+            order.append(key)
+    return [merged[k] for k in order]
+
+
+def merge_chunk_analyses(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    合并各分块的分析结果（reduce 的结构化部分，summary 由调用方单独生成）。
+    时间线保持分块顺序（笔录按问答先后记录），其余按名称/内容去重。
+    """
+    def collect(field: str) -> List[Dict[str, Any]]:
+        out: List[Dict[str, Any]] = []
+        for r in results:
+            out.extend(x for x in (r.get(field) or []) if isinstance(x, dict))
+        return out
+
+    related: Dict[tuple, Dict[str, Any]] = {}
+    for law in collect("related_laws"):
+        key = (_norm(re.sub(r"[《》]", "", law.get("law_title", ""))), _norm(law.get("article_display")))
+        if not key[0]:
+            continue
+        existing = related.get(key)
+        if existing is None:
+            related[key] = dict(law)
+        elif _CONFIDENCE_RANK.get(law.get("confidence"), 0) > _CONFIDENCE_RANK.get(existing.get("confidence"), 0):
+            _merge_into(law, existing)
+            related[key] = dict(law)
+        else:
+            _merge_into(existing, law)
+
+    compliance: Dict[str, Dict[str, Any]] = {}
+    for issue in collect("compliance_issues"):
+        key = _norm(issue.get("item"))
+        if not key:
+            continue
+        existing = compliance.get(key)
+        if existing is None or _COMPLIANCE_RANK.get(issue.get("status"), 0) > _COMPLIANCE_RANK.get(existing.get("status"), 0):
+            compliance[key] = dict(issue)
+
+    return {
+        "persons": _dedupe(collect("persons"), ["name"]),
+        "timeline": _dedupe(collect("timeline"), ["time", "event"]),
+        "locations": _dedupe(collect("locations"), ["name"]),
+        "key_facts": _dedupe(collect("key_facts"), ["description"]),
+        "items_amounts": _dedupe(collect("items_amounts"), ["name", "quantity"]),
+        "related_laws": list(related.values()),
+        "compliance_issues": list(compliance.values()),
+    }
+
+
+def fallback_summary(results: List[Dict[str, Any]], max_chars: int = 1500) -> str:
+    """reduce 阶段生成摘要失败时，拼接各分块摘要"""
+    parts = [r.get("summary", "").strip() for r in results if r.get("summary")]
+    text = "\n".join(parts)
+    return text[:max_chars]
+
+
+def chunk_header(doc: Dict[str, Any], index: Optional[int] = None, total: Optional[int] = None) -> str:
+    header = (
+        f"【笔录标题】{doc.get('title', '')}\n"
+        f"【笔录类型】{doc.get('type', '')}\n"
+        f"【被询问/讯问人】{doc.get('subject_name', '')}（{doc.get('subject_role', '')}）"
+    )
+    if index is not None and total:
+        header += f"\n【分段】第 {index} / {total} 部分"
+    return header
+
+
+# ==================== 原文偏移索引 ====================
+
+_QUOTE_SPLIT = re.compile(r"[，。；！？、,.;!?\s“”\"'（）()]+")
+
+
+def quote_terms(quote: str, min_len: int = 4, limit: int = 3) -> List[str]:
+    """从引用/描述中取几个较长的短句作为定位词"""
+    parts = [p for p in _QUOTE_SPLIT.split(quote or "") if len(p) >= min_len]
+    return sorted(parts, key=len, reverse=True)[:limit]
+
+
+def build_offset_index(content: str, terms: List[str]) -> Dict[str, List[int]]:
+    """各定位词在原文中的全部出现位置（未出现的词不记录）"""
+    index: Dict[str, List[int]] = {}
+    for term in dict.fromkeys(t for t in terms if t):
+        offsets = []
+        start = content.find(term)
+        while start != -1:
+            offsets.append(start)
+            start = content.find(term, start + len(term))
+        if offsets:
+            index[term] = offsets
+    return index
+
+
+def excerpt_around(
+    content: str, index: Dict[str, List[int]], terms: List[str], radius: int = 150, max_chars: int = 1500
+) -> str:
+    """
+    按偏移索引截取定位词附近的原文片段（相邻窗口合并，片段间以"……"分隔）。
+    引用/事件词（较长、更具体）优先于人名；都未命中时取原文开头。
+    """
+    offsets = sorted(
+        ((len(term) < 4, offset, len(term)) for term in terms for offset in index.get(term, [])),
+    )
+    if not offsets:
+        return content[:max_chars]
+
+    windows: List[List[int]] = []
+    total = 0
+    for _, offset, length in offsets:
+        start, end = max(0, offset - radius), min(len(content), offset + length + radius)
+        if total + (end - start) > max_chars:
+            continue
+        windows.append([start, end])
+        total += end - start
+    windows.sort()
+
+    merged: List[List[int]] = []
+    for start, end in windows:
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    parts = [content[start:end] for start, end in merged]
+    prefix = "……" if merged and merged[0][0] > 0 else ""
+    suffix = "……" if merged and merged[-1][1] < len(content) else ""
+    return prefix + "……".join(parts) + suffix
@@ -0,0 +1,235 @@
+"""
+笔录批量导入 - zip 压缩包 / 多个文件 + 元数据清单
+
+- 上传的文件（含 zip 内的 .doc/.docx/.txt）逐个分块落盘到本次导入的临时目录
+- 元数据清单（manifest）按文件名匹配标题、类型、被询问人；清单未提供的字段使用表单默认值，标题默认取文件名
+- 并行解析（同时解析数不超过解析进程池大小，不占满上传接口的解析队列）
+- 解析成功的笔录一次 insert_many 写入，案件笔录计数只更新一次，分析任务一次批量提交
+- 逐文件返回结果，单个文件失败不影响其他文件
+"""
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+import zlib
+from typing import Any, Dict, List, Optional
+
+from fastapi import UploadFile
+
+from app.services.document_parser import UPLOAD_MAX_BYTES, UPLOAD_CHUNK_SIZE, get_document_parser, write_upload
+
+
+# 单次导入的最大文件数（zip 内的文件逐个计数）
+BULK_IMPORT_MAX_FILES = int(os.getenv("BULK_IMPORT_MAX_FILES", "50"))
+SUPPORTED_EXTS = ("doc", "docx", "txt")
+# 导入单个笔录时必填的元数据
+REQUIRED_FIELDS = {"type": "笔录类型", "subject_name": "被询问人姓名", "subject_role": "被询问人角色"}
+
+
+def _file_ext(name: str) -> str:
+    return name.rsplit(".", 1)[-1].lower() if "." in name else ""
+
+
+def parse_manifest(text: Optional[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    解析元数据清单：JSON 数组 [{"file_name": ..., "title": ..., "type": ..., "subject_name": ..., "subject_role": ...}]，
+    返回 {文件名: 元数据}。格式错误抛出 ValueError。
+    """
+    if not text or not text.strip():
+        return {}
+    try:
+        entries = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"清单不是有效的 JSON: {e}")
+    if not isinstance(entries, list) or not all(isinstance(e, dict) and e.get("file_name") for e in entries):
+        raise ValueError("清单应为数组，每项包含 file_name")
+    return {os.path.basename(e["file_name"]): e for e in entries}
+
+
+def _zip_entry_name(info: zipfile.ZipInfo) -> str:
+    """zip 内文件名：未标记 UTF-8 的按 GBK 解码（Windows 中文系统打包的 zip）"""
+    if info.flag_bits & 0x800:
+        return info.filename
+    try:
+        return info.filename.encode("cp437").decode("gbk")
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return info.filename
+
+
+def _extract_zip(zip_path: str, work_dir: str, max_bytes: int) -> List[Dict[str, Any]]:
+    """解压 zip 中的笔录文件到 work_dir（在线程中执行），返回导入条目"""
+    entries: List[Dict[str, Any]] = []
+    try:
+        archive = zipfile.ZipFile(zip_path)
+    except zipfile.BadZipFile:
+        raise RuntimeError("zip 文件已损坏")
+    with archive:
+        for index, info in enumerate(archive.infolist()):
+            name = os.path.basename(_zip_entry_name(info).rstrip("/"))
+            if info.is_dir() or not name or name.startswith(".") or "__MACOSX" in info.filename:
+                continue
+            entry: Dict[str, Any] = {"file_name": name, "ext": _file_ext(name)}
+            entries.append(entry)
+            if len(entries) > BULK_IMPORT_MAX_FILES:
+                raise RuntimeError(f"单次最多导入 {BULK_IMPORT_MAX_FILES} 个文件")
+            if entry["ext"] not in SUPPORTED_EXTS:
+                entry["error"] = "仅支持 .doc、.docx 和 .txt 文件"
+                continue
+            if info.file_size > max_bytes:
+                entry["error"] = f"文件大小不能超过 {max_bytes / 1024 / 1024:.0f}MB"
+                continue
+
+            path = os.path.join(work_dir, f"{index}.{entry['ext']}")
+            digest = hashlib.sha256()
+            size = 0
+            try:
+                with archive.open(info) as src, open(path, "wb") as out:
+                    while True:
+                        chunk = src.read(UPLOAD_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        size += len(chunk)
+                        # 不信任 zip 头中记录的大小
+                        if size > max_bytes:
+                            entry["error"] = f"文件大小不能超过 {max_bytes / 1024 / 1024:.0f}MB"
+                            break
+                        digest.update(chunk)
+                        out.write(chunk)
+            except (zipfile.BadZipFile, zlib.error, NotImplementedError, RuntimeError, OSError, EOFError) as e:
+                # 单个成员损坏（CRC 校验失败、不支持的压缩方式、加密等）只标记该文件失败
+                entry["error"] = f"解压失败: {e}"
+                continue
+            if "error" not in entry:
+                entry.update(path=path, sha256=digest.hexdigest())
+    return entries
+
+
+async def collect_import_files(files: List[UploadFile], work_dir: str) -> List[Dict[str, Any]]:
+    """
+    上传文件落盘到 work_dir，zip 展开为其中的笔录文件。
+    返回导入条目 [{"file_name", "ext", "path", "sha256"}]，无法导入的条目带 error。
+    """
+    entries: List[Dict[str, Any]] = []
+    for index, file in enumerate(files):
+        name = os.path.basename(file.filename or "")
+        ext = _file_ext(name)
+        path = os.path.join(work_dir, f"upload_{index}.{ext or 'bin'}")
+        if ext == "zip":
+            try:
+                spooled = await write_upload(file, path, max_bytes=UPLOAD_MAX_BYTES * BULK_IMPORT_MAX_FILES)
+                extract_dir = os.path.join(work_dir, f"zip_{index}")
+                await asyncio.to_thread(os.mkdir, extract_dir)
+                entries.extend(await asyncio.to_thread(_extract_zip, spooled.path, extract_dir, UPLOAD_MAX_BYTES))
+            except RuntimeError as e:
+                entries.append({"file_name": name, "ext": ext, "error": str(e)})
+        elif ext in SUPPORTED_EXTS:
+            entry: Dict[str, Any] = {"file_name": name, "ext": ext}
+            try:
+                spooled = await write_upload(file, path)
+                entry.update(path=spooled.path, sha256=spooled.sha256)
+            except RuntimeError as e:
+                entry["error"] = str(e)
+            entries.append(entry)
+        else:
+            entries.append({"file_name": name, "ext": ext, "error": "仅支持 .doc、.docx、.txt 和 .zip 文件"})
+        if len(entries) > BULK_IMPORT_MAX_FILES:
+            raise RuntimeError(f"单次最多导入 {BULK_IMPORT_MAX_FILES} 个文件")
+    return entries
+
+
+def apply_manifest(entries: List[Dict[str, Any]], manifest: Dict[str, Dict[str, Any]], defaults: Dict[str, Any]):
+    """按文件名匹配清单元数据，缺少必填字段的条目标记 error"""
+    for entry in entries:
+        if entry.get("error"):
+            continue
+        meta = {**{k: v for k, v in defaults.items() if v}, **{k: v for k, v in manifest.get(entry["file_name"], {}).items() if v}}
+        missing = [label for field, label in REQUIRED_FIELDS.items() if not meta.get(field)]
+        if missing:
+            entry["error"] = f"缺少{'、'.join(missing)}（请在清单中填写）"
+            continue
+        entry["data"] = {
+            "title": meta.get("title") or entry["file_name"].rsplit(".", 1)[0],
+            "type": meta["type"],
+            "subject_name": meta["subject_name"],
+            "subject_role": meta["subject_role"],
+            "file_name": entry["file_name"],
+            "file_hash": entry["sha256"],
+        }
+
+
+async def parse_import_files(entries: List[Dict[str, Any]]):
+    """并行解析待导入的文件，结果写入条目的 data.content，失败写入 error"""
+    parser = get_document_parser()
+    # 同时解析数不超过进程池大小：批量导入在此排队，不占满上传接口的解析队列
+    slots = asyncio.Semaphore(parser.workers)
+
+    async def parse(entry: Dict[str, Any]):
+        try:
+            async with slots:
+                content = await parser.parse(entry["path"], entry["ext"])
+            if not content.strip():
+                entry["error"] = "文件内容为空"
+            else:
+                entry["data"]["content"] = content
+        except RuntimeError as e:
+            entry["error"] = str(e)
+
+    await asyncio.gather(*(parse(e) for e in entries if not e.get("error")))
+
+
+async def bulk_import_transcripts(
+    service,
+    case_id: str,
+    files: List[UploadFile],
+    manifest: Dict[str, Dict[str, Any]],
+    defaults: Dict[str, Any],
+    auto_analyze: bool = True,
+) -> Dict[str, Any]:
+    """
+    批量导入笔录（service 为 TranscriptService）。
+    案件不存在抛出 ValueError，文件数超限抛出 RuntimeError；单个文件的失败记录在返回的 items 中。
+    """
+    if not await service.cases.find_one({"case_id": case_id}, {"_id": 1}):
+        raise ValueError(f"案件不存在: {case_id}")
+
+    work_dir = await asyncio.to_thread(tempfile.mkdtemp, prefix="transcript_import_")
+    try:
+        entries = await collect_import_files(files, work_dir)
+        apply_manifest(entries, manifest, defaults)
+        await parse_import_files(entries)
+    finally:
+        await asyncio.to_thread(shutil.rmtree, work_dir, True)
+
+    ok = [e for e in entries if not e.get("error")]
+    docs, errors = await service.create_transcripts(case_id, [e["data"] for e in ok])
+    for index, error in errors.items():
+        ok[index]["error"] = error
+    analyses = await service.request_analyses(case_id, docs) if auto_analyze else {}
+
+    items = []
+    created = iter(docs)
+    for entry in entries:
+        if entry.get("error"):
+            items.append({"file_name": entry["file_name"], "success": False, "error": entry["error"]})
+            continue
+        doc = next(created)
+        analysis = analyses.get(doc["transcript_id"], {})
+        items.append({
+            "file_name": entry["file_name"],
+            "success": True,
+            "transcript_id": doc["transcript_id"],
+            "title": doc["title"],
+            "analysis_status": analysis.get("analysis_status", doc["analysis_status"]),
+            "job_id": analysis.get("job_id"),
+        })
+    print(f"[TranscriptImport] 📦 批量导入笔录: 案件 {case_id}，成功 {len(docs)}/{len(entries)} 个文件")
+    return {
+        "case_id": case_id,
+        "total": len(entries),
+        "created": len(docs),
+        "failed": len(entries) - len(docs),
+        "items": items,
+    }
@@ -1,14 +1,95 @@
 """
 笔录管理服务层 — CRUD + AI 分析 + 知识库沉淀
 """
+import asyncio
+import hashlib
 import json
+import os
 import re
+import unicodedata
 import uuid
 from datetime import datetime
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Awaitable, Callable, Tuple
+
+import bson
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
 
 from app.db import COLLECTION_CASES, COLLECTION_TRANSCRIPTS, COLLECTION_LAWS, COLLECTION_LAW_ARTICLES
 from app.services.embedding_client import get_embeddings
+from app.services.llm_dispatcher import PRIORITY_TRANSCRIPT_ANALYSIS, PRIORITY_CROSS_ANALYSIS, get_llm_dispatcher
+from app.services.job_queue import JobQueue, JOB_ANALYZE_TRANSCRIPT, JOB_CROSS_ANALYZE, job_key, job_summary
+from app.services.document_parser import get_document_parser
+from app.services.search_terms import transcript_search_terms, keyword_query, TRANSCRIPT_SEARCH_FIELDS
+from app.services.transcript_chunking import (
+    split_transcript_turns,
+    merge_chunk_analyses,
+    chunk_cache_key,
+    chunk_header,
+    fallback_summary,
+    quote_terms,
+    build_offset_index,
+    excerpt_around,
+)
+
+# 分析提示词版本：修改分析提示词或结果结构时递增，缓存的分析结果随之失效
+ANALYSIS_PROMPT_VERSION = "1"
+# 笔录超过该字数时分块分析（map-reduce），否则整篇一次分析
+TRANSCRIPT_CHUNK_THRESHOLD = int(os.getenv("TRANSCRIPT_CHUNK_THRESHOLD", "12000"))
+# 每个分块的最大字数（按问答轮次切分）
+TRANSCRIPT_CHUNK_MAX_CHARS = int(os.getenv("TRANSCRIPT_CHUNK_MAX_CHARS", "6000"))
+# 笔录文档入库大小上限（含 search_terms）：低于 MongoDB 单文档 16MB 上限，为后续写入的分析结果与向量留出余量
+TRANSCRIPT_MAX_DOC_BYTES = int(float(os.getenv("TRANSCRIPT_MAX_DOC_MB", "12")) * 1024 * 1024)
+# 分块分析结果缓存保留天数
+CHUNK_CACHE_TTL_DAYS = int(os.getenv("TRANSCRIPT_CHUNK_CACHE_TTL_DAYS", "90"))
+# 整篇分析结果缓存保留天数（按最近命中时间计算）
+ANALYSIS_CACHE_TTL_DAYS = int(os.getenv("TRANSCRIPT_ANALYSIS_CACHE_TTL_DAYS", "180"))
+
+# 交叉分析提示词版本：变化后增量交叉分析退回全量计算
+CROSS_ANALYSIS_PROMPT_VERSION = "1"
+# 变化的笔录超过该比例时直接全量交叉分析
+CROSS_INCREMENTAL_MAX_CHANGED_RATIO = float(os.getenv("CROSS_INCREMENTAL_MAX_CHANGED_RATIO", "0.5"))
+
+# 矛盾点深入比对：每批矛盾点数、每份笔录附带的原文片段上限与定位词前后截取字数
+CROSS_ENRICH_BATCH_SIZE = int(os.getenv("CROSS_ENRICH_BATCH_SIZE", "4"))
+CROSS_ENRICH_EXCERPT_MAX_CHARS = int(os.getenv("CROSS_ENRICH_EXCERPT_MAX_CHARS", "1500"))
+CROSS_ENRICH_EXCERPT_RADIUS = int(os.getenv("CROSS_ENRICH_EXCERPT_RADIUS", "150"))
+
+_SEVERITY_ORDER = {"high": 0, "medium": 1, "low": 2}
+
+COLLECTION_TRANSCRIPT_CHUNK_CACHE = "transcript_chunk_cache"
+COLLECTION_TRANSCRIPT_ANALYSIS_CACHE = "transcript_analysis_cache"
+
+
+class TranscriptTooLargeError(RuntimeError):
+    """笔录内容过大，无法存入单个文档"""
+
+
+def content_fingerprint(content: str) -> str:
+    """
+    笔录内容指纹：全角/半角统一（NFKC）、连续空白合并为一个空格后计算 sha256。
+    同一文件重复上传、不同格式（doc/docx/txt）导出的同一份笔录得到相同指纹；
+    空白的有无（如词之间是否分隔）仍会区分。
+    """
+    normalized = re.sub(r"\s+", " ", unicodedata.normalize("NFKC", content or "")).strip()
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+# 分析提示词中除正文外的字段（标题、类型、被询问人及其角色）
+ANALYSIS_META_FIELDS = ("title", "type", "subject_name", "subject_role")
+
+
+def analysis_meta_fingerprint(doc: dict) -> str:
+    """分析提示词元信息指纹：正文相同但被询问人/角色等不同的笔录不共用分析结果"""
+    raw = "\x1f".join(str(doc.get(field) or "").strip() for field in ANALYSIS_META_FIELDS)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+# 任务进度回调（由任务队列 worker 传入）
+ProgressCallback = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+async def _noop_progress(progress: Dict[str, Any]):
+    return None
 
 
 class TranscriptService:
@@ -20,6 +101,27 @@ class TranscriptService:
         self.transcripts = db[COLLECTION_TRANSCRIPTS]
         self.laws = db[COLLECTION_LAWS]
         self.law_articles = db[COLLECTION_LAW_ARTICLES]
+        self.chunk_cache = db[COLLECTION_TRANSCRIPT_CHUNK_CACHE]
+        self.analysis_cache = db[COLLECTION_TRANSCRIPT_ANALYSIS_CACHE]
+
+    async def ensure_indexes(self):
+        """确保索引存在（分析缓存按最近使用时间过期）"""
+        await self.chunk_cache.create_index(
+            "used_at", expireAfterSeconds=CHUNK_CACHE_TTL_DAYS * 24 * 3600
+        )
+        # 旧版缓存键不含元信息指纹，其唯一索引会阻止同一正文写入多份缓存
+        try:
+            await self.analysis_cache.drop_index("content_hash_1_prompt_version_1_model_1")
+        except Exception:
+            pass
+        await self.analysis_cache.create_index(
+            [("content_hash", 1), ("meta_hash", 1), ("prompt_version", 1), ("model", 1)], unique=True
+        )
+        await self.analysis_cache.create_index(
+            "used_at", expireAfterSeconds=ANALYSIS_CACHE_TTL_DAYS * 24 * 3600
+        )
+        await self.transcripts.create_index("content_hash")
+        await self.transcripts.create_index([("created_at", -1)])
 
     # ==================== CRUD ====================
 
@@ -31,6 +133,63 @@ class TranscriptService:
             raise ValueError(f"案件不存在: {case_id}")
 
         now = datetime.utcnow()
+        doc = self._new_transcript(case_id, data, now)
+        await self.transcripts.insert_one(doc)
+        # 更新案件笔录计数
+        await self.cases.update_one(
+            {"case_id": case_id},
+            {"$inc": {"transcript_count": 1}, "$set": {"updated_at": now}}
+        )
+        doc.pop("_id", None)
+        doc.pop("search_terms", None)
+        return doc
+
+    async def create_transcripts(self, case_id: str, items: List[dict]) -> Tuple[List[dict], Dict[int, str]]:
+        """
+        批量创建笔录：一次 insert_many，案件笔录计数只更新一次。
+        返回 (已创建的笔录（按 items 顺序）, {创建失败的 items 下标: 错误信息})。
+        """
+        case = await self.cases.find_one({"case_id": case_id}, {"_id": 1})
+        if not case:
+            raise ValueError(f"案件不存在: {case_id}")
+
+        now = datetime.utcnow()
+        docs, indexes, errors = [], [], {}
+        for index, data in enumerate(items):
+            try:
+                docs.append(self._new_transcript(case_id, data, now))
+                indexes.append(index)
+            except TranscriptTooLargeError as e:
+                errors[index] = str(e)
+        if not docs:
+            return [], errors
+
+        # 无序写入：个别文档失败不影响其余文档，失败的按下标记录
+        failed = {}
+        try:
+            await self.transcripts.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                failed[error["index"]] = error.get("errmsg") or "写入失败"
+            if not failed:
+                raise
+        created = [doc for position, doc in enumerate(docs) if position not in failed]
+        for position, message in failed.items():
+            errors[indexes[position]] = f"笔录保存失败: {message}"
+        if created:
+            await self.cases.update_one(
+                {"case_id": case_id},
+                {"$inc": {"transcript_count": len(created)}, "$set": {"updated_at": now}}
+            )
+        for doc in created:
+            doc.pop("_id", None)
+            doc.pop("search_terms", None)
+        return created, errors
+
+    def _new_transcript(self, case_id: str, data: dict, now: datetime) -> dict:
+        """构造笔录文档；入库大小超过 TRANSCRIPT_MAX_DOC_BYTES 时抛出 TranscriptTooLargeError"""
+        # 先按正文大小快速拒绝，避免为超大正文生成 search_terms
+        self._check_transcript_size(len(data["content"].encode("utf-8")))
         doc = {
             "transcript_id": str(uuid.uuid4()),
             "case_id": case_id,
@@ -39,7 +198,9 @@ class TranscriptService:
             "subject_name": data["subject_name"],
             "subject_role": data["subject_role"],
             "content": data["content"],
+            "content_hash": content_fingerprint(data["content"]),
             "file_name": data.get("file_name", ""),
+            "file_hash": data.get("file_hash", ""),
             "analysis": None,
             "embedding": None,
             "keywords": [],
@@ -47,15 +208,19 @@ class TranscriptService:
             "created_at": now,
             "updated_at": now,
         }
-        await self.transcripts.insert_one(doc)
-        # 更新案件笔录计数
-        await self.cases.update_one(
-            {"case_id": case_id},
-            {"$inc": {"transcript_count": 1}, "$set": {"updated_at": now}}
-        )
-        doc.pop("_id", None)
+        doc["search_terms"] = transcript_search_terms(doc)
+        self._check_transcript_size(len(bson.encode(doc)))
         return doc
 
+    @staticmethod
+    def _check_transcript_size(size: int):
+        if size > TRANSCRIPT_MAX_DOC_BYTES:
+            mb = 1024 * 1024
+            raise TranscriptTooLargeError(
+                f"笔录内容过大：入库约 {size / mb:.1f}MB（含检索索引），超过单份笔录上限 "
+                f"{TRANSCRIPT_MAX_DOC_BYTES / mb:.0f}MB，请拆分为多份笔录后导入"
+            )
+
     async def get_transcript_list(self, case_id: str) -> List[dict]:
         """获取案件下所有笔录列表"""
         cursor = self.transcripts.find(
@@ -64,6 +229,7 @@ class TranscriptService:
                 "_id": 0,
                 "content": 0,          # 列表不返回全文
                 "embedding": 0,
+                "search_terms": 0,
             }
         ).sort("created_at", -1)
         items = await cursor.to_list(length=200)
@@ -88,7 +254,7 @@ class TranscriptService:
         """获取笔录详情（含分析结果）"""
         doc = await self.transcripts.find_one(
             {"case_id": case_id, "transcript_id": transcript_id},
-            {"_id": 0, "embedding": 0}
+            {"_id": 0, "embedding": 0, "search_terms": 0}
         )
         return doc
 
@@ -115,105 +281,159 @@ class TranscriptService:
 
     # ==================== 文件解析 ====================
 
-    # OLE2 魔数：旧版 .doc 二进制格式的文件头
-    _OLE2_MAGIC = b'\xD0\xCF\x11\xE0\xA1\xB1\x1A\xE1'
-
-    @staticmethod
-    def _is_ole2(file_bytes: bytes) -> bool:
-        """检测文件是否为 OLE2 格式（旧版 .doc）"""
-        return file_bytes[:8] == TranscriptService._OLE2_MAGIC
-
     @staticmethod
-    def parse_docx(file_bytes: bytes) -> str:
-        """解析 DOCX 文件内容；若检测到实际是旧版 .doc 则自动回退"""
-        # 检测伪装的 .doc 文件（扩展名是 .docx 但实际是 OLE2 格式）
-        if TranscriptService._is_ole2(file_bytes):
-            return TranscriptService.parse_doc(file_bytes)
-        try:
-            from docx import Document
-            import io
-            doc = Document(io.BytesIO(file_bytes))
-            paragraphs = [p.text for p in doc.paragraphs if p.text.strip()]
-            return "\n".join(paragraphs)
-        except ImportError:
-            raise RuntimeError("python-docx 未安装，无法解析 DOCX 文件")
-        except Exception as e:
-            # 最后兜底：尝试用 antiword 解析
-            try:
-                return TranscriptService.parse_doc(file_bytes)
-            except Exception:
-                raise RuntimeError(f"DOCX 解析失败: {e}")
+    async def parse_file(path: str, ext: str) -> str:
+        """解析已落盘的笔录文件（在进程池 / 子进程中执行，不阻塞事件循环）"""
+        return await get_document_parser().parse(path, ext)
 
-    @staticmethod
-    def parse_doc(file_bytes: bytes) -> str:
-        """解析 DOC（旧版 Word）文件内容，使用 antiword"""
-        import subprocess
-        import tempfile
-        import os
-        try:
-            with tempfile.NamedTemporaryFile(suffix=".doc", delete=False) as tmp:
-                tmp.write(file_bytes)
-                tmp_path = tmp.name
-            result = subprocess.run(
-                ["antiword", tmp_path],
-                capture_output=True, timeout=30
-            )
-            os.unlink(tmp_path)
-            if result.returncode != 0:
-                stderr = result.stderr.decode("utf-8", errors="replace")
-                raise RuntimeError(f"antiword 解析失败: {stderr}")
-            # antiword 输出可能是 utf-8 或 latin-1
-            text = result.stdout.decode("utf-8", errors="replace")
-            lines = [line for line in text.splitlines() if line.strip()]
-            return "\n".join(lines)
-        except FileNotFoundError:
-            raise RuntimeError("antiword 未安装，无法解析 .doc 文件")
-        except subprocess.TimeoutExpired:
-            raise RuntimeError(".doc 文件解析超时")
-        except RuntimeError:
-            raise
-        except Exception as e:
-            raise RuntimeError(f"DOC 解析失败: {e}")
+    # ==================== AI 分析 ====================
 
-    @staticmethod
-    def parse_txt(file_bytes: bytes) -> str:
-        """解析 TXT 文件内容"""
-        for encoding in ["utf-8", "gbk", "gb2312", "utf-16"]:
-            try:
-                return file_bytes.decode(encoding)
-            except (UnicodeDecodeError, Exception):
-                continue
-        raise RuntimeError("无法识别文件编码")
+    async def enqueue_analysis(self, case_id: str, transcript_id: str, force: bool = False) -> dict:
+        """
+        提交笔录分析任务（同一笔录已有未完成任务时直接返回该任务）。
+        force=True 时忽略内容指纹缓存，重新调用 LLM 分析；已有排队中的任务会被升级为强制重新分析。
+        """
+        await self.mark_analysis_queued(case_id, transcript_id)
+        return await JobQueue(self.db).enqueue(
+            JOB_ANALYZE_TRANSCRIPT,
+            {"case_id": case_id, "transcript_id": transcript_id, "force": force},
+            dedupe_key=job_key(JOB_ANALYZE_TRANSCRIPT, transcript_id),
+            upgrade={"force": True} if force else None,
+        )
 
-    # ==================== AI 分析 ====================
+    async def request_analysis(self, case_id: str, transcript_id: str, force: bool = False) -> dict:
+        """
+        请求分析：相同内容已有分析结果（含其他案件的笔录）时直接复用，不再排队；
+        否则提交任务。返回 {"analysis_status", "job_id", "cached"}。
+        """
+        if not force and await self.apply_cached_analysis(case_id, transcript_id):
+            return {"analysis_status": "analyzed", "job_id": None, "cached": True}
+        job = await self.enqueue_analysis(case_id, transcript_id, force=force)
+        return {"analysis_status": "analyzing", "job_id": job["job_id"], "cached": False}
 
-    async def analyze_transcript(self, case_id: str, transcript_id: str):
+    async def request_analyses(self, case_id: str, docs: List[dict]) -> Dict[str, dict]:
         """
-        触发笔录 AI 分析（异步后台任务）
-        分析完成后自动执行知识库沉淀（关键词提取 + 向量化）
+        批量请求分析（批量导入后调用）：一次查询分析缓存，命中的直接写入，
+        其余一次 update_many 标记排队 + 一次 insert_many 提交任务。
+        返回 {transcript_id: {"analysis_status", "job_id", "cached"}}。
         """
-        # 更新状态为 analyzing
+        if not docs:
+            return {}
+        base_key = await self._analysis_cache_key({"content_hash": "-"})
+        hashes = {
+            d["transcript_id"]: (d.get("content_hash") or content_fingerprint(d.get("content", "")), analysis_meta_fingerprint(d))
+            for d in docs
+        }
+        cursor = self.analysis_cache.find(
+            {"content_hash": {"$in": list({h for h, _ in hashes.values()})},
+             "meta_hash": {"$in": list({m for _, m in hashes.values()})},
+             "prompt_version": base_key["prompt_version"], "model": base_key["model"]},
+            {"_id": 0, "content_hash": 1, "meta_hash": 1, "analysis": 1, "keywords": 1, "embedding": 1},
+        )
+        cached_by_hash = {(c["content_hash"], c["meta_hash"]): c async for c in cursor}
+
+        result: Dict[str, dict] = {}
+        cached_ops = []
+        pending = []
+        for doc in docs:
+            tid = doc["transcript_id"]
+            cached = cached_by_hash.get(hashes[tid])
+            if cached:
+                cache_key = {**base_key, "content_hash": hashes[tid][0], "meta_hash": hashes[tid][1]}
+                cached_ops.append(UpdateOne(
+                    {"case_id": case_id, "transcript_id": tid},
+                    {"$set": self._cached_analysis_fields(doc, cached, cache_key)},
+                ))
+                result[tid] = {"analysis_status": "analyzed", "job_id": None, "cached": True}
+            else:
+                pending.append(tid)
+
+        if cached_ops:
+            await self.transcripts.bulk_write(cached_ops, ordered=False)
+            await self.analysis_cache.update_many(
+                {"$or": [{"content_hash": h, "meta_hash": m} for h, m in cached_by_hash],
+                 "prompt_version": base_key["prompt_version"], "model": base_key["model"]},
+                {"$set": {"used_at": datetime.utcnow()}, "$inc": {"hit_count": 1}},
+            )
+            print(f"[TranscriptService] ♻️ 批量导入 {len(cached_ops)} 份笔录命中分析缓存，跳过 LLM 分析")
+        if pending:
+            await self.transcripts.update_many(
+                {"case_id": case_id, "transcript_id": {"$in": pending}},
+                {"$set": {"analysis_status": "analyzing", "updated_at": datetime.utcnow()}}
+            )
+            jobs = await JobQueue(self.db).enqueue_many(
+                JOB_ANALYZE_TRANSCRIPT,
+                [({"case_id": case_id, "transcript_id": tid, "force": False}, job_key(JOB_ANALYZE_TRANSCRIPT, tid))
+                 for tid in pending],
+            )
+            for tid, job in zip(pending, jobs):
+                result[tid] = {"analysis_status": "analyzing", "job_id": job["job_id"], "cached": False}
+        return result
+
+    async def get_analysis_job(self, transcript_id: str) -> Optional[dict]:
+        """笔录最近一次分析任务的状态与进度"""
+        job = await JobQueue(self.db).latest_job(job_key(JOB_ANALYZE_TRANSCRIPT, transcript_id))
+        return job_summary(job)
+
+    async def mark_analysis_queued(self, case_id: str, transcript_id: str):
+        """任务已提交：前端按 analyzing 展示并轮询"""
         await self.transcripts.update_one(
             {"case_id": case_id, "transcript_id": transcript_id},
             {"$set": {"analysis_status": "analyzing", "updated_at": datetime.utcnow()}}
         )
 
+    async def mark_analysis_failed(self, case_id: str, transcript_id: str, error: str = ""):
+        """任务最终失败（重试次数用尽）"""
+        await self.transcripts.update_one(
+            {"case_id": case_id, "transcript_id": transcript_id},
+            {"$set": {
+                "analysis_status": "failed",
+                "analysis_error": error,
+                "updated_at": datetime.utcnow(),
+            }}
+        )
+
+    async def analyze_transcript(
+        self,
+        case_id: str,
+        transcript_id: str,
+        progress: Optional[ProgressCallback] = None,
+        force: bool = False,
+    ):
+        """
+        笔录 AI 分析（由任务队列 worker 执行）
+        分析完成后自动执行知识库沉淀（关键词提取 + 向量化），结果按内容指纹写入分析缓存。
+        相同内容已有缓存时直接复用（force=True 时强制重新分析）。
+        失败时抛出异常，由任务队列决定重试或调用 mark_analysis_failed。
+        """
+        progress = progress or _noop_progress
+        # 更新状态为 analyzing
+        await self.mark_analysis_queued(case_id, transcript_id)
+
         try:
             # 获取笔录全文
             doc = await self.transcripts.find_one(
                 {"case_id": case_id, "transcript_id": transcript_id},
-                {"_id": 0, "content": 1, "title": 1, "type": 1,
+                {"_id": 0, "content": 1, "content_hash": 1, "title": 1, "type": 1,
                  "subject_name": 1, "subject_role": 1}
             )
             if not doc:
                 raise ValueError("笔录不存在")
 
-            content = doc["content"]
+            cache_key = await self._analysis_cache_key(doc)
+            if not force:
+                cached = await self._get_cached_analysis(cache_key)
+                if cached:
+                    await self._apply_analysis(case_id, transcript_id, doc, cached, cache_key)
+                    print(f"[TranscriptService] ♻️ 笔录内容命中分析缓存: {transcript_id}")
+                    return
 
             # 调用 LLM 分析
-            analysis_result = await self._call_llm_analyze(doc)
+            await progress({"stage": "llm_analysis"})
+            analysis_result = await self._call_llm_analyze(doc, progress)
 
             # 用项目法条库校验并丰富关联法条
+            await progress({"stage": "enrich_related_laws"})
             analysis_result = await self._enrich_related_laws_from_db(analysis_result)
 
             # 提取关键词（从分析结果中）
@@ -223,11 +443,15 @@ class TranscriptService:
             update_data: Dict[str, Any] = {
                 "analysis": analysis_result,
                 "analysis_status": "analyzed",
+                "analysis_error": None,
+                "analysis_cached": False,
                 "keywords": keywords,
+                "search_terms": transcript_search_terms({**doc, "keywords": keywords, "analysis": analysis_result}),
                 "updated_at": datetime.utcnow(),
             }
 
             # 知识库沉淀：向量化摘要
+            await progress({"stage": "embedding"})
             summary_text = analysis_result.get("summary", "")
             if summary_text:
                 try:
@@ -242,30 +466,100 @@ class TranscriptService:
 
             await self.transcripts.update_one(
                 {"case_id": case_id, "transcript_id": transcript_id},
-                {"$set": update_data}
+                {"$set": {**update_data, "content_hash": cache_key["content_hash"]}}
             )
+            # 向量化失败的结果不缓存，下次分析时补齐向量
+            if not analysis_result.get("parse_error") and (update_data.get("embedding") or not summary_text):
+                await self._save_cached_analysis(cache_key, update_data)
             print(f"[TranscriptService] ✅ 笔录分析完成: {transcript_id}")
 
         except Exception as e:
             print(f"[TranscriptService] ❌ 笔录分析失败: {e}")
-            await self.transcripts.update_one(
-                {"case_id": case_id, "transcript_id": transcript_id},
+            raise
+
+    # ==================== 分析结果缓存（按内容指纹） ====================
+
+    async def _analysis_cache_key(self, doc: dict) -> Dict[str, str]:
+        """
+        缓存键：(内容指纹, 元信息指纹, 提示词版本, 模型)；提示词或模型变化时缓存自然失效。
+        元信息（标题、类型、被询问人、角色）同样写入提示词，影响人员与角色的识别，须一并区分。
+        """
+        from app.services.ai_service import get_ai_config
+
+        config = await get_ai_config(self.db)
+        return {
+            "content_hash": doc.get("content_hash") or content_fingerprint(doc.get("content", "")),
+            "meta_hash": analysis_meta_fingerprint(doc),
+            "prompt_version": ANALYSIS_PROMPT_VERSION,
+            "model": config.get("model_name", ""),
+        }
+
+    async def _get_cached_analysis(self, cache_key: Dict[str, str]) -> Optional[dict]:
+        return await self.analysis_cache.find_one_and_update(
+            cache_key,
+            {"$set": {"used_at": datetime.utcnow()}, "$inc": {"hit_count": 1}},
+            projection={"_id": 0, "analysis": 1, "keywords": 1, "embedding": 1},
+        )
+
+    async def _save_cached_analysis(self, cache_key: Dict[str, str], update_data: Dict[str, Any]):
+        now = datetime.utcnow()
+        try:
+            await self.analysis_cache.update_one(
+                cache_key,
                 {"$set": {
-                    "analysis_status": "failed",
-                    "updated_at": datetime.utcnow(),
-                }}
+                    "analysis": update_data["analysis"],
+                    "keywords": update_data.get("keywords", []),
+                    "embedding": update_data.get("embedding"),
+                    "used_at": now,
+                }, "$setOnInsert": {"created_at": now, "hit_count": 0}},
+                upsert=True,
             )
+        except Exception as e:
+            print(f"[TranscriptService] ⚠️ 写入分析缓存失败（不影响分析结果）: {e}")
 
-    async def _call_llm_analyze(self, doc: dict) -> dict:
-        """调用 LLM 执行笔录结构化分析"""
-        import httpx
-        from app.services.ai_service import get_ai_config, LLM_TIMEOUT
+    async def _apply_analysis(
+        self, case_id: str, transcript_id: str, doc: dict, cached: dict, cache_key: Dict[str, str]
+    ):
+        await self.transcripts.update_one(
+            {"case_id": case_id, "transcript_id": transcript_id},
+            {"$set": self._cached_analysis_fields(doc, cached, cache_key)}
+        )
 
-        config = await get_ai_config(self.db)
-        api_url = config["api_url"]
-        api_key = config["api_key"]
-        model_name = config["model_name"]
-        skip_ssl = config.get("skip_ssl_verify", False)
+    def _cached_analysis_fields(self, doc: dict, cached: dict, cache_key: Dict[str, str]) -> dict:
+        keywords = cached.get("keywords", [])
+        return {
+            "analysis": cached["analysis"],
+            "keywords": keywords,
+            "search_terms": transcript_search_terms({**doc, "keywords": keywords, "analysis": cached["analysis"]}),
+            "embedding": cached.get("embedding"),
+            "content_hash": cache_key["content_hash"],
+            "analysis_status": "analyzed",
+            "analysis_error": None,
+            "analysis_cached": True,
+            "updated_at": datetime.utcnow(),
+        }
+
+    async def apply_cached_analysis(self, case_id: str, transcript_id: str) -> bool:
+        """相同内容已有分析结果时直接写入该笔录，返回是否命中"""
+        doc = await self.transcripts.find_one(
+            {"case_id": case_id, "transcript_id": transcript_id},
+            {"_id": 0, "content": 1, "content_hash": 1, "title": 1, "type": 1,
+             "subject_name": 1, "subject_role": 1}
+        )
+        if not doc:
+            return False
+        cache_key = await self._analysis_cache_key(doc)
+        cached = await self._get_cached_analysis(cache_key)
+        if not cached:
+            return False
+        await self._apply_analysis(case_id, transcript_id, doc, cached, cache_key)
+        print(f"[TranscriptService] ♻️ 笔录内容命中分析缓存，跳过 LLM 分析: {transcript_id}")
+        return True
+
+    async def _call_llm_analyze(self, doc: dict, progress: Optional[ProgressCallback] = None) -> dict:
+        """调用 LLM 执行笔录结构化分析（长笔录分块分析后合并）"""
+        if len(doc.get("content", "")) > TRANSCRIPT_CHUNK_THRESHOLD:
+            return await self._map_reduce_analyze(doc, progress or _noop_progress)
 
         system_prompt = self._build_analysis_system_prompt()
         user_prompt = self._build_analysis_user_prompt(doc)
@@ -275,33 +569,121 @@ class TranscriptService:
             {"role": "user", "content": user_prompt},
         ]
 
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}",
-        }
+        content = await self._call_analysis_llm(
+            messages, max_tokens=6000, priority=PRIORITY_TRANSCRIPT_ANALYSIS
+        )
 
-        payload = {
-            "model": model_name,
-            "messages": messages,
-            "temperature": 0,
-            "max_tokens": 6000,
-        }
+        # 解析 JSON 结果
+        analysis = self._parse_analysis_json(content)
+        return analysis
 
-        # 使用较长超时（笔录分析输出较多）
-        analysis_timeout = httpx.Timeout(
-            connect=30.0, read=300.0, write=30.0, pool=30.0
+    async def _map_reduce_analyze(self, doc: dict, progress: ProgressCallback) -> dict:
+        """
+        长笔录分块分析：
+        1. map：按问答轮次切分，各分块并发分析（并发数不超过 LLM 调度器的 provider 并发上限）
+        2. 分块结果按 (分块内容, 提示词版本, 模型) 缓存，笔录小幅修改后重新分析只会重跑变化的分块
+        3. reduce：合并人员/时间线/关键事实/关联法条等结构化要素，再由 LLM 汇总整体摘要
+        """
+        from app.services.ai_service import get_ai_config
+
+        config = await get_ai_config(self.db)
+        model = config.get("model_name", "")
+        chunks = split_transcript_turns(doc.get("content", ""), TRANSCRIPT_CHUNK_MAX_CHARS)
+        total = len(chunks)
+        limit = get_llm_dispatcher().get_limit(config.get("provider", "default"), config.get("max_concurrency"))
+        slots = asyncio.Semaphore(limit)
+        header = chunk_header(doc)
+        done = {"analyzed": 0, "cached": 0}
+        print(f"[TranscriptService] 🧩 笔录分块分析: {len(doc.get('content', ''))} 字 → {total} 块（并发 {limit}）")
+
+        async def analyze_chunk(index: int, chunk: str) -> dict:
+            key = chunk_cache_key(chunk, header, ANALYSIS_PROMPT_VERSION, model)
+            cached = await self.chunk_cache.find_one_and_update(
+                {"_id": key}, {"$set": {"used_at": datetime.utcnow()}}, projection={"analysis": 1}
+            )
+            if cached:
+                done["cached"] += 1
+            else:
+                messages = [
+                    {"role": "system", "content": self._build_chunk_system_prompt()},
+                    {"role": "user", "content": self._build_chunk_user_prompt(doc, chunk, index + 1, total)},
+                ]
+                async with slots:
+                    content = await self._call_analysis_llm(
+                        messages, max_tokens=4000, priority=PRIORITY_TRANSCRIPT_ANALYSIS
+                    )
+                result = self._parse_analysis_json(content)
+                if not result.get("parse_error"):
+                    now = datetime.utcnow()
+                    await self.chunk_cache.update_one(
+                        {"_id": key},
+                        {"$set": {"analysis": result, "used_at": now},
+                         "$setOnInsert": {"prompt_version": ANALYSIS_PROMPT_VERSION, "model": model, "created_at": now}},
+                        upsert=True,
+                    )
+                cached = {"analysis": result}
+            done["analyzed"] += 1
+            await progress({"stage": "llm_analysis", "chunks_total": total, "chunks_done": done["analyzed"]})
+            return cached["analysis"]
+
+        await progress({"stage": "llm_analysis", "chunks_total": total, "chunks_done": 0})
+        # 等全部分块结束后再抛出异常：已成功的分块写入缓存，任务重试时无需重跑
+        outcomes = await asyncio.gather(
+            *(analyze_chunk(i, c) for i, c in enumerate(chunks)), return_exceptions=True
         )
+        errors = [o for o in outcomes if isinstance(o, BaseException)]
+        if errors:
+            raise RuntimeError(f"{len(errors)}/{total} 个分块分析失败: {errors[0]}") from errors[0]
+        print(f"[TranscriptService] 🧩 分块分析完成: {total} 块，命中缓存 {done['cached']} 块")
+
+        await progress({"stage": "llm_reduce", "chunks_total": total, "chunks_done": total})
+        analysis = merge_chunk_analyses(outcomes)
+        analysis["summary"] = await self._reduce_chunk_summaries(doc, outcomes, analysis)
+        analysis["chunk_count"] = total
+        return analysis
 
-        async with httpx.AsyncClient(verify=not skip_ssl, timeout=analysis_timeout) as client:
-            response = await client.post(api_url, json=payload, headers=headers)
-            response.raise_for_status()
-            result = response.json()
+    async def _reduce_chunk_summaries(self, doc: dict, results: List[dict], merged: dict) -> str:
+        """由各分块摘要汇总整篇笔录摘要，失败时退化为拼接分块摘要"""
+        parts = "\n\n".join(
+            f"【第 {i} 部分】{r.get('summary', '')}" for i, r in enumerate(results, 1) if r.get("summary")
+        )
+        laws = "、".join(
+            f"《{l.get('law_title', '')}》{l.get('article_display', '')}" for l in merged.get("related_laws", [])[:10]
+        )
+        messages = [
+            {"role": "system", "content": "你是一名专业的公安执法辅助分析员。下面是同一份笔录按顺序分段分析得到的各部分摘要，"
+                                          "请综合为一份 200-500 字的整体摘要，覆盖案情概要、关键证据、法律适用建议。"
+                                          "直接输出摘要正文，不要输出 JSON 或其他说明。"},
+            {"role": "user", "content": f"{chunk_header(doc)}\n\n{parts}\n\n【各部分提及的关联法条】{laws or '无'}"},
+        ]
+        try:
+            summary = await self._call_analysis_llm(messages, max_tokens=1500, priority=PRIORITY_TRANSCRIPT_ANALYSIS)
+            if summary and summary.strip():
+                return summary.strip()
+        except Exception as e:
+            print(f"[TranscriptService] ⚠️ 汇总分块摘要失败，使用分块摘要拼接: {e}")
+        return fallback_summary(results)
 
-        content = result["choices"][0]["message"]["content"]
+    async def _call_analysis_llm(self, messages: List[dict], max_tokens: int, priority: int) -> str:
+        """
+        调用 LLM 执行分析任务，返回回复文本。
+        使用较长超时（分析输出较多），并以低于交互式对话的优先级排队。
+        """
+        from app.services.ai_service import get_ai_config, _call_llm, _llm_call_options, LLM_ANALYSIS_TIMEOUT
 
-        # 解析 JSON 结果
-        analysis = self._parse_analysis_json(content)
-        return analysis
+        config = await get_ai_config(self.db)
+        result = await _call_llm(
+            config["api_url"],
+            config["api_key"],
+            config["model_name"],
+            messages,
+            config.get("skip_ssl_verify", False),
+            timeout=LLM_ANALYSIS_TIMEOUT,
+            max_tokens=max_tokens,
+            priority=priority,
+            **_llm_call_options(config),
+        )
+        return result["choices"][0]["message"]["content"]
 
     def _build_analysis_system_prompt(self) -> str:
         """构建笔录分析系统提示词"""
@@ -352,6 +734,25 @@ JSON 结构如下：
 【笔录全文】
 {doc.get('content', '')}
 
+请按照系统指令要求，返回结构化的 JSON 分析结果。"""
+
+    def _build_chunk_system_prompt(self) -> str:
+        """分块分析系统提示词：在整篇分析要求基础上限定只分析当前部分"""
+        return self._build_analysis_system_prompt() + """
+
+【分段分析说明】
+- 笔录较长，本次只提供其中一部分，请只提取本部分出现的信息
+- 规范性检查只输出本部分能够确认的事项（如权利告知、签名通常只出现在开头或结尾部分），本部分未涉及的事项不要输出
+- summary 只概括本部分内容，100-200字"""
+
+    def _build_chunk_user_prompt(self, doc: dict, chunk: str, index: int, total: int) -> str:
+        return f"""请分析以下笔录片段：
+
+{chunk_header(doc, index, total)}
+
+【笔录片段】
+{chunk}
+
 请按照系统指令要求，返回结构化的 JSON 分析结果。"""
 
     def _parse_analysis_json(self, content: str) -> dict:
@@ -422,51 +823,25 @@ JSON 结构如下：
         """
         用项目法条库校验并丰富 LLM 输出的关联法条。
         策略：
-        1. 对 LLM 给出的每条法条，先按法律名称模糊匹配 laws 集合
-        2. 若命中法律，再按条号匹配 law_articles 集合获取原文
+        1. 所有法律名称在常驻内存的法规名称索引中一次性解析（别名/简称/全称）
+        2. 命中法律的条号统一写法后，用一次查询批量取回 law_articles 原文
         3. 命中的标记 matched=True 并附上数据库中的准确内容
         4. 未命中的保留 LLM 原始输出，标记 matched=False
         """
+        from app.services.law_citation_resolver import LawCitationResolver
+
         raw_laws = analysis.get("related_laws", [])
         if not raw_laws:
             return analysis
 
+        resolved = await LawCitationResolver(self.db).resolve(raw_laws)
         enriched = []
-        for item in raw_laws:
-            law_title = item.get("law_title", "").strip()
-            article_display = item.get("article_display", "").strip()
-            if not law_title:
-                enriched.append({**item, "matched": False})
-                continue
-
-            # 清理书名号
-            clean_title = re.sub(r'[《》]', '', law_title).strip()
-
-            # 1) 在 laws 集合中模糊匹配法律名称
-            law_doc = await self.laws.find_one(
-                {"title": {"$regex": re.escape(clean_title), "$options": "i"}},
-                {"_id": 0, "law_id": 1, "title": 1, "category": 1}
-            )
-            if not law_doc:
-                # 尝试去掉"中华人民共和国"前缀再匹配
-                short_title = re.sub(r'^中华人民共和国', '', clean_title)
-                if short_title != clean_title:
-                    law_doc = await self.laws.find_one(
-                        {"title": {"$regex": re.escape(short_title), "$options": "i"}},
-                        {"_id": 0, "law_id": 1, "title": 1, "category": 1}
-                    )
-                # 或者数据库中存的是全称，LLM 给的是简称
-                if not law_doc:
-                    law_doc = await self.laws.find_one(
-                        {"title": {"$regex": re.escape(clean_title)}},
-                        {"_id": 0, "law_id": 1, "title": 1, "category": 1}
-                    )
-
+        for item, hit in zip(raw_laws, resolved):
+            law_doc = hit["law"]
             if not law_doc:
                 enriched.append({**item, "matched": False})
                 continue
 
-            # 2) 匹配具体条文
             enriched_item = {
                 **item,
                 "matched": True,
@@ -474,21 +849,11 @@ JSON 结构如下：
                 "law_title": law_doc["title"],  # 用数据库中的准确名称
                 "category": law_doc.get("category", ""),
             }
-
-            if article_display:
-                # 从 article_display 中提取条号用于匹配
-                # 如 "第二百六十四条" → 直接用 article_display 匹配
-                article_doc = await self.law_articles.find_one(
-                    {
-                        "law_id": law_doc["law_id"],
-                        "article_display": {"$regex": re.escape(article_display)},
-                    },
-                    {"_id": 0, "article_num": 1, "article_display": 1, "content": 1}
-                )
-                if article_doc:
-                    enriched_item["article_display"] = article_doc["article_display"]
-                    enriched_item["article_content"] = article_doc["content"]
-                    enriched_item["article_num"] = article_doc.get("article_num")
+            article_doc = hit["article"]
+            if article_doc:
+                enriched_item["article_display"] = article_doc["article_display"]
+                enriched_item["article_content"] = article_doc["content"]
+                enriched_item["article_num"] = article_doc.get("article_num")
 
             enriched.append(enriched_item)
 
@@ -509,16 +874,66 @@ JSON 结构如下：
         if not case:
             return None
         # 案件存在但未做过交叉分析时，返回 not_started 状态
-        return case.get("cross_analysis") or {"analysis_status": "not_started"}
+        result = case.get("cross_analysis") or {"analysis_status": "not_started"}
+        job = await JobQueue(self.db).latest_job(job_key(JOB_CROSS_ANALYZE, case_id))
+        if job:
+            result["job"] = job_summary(job)
+        return result
+
+    async def enqueue_cross_analysis(self, case_id: str, full: bool = False) -> dict:
+        """
+        提交交叉分析任务（同一案件已有未完成任务时直接返回该任务）。
+        full=True 时忽略上次结果，全量重新比对；已有排队中的增量任务会被升级为全量。
+        """
+        await self.mark_cross_analysis_queued(case_id)
+        return await JobQueue(self.db).enqueue(
+            JOB_CROSS_ANALYZE,
+            {"case_id": case_id, "full": full},
+            dedupe_key=job_key(JOB_CROSS_ANALYZE, case_id),
+            upgrade={"full": True} if full else None,
+        )
+
+    async def mark_cross_analysis_queued(self, case_id: str):
+        """交叉分析任务已提交：前端按 analyzing 展示并轮询"""
+        await self.cases.update_one(
+            {"case_id": case_id},
+            {"$set": {
+                "cross_analysis": {
+                    "analysis_status": "analyzing",
+                    "analyzed_at": datetime.utcnow(),
+                },
+                "updated_at": datetime.utcnow(),
+            }}
+        )
 
-    async def cross_analyze(self, case_id: str):
+    async def mark_cross_analysis_failed(self, case_id: str, error: str = ""):
+        """交叉分析任务最终失败（重试次数用尽）"""
+        await self.cases.update_one(
+            {"case_id": case_id},
+            {"$set": {
+                "cross_analysis": {
+                    "analysis_status": "failed",
+                    "error": error,
+                    "analyzed_at": datetime.utcnow(),
+                },
+                "updated_at": datetime.utcnow(),
+            }}
+        )
+
+    async def cross_analyze(self, case_id: str, progress: Optional[ProgressCallback] = None, full: bool = False):
         """
-        触发交叉分析（异步后台任务）
+        交叉分析（由任务队列 worker 执行）
         分步策略：
         1. 拼接各笔录分析摘要 + 时间线 + 关键事实
         2. LLM 发现矛盾点、评估一致性
         3. 针对矛盾点提取原文段落做详细比对
+
+        增量模式：案件上保存各笔录要素摘要的指纹和上次的交叉分析结果（cross_analysis_state），
+        只有新增/变更的笔录与已有的统一时间线、证据链、矛盾点比对，结果合并；
+        笔录被删除、变化过多、提示词版本变化或 full=True 时全量重算。
+        失败时抛出异常，由任务队列决定重试或调用 mark_cross_analysis_failed。
         """
+        progress = progress or _noop_progress
         # 标记分析中
         await self.cases.update_one(
             {"case_id": case_id},
@@ -543,21 +958,65 @@ JSON 结构如下：
             if len(transcripts) < 2:
                 raise ValueError("至少需要 2 份已分析的笔录才能交叉分析")
 
-            # === 第 1 步：拼接要素摘要，发现矛盾 + 一致性评分 ===
-            cross_result = await self._cross_step1_compare(transcripts)
-
-            # === 第 2 步：针对矛盾点从原文提取详细引用 ===
-            if cross_result.get("contradictions"):
-                cross_result = await self._cross_step2_enrich(transcripts, cross_result)
+            digests = {t["transcript_id"]: self._transcript_digest(t) for t in transcripts}
+            digest_hashes = {
+                tid: hashlib.sha256(text.encode("utf-8")).hexdigest() for tid, text in digests.items()
+            }
+            case = await self.cases.find_one({"case_id": case_id}, {"_id": 0, "cross_analysis_state": 1})
+            state = (case or {}).get("cross_analysis_state") or {}
+            changed_ids = None if full else self._plan_incremental_cross(state, digest_hashes)
+
+            if changed_ids is None:
+                # === 全量：第 1 步 拼接要素摘要，发现矛盾 + 一致性评分 ===
+                await progress({"stage": "compare", "transcripts": len(transcripts)})
+                cross_result = await self._cross_step1_compare(transcripts)
+
+                # === 第 2 步：针对矛盾点从原文提取详细引用 ===
+                if cross_result.get("contradictions"):
+                    await progress({"stage": "enrich", "contradictions": len(cross_result["contradictions"])})
+                    cross_result = await self._cross_step2_enrich(transcripts, cross_result)
+                cross_result["analysis_mode"] = "full"
+            elif not changed_ids:
+                # 笔录要素均未变化：直接沿用上次结果
+                cross_result = dict(state["result"])
+                cross_result["analysis_mode"] = "unchanged"
+            else:
+                await progress({"stage": "compare_incremental", "transcripts": len(transcripts), "changed": len(changed_ids)})
+                cross_result = await self._cross_compare_incremental(transcripts, changed_ids, state["result"], digests)
+                new_contradictions = cross_result.get("contradictions", [])
+                if new_contradictions:
+                    await progress({"stage": "enrich", "contradictions": len(new_contradictions)})
+                    cross_result = await self._cross_step2_enrich(transcripts, cross_result)
+                # 合并：保留与变更笔录无关的已有矛盾点
+                kept = [
+                    c for c in state["result"].get("contradictions", [])
+                    if not any(src.get("transcript_id") in changed_ids for src in c.get("sources", []))
+                ]
+                merged = kept + cross_result.get("contradictions", [])
+                merged.sort(key=lambda c: _SEVERITY_ORDER.get(c.get("severity"), 3))
+                cross_result["contradictions"] = merged
+                cross_result["analysis_mode"] = "incremental"
+                cross_result["changed_transcripts"] = changed_ids
+                print(f"[TranscriptService] 🔁 增量交叉分析: {len(changed_ids)}/{len(transcripts)} 份笔录变化")
 
             # 保存结果
             cross_result["analysis_status"] = "analyzed"
             cross_result["analyzed_at"] = datetime.utcnow()
+            cross_result["transcript_count"] = len(transcripts)
 
             await self.cases.update_one(
                 {"case_id": case_id},
                 {"$set": {
                     "cross_analysis": cross_result,
+                    "cross_analysis_state": {
+                        "prompt_version": CROSS_ANALYSIS_PROMPT_VERSION,
+                        "digests": digest_hashes,
+                        "result": {
+                            k: cross_result.get(k)
+                            for k in ("contradictions", "unified_timeline", "evidence_chain", "consistency_score", "summary")
+                        },
+                        "updated_at": datetime.utcnow(),
+                    },
                     "updated_at": datetime.utcnow(),
                 }}
             )
@@ -565,57 +1024,150 @@ JSON 结构如下：
 
         except Exception as e:
             print(f"[TranscriptService] ❌ 交叉分析失败: {e}")
-            await self.cases.update_one(
-                {"case_id": case_id},
-                {"$set": {
-                    "cross_analysis": {
-                        "analysis_status": "failed",
-                        "error": str(e),
-                        "analyzed_at": datetime.utcnow(),
-                    },
-                    "updated_at": datetime.utcnow(),
-                }}
-            )
+            raise
 
-    async def _cross_step1_compare(self, transcripts: List[dict]) -> dict:
+    def _plan_incremental_cross(self, state: dict, digest_hashes: Dict[str, str]) -> Optional[List[str]]:
         """
-        交叉分析第 1 步：拼接各笔录分析摘要 → 发现矛盾 + 一致性评分
+        判断能否增量交叉分析：返回需要比对的笔录 ID 列表（空列表表示无变化），None 表示需要全量重算。
         """
-        import httpx
-        from app.services.ai_service import get_ai_config
+        previous = state.get("digests") or {}
+        if not previous or not state.get("result") or state.get("prompt_version") != CROSS_ANALYSIS_PROMPT_VERSION:
+            return None
+        # 有笔录被删除（或不再是已分析状态）：已合并的时间线、证据链中仍含其内容，只能全量重算
+        if set(previous) - set(digest_hashes):
+            return None
+        changed = [tid for tid, h in digest_hashes.items() if previous.get(tid) != h]
+        if len(changed) > len(digest_hashes) * CROSS_INCREMENTAL_MAX_CHANGED_RATIO:
+            return None
+        return changed
+
+    def _transcript_digest(self, t: dict) -> str:
+        """单份笔录的要素摘要（摘要 + 时间线 + 关键事实 + 涉及人员），交叉比对的输入"""
+        analysis = t.get("analysis", {})
+        entry = f"【{t['title']}】（{t['subject_name']}，{t['subject_role']}）\n"
+        entry += f"摘要：{analysis.get('summary', '无')}\n"
+
+        timeline = analysis.get("timeline", [])
+        if timeline:
+            entry += "时间线：\n"
+            for ev in timeline:
+                entry += f"  - {ev.get('time', '')}: {ev.get('event', '')}\n"
+
+        facts = analysis.get("key_facts", [])
+        if facts:
+            entry += "关键事实：\n"
+            for f in facts:
+                entry += f"  - [{f.get('category', '')}] {f.get('description', '')}\n"
+
+        persons = analysis.get("persons", [])
+        if persons:
+            entry += "涉及人员：\n"
+            for p in persons:
+                entry += f"  - {p.get('name', '')}（{p.get('role', '')}）: {p.get('description', '')}\n"
+        return entry
+
+    def _fill_source_transcript_ids(self, contradictions: List[dict], transcripts: List[dict]):
+        """补充 transcript_id（LLM 可能只返回人名，需要映射）"""
+        name_id_map = {t["subject_name"]: t["transcript_id"] for t in transcripts}
+        for c in contradictions:
+            for src in c.get("sources", []):
+                if not src.get("transcript_id"):
+                    src["transcript_id"] = name_id_map.get(src.get("person", ""), "")
 
-        config = await get_ai_config(self.db)
-        api_url = config["api_url"]
-        api_key = config["api_key"]
-        model_name = config["model_name"]
-        skip_ssl = config.get("skip_ssl_verify", False)
+    async def _cross_compare_incremental(
+        self, transcripts: List[dict], changed_ids: List[str], previous: dict, digests: Dict[str, str]
+    ) -> dict:
+        """
+        增量交叉比对：新增/变更的笔录要素摘要 vs 已有的统一时间线、证据链和矛盾点。
+        返回的 contradictions 只包含涉及这些笔录的矛盾点，时间线/证据链/评分/总结为合并后的完整结果。
+        """
+        changed = set(changed_ids)
+        existing = [t for t in transcripts if t["transcript_id"] not in changed]
+        existing_list = "\n".join(f"- 【{t['title']}】（{t['subject_name']}，{t['subject_role']}）" for t in existing)
+        changed_text = "\n---\n".join(digests[tid] for tid in changed_ids)
+        previous_text = json.dumps(
+            {k: previous.get(k) for k in ("unified_timeline", "evidence_chain", "consistency_score", "summary")},
+            ensure_ascii=False, default=str,
+        )
+        previous_contradictions = "\n".join(
+            f"- [{c.get('type', '')}] {c.get('description', '')}"
+            for c in previous.get("contradictions", [])
+            if not any(src.get("transcript_id") in changed for src in c.get("sources", []))
+        ) or "无"
+
+        system_prompt = """你是一名专业的公安案件分析员，擅长对多份笔录进行交叉比对分析。
+
+同一案件此前已完成交叉分析，现在有新增或内容变更的笔录。你需要：
+
+1. **发现矛盾点（contradictions）**：只找出新增/变更笔录与已有统一时间线、证据链、已知矛盾之间，以及新增/变更笔录彼此之间的新矛盾；已知矛盾不要重复输出
+2. **更新统一时间线（unified_timeline）**：将新增/变更笔录的事件并入已有时间线，标注各方一致或有异议；变更笔录的旧陈述以新内容为准
+3. **更新证据链（evidence_chain）**：合并新笔录涉及的证据
+4. **评估一致性（consistency_score）**：给出合并后整体 0-100 的一致性评分
+5. **总结（summary）**：合并后的综合分析摘要
+
+【输出格式】
+返回严格的 JSON 格式，不要包含 markdown 代码块标记。
+
+{
+  "contradictions": [
+    {
+      "type": "时间矛盾/事实矛盾/数量矛盾/细节矛盾",
+      "severity": "high/medium/low",
+      "description": "矛盾描述",
+      "sources": [
+        {"transcript_id": "", "person": "某某", "quote": "相关陈述摘要"}
+      ]
+    }
+  ],
+  "unified_timeline": [
+    {"time": "时间描述", "event": "事件描述", "agreed_by": ["一致的笔录人"], "disputed_by": ["有异议的笔录人"]}
+  ],
+  "evidence_chain": [
+    {"type": "言证/物证/书证/电子证据", "description": "证据描述", "status": "已获取/待补充", "source_transcripts": ["来源笔录标题"]}
+  ],
+  "consistency_score": 0,
+  "summary": ""
+}
+
+【注意】
+- 矛盾点按严重程度排序（high > medium > low）
+- 时间线按时间先后排序
+- sources 中的 person 填写笔录中的被询问人姓名"""
+
+        user_prompt = f"""【已参与交叉分析的笔录】
+{existing_list}
+
+【已有交叉分析结果】
+{previous_text}
+
+【已知矛盾点】
+{previous_contradictions}
 
+【新增/变更的笔录（{len(changed_ids)} 份）】
+{changed_text}
+
+请返回 JSON 格式的增量交叉分析结果。"""
+
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ]
+        content = await self._call_analysis_llm(
+            messages, max_tokens=6000, priority=PRIORITY_CROSS_ANALYSIS
+        )
+        cross_result = self._parse_analysis_json(content)
+        for key in ("unified_timeline", "evidence_chain", "consistency_score", "summary"):
+            if not cross_result.get(key) and previous.get(key):
+                cross_result[key] = previous[key]
+        self._fill_source_transcript_ids(cross_result.get("contradictions", []), transcripts)
+        return cross_result
+
+    async def _cross_step1_compare(self, transcripts: List[dict]) -> dict:
+        """
+        交叉分析第 1 步：拼接各笔录分析摘要 → 发现矛盾 + 一致性评分
+        """
         # 拼接各笔录的分析摘要
-        summaries = []
-        for t in transcripts:
-            analysis = t.get("analysis", {})
-            entry = f"【{t['title']}】（{t['subject_name']}，{t['subject_role']}）\n"
-            entry += f"摘要：{analysis.get('summary', '无')}\n"
-
-            timeline = analysis.get("timeline", [])
-            if timeline:
-                entry += "时间线：\n"
-                for ev in timeline:
-                    entry += f"  - {ev.get('time', '')}: {ev.get('event', '')}\n"
-
-            facts = analysis.get("key_facts", [])
-            if facts:
-                entry += "关键事实：\n"
-                for f in facts:
-                    entry += f"  - [{f.get('category', '')}] {f.get('description', '')}\n"
-
-            persons = analysis.get("persons", [])
-            if persons:
-                entry += "涉及人员：\n"
-                for p in persons:
-                    entry += f"  - {p.get('name', '')}（{p.get('role', '')}）: {p.get('description', '')}\n"
-
-            summaries.append(entry)
+        summaries = [self._transcript_digest(t) for t in transcripts]
 
         combined_text = "\n---\n".join(summaries)
 
@@ -676,80 +1228,116 @@ JSON 结构如下：
 
 请返回 JSON 格式的交叉分析结果。"""
 
-        # 构建笔录标题→ID映射，供后续引用
-        title_id_map = {t["title"]: t["transcript_id"] for t in transcripts}
-        name_id_map = {t["subject_name"]: t["transcript_id"] for t in transcripts}
-
         messages = [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt},
         ]
 
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}",
-        }
-
-        payload = {
-            "model": model_name,
-            "messages": messages,
-            "temperature": 0,
-            "max_tokens": 6000,
-        }
-
-        analysis_timeout = httpx.Timeout(connect=30.0, read=300.0, write=30.0, pool=30.0)
-
-        async with httpx.AsyncClient(verify=not skip_ssl, timeout=analysis_timeout) as client:
-            response = await client.post(api_url, json=payload, headers=headers)
-            response.raise_for_status()
-            result = response.json()
-
-        content = result["choices"][0]["message"]["content"]
+        content = await self._call_analysis_llm(
+            messages, max_tokens=6000, priority=PRIORITY_CROSS_ANALYSIS
+        )
         cross_result = self._parse_analysis_json(content)
-
-        # 补充 transcript_id（LLM 可能只返回人名，需要映射）
-        for c in cross_result.get("contradictions", []):
-            for src in c.get("sources", []):
-                if not src.get("transcript_id"):
-                    person = src.get("person", "")
-                    src["transcript_id"] = name_id_map.get(person, "")
-
+        self._fill_source_transcript_ids(cross_result.get("contradictions", []), transcripts)
         return cross_result
 
     async def _cross_step2_enrich(self, transcripts: List[dict], cross_result: dict) -> dict:
         """
-        交叉分析第 2 步：针对每个矛盾点，从原始笔录提取相关段落做详细比对
+        交叉分析第 2 步：针对每个矛盾点，从原始笔录提取相关段落做详细比对。
+        矛盾点按 CROSS_ENRICH_BATCH_SIZE 分批、批次间并发（不超过 LLM 调度器的 provider 并发上限）；
+        每批只附带所涉笔录中人名/引用附近的原文片段（按偏移索引定位）。
+        某批失败时该批保留原矛盾点，其余批次的结果照常采用。
         """
-        import httpx
         from app.services.ai_service import get_ai_config
 
-        config = await get_ai_config(self.db)
-        api_url = config["api_url"]
-        api_key = config["api_key"]
-        model_name = config["model_name"]
-        skip_ssl = config.get("skip_ssl_verify", False)
-
         contradictions = cross_result.get("contradictions", [])
         if not contradictions:
             return cross_result
 
-        # 拼接所有矛盾点描述
-        contra_texts = []
-        for i, c in enumerate(contradictions, 1):
-            persons = ", ".join(s.get("person", "") for s in c.get("sources", []))
-            contra_texts.append(f"矛盾 {i}: [{c.get('type', '')}] {c.get('description', '')}（涉及: {persons}）")
-
-        # 拼接各笔录原文的关键段落（控制总 token 量）
-        transcript_excerpts = []
-        for t in transcripts:
-            content = t.get("content", "")
-            # 截取前 3000 字（避免超长）
-            excerpt = content[:3000] if len(content) > 3000 else content
-            transcript_excerpts.append(
-                f"【{t['title']}】（{t['subject_name']}，{t['subject_role']}）\n{excerpt}"
-            )
+        by_id = {t["transcript_id"]: t for t in transcripts}
+        # 每个矛盾点的定位词：涉及人员姓名 + 引用/描述中的短句
+        terms_per_contradiction = []
+        for c in contradictions:
+            terms = [src.get("person", "") for src in c.get("sources", [])]
+            for src in c.get("sources", []):
+                terms.extend(quote_terms(src.get("quote", "")))
+            terms.extend(quote_terms(c.get("description", "")))
+            terms_per_contradiction.append([t for t in dict.fromkeys(terms) if t])
+        all_terms = [t for terms in terms_per_contradiction for t in terms]
+        offset_index = {
+            t["transcript_id"]: build_offset_index(t.get("content", ""), all_terms) for t in transcripts
+        }
+
+        config = await get_ai_config(self.db)
+        limit = get_llm_dispatcher().get_limit(config.get("provider", "default"), config.get("max_concurrency"))
+        slots = asyncio.Semaphore(limit)
+        batches = [
+            list(range(i, min(i + CROSS_ENRICH_BATCH_SIZE, len(contradictions))))
+            for i in range(0, len(contradictions), CROSS_ENRICH_BATCH_SIZE)
+        ]
+
+        async def enrich_batch(indexes: List[int]) -> List[dict]:
+            batch = [contradictions[i] for i in indexes]
+            terms = list(dict.fromkeys(t for i in indexes for t in terms_per_contradiction[i]))
+            involved = [
+                by_id[src["transcript_id"]] for c in batch for src in c.get("sources", [])
+                if src.get("transcript_id") in by_id
+            ]
+            involved = list({t["transcript_id"]: t for t in involved}.values()) or transcripts
+
+            contra_texts = []
+            for n, c in enumerate(batch, 1):
+                persons = ", ".join(s.get("person", "") for s in c.get("sources", []))
+                contra_texts.append(f"矛盾 {n}: [{c.get('type', '')}] {c.get('description', '')}（涉及: {persons}）")
+            transcript_excerpts = []
+            for t in involved:
+                excerpt = excerpt_around(
+                    t.get("content", ""), offset_index[t["transcript_id"]], terms,
+                    radius=CROSS_ENRICH_EXCERPT_RADIUS, max_chars=CROSS_ENRICH_EXCERPT_MAX_CHARS,
+                )
+                transcript_excerpts.append(
+                    f"【{t['title']}】（{t['subject_name']}，{t['subject_role']}）\n{excerpt}\n"
+                )
+
+            user_prompt = f"""已发现的矛盾点：
+{chr(10).join(contra_texts)}
 
-        system_prompt = """你是一名专业的公安案件分析员。现在需要你针对已发现的矛盾点，从原始笔录中提取准确的原文引用，以增强矛盾分析的可信度。
+各份笔录原文（相关片段）：
+{"".join(transcript_excerpts)}
+
+请从原文中提取准确引用，返回增强后的矛盾分析。"""
+            messages = [
+                {"role": "system", "content": self._build_enrich_system_prompt()},
+                {"role": "user", "content": user_prompt},
+            ]
+            async with slots:
+                content = await self._call_analysis_llm(
+                    messages, max_tokens=min(4000, 800 * len(batch) + 400), priority=PRIORITY_CROSS_ANALYSIS
+                )
+            enriched = self._parse_json_array(content)
+            if not enriched:
+                raise ValueError("返回内容无法解析为矛盾点数组")
+            return enriched
+
+        outcomes = await asyncio.gather(*(enrich_batch(b) for b in batches), return_exceptions=True)
+
+        result: List[dict] = []
+        failed = 0
+        for indexes, outcome in zip(batches, outcomes):
+            if isinstance(outcome, BaseException):
+                failed += 1
+                print(f"[TranscriptService] ⚠️ 矛盾点深入分析失败（保留该批原结果）: {outcome}")
+                result.extend(contradictions[i] for i in indexes)
+            else:
+                result.extend(outcome)
+        self._fill_source_transcript_ids(result, transcripts)
+        cross_result["contradictions"] = result
+        if failed:
+            print(f"[TranscriptService] ⚠️ 矛盾点深入分析: {failed}/{len(batches)} 批失败")
+        return cross_result
+
+    def _build_enrich_system_prompt(self) -> str:
+        """矛盾点深入比对系统提示词"""
+        return """你是一名专业的公安案件分析员。现在需要你针对已发现的矛盾点，从原始笔录中提取准确的原文引用，以增强矛盾分析的可信度。
 
 请对每个矛盾点：
 1. 找到各方在原始笔录中的相关陈述
@@ -772,76 +1360,24 @@ JSON 结构如下：
 
 只返回 JSON 数组，不要包含 markdown 代码块标记。"""
 
-        user_prompt = f"""已发现的矛盾点：
-{chr(10).join(contra_texts)}
-
-各份笔录原文（摘要）：
-{"".join(transcript_excerpts)}
-
-请从原文中提取准确引用，返回增强后的矛盾分析。"""
-
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
-        ]
-
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}",
-        }
-
-        payload = {
-            "model": model_name,
-            "messages": messages,
-            "temperature": 0,
-            "max_tokens": 4000,
-        }
-
-        name_id_map = {t["subject_name"]: t["transcript_id"] for t in transcripts}
-
-        analysis_timeout = httpx.Timeout(connect=30.0, read=300.0, write=30.0, pool=30.0)
-
+    def _parse_json_array(self, content: str) -> Optional[List[dict]]:
+        """解析 LLM 返回的 JSON 数组（兼容 markdown 代码块包裹）"""
+        cleaned = (content or "").strip()
+        if cleaned.startswith("```"):
+            lines = cleaned.split("\n")
+            end = len(lines) - 1 if lines[-1].strip() == "```" else len(lines)
+            cleaned = "\n".join(lines[1:end]).strip()
         try:
-            async with httpx.AsyncClient(verify=not skip_ssl, timeout=analysis_timeout) as client:
-                response = await client.post(api_url, json=payload, headers=headers)
-                response.raise_for_status()
-                result = response.json()
-
-            content = result["choices"][0]["message"]["content"]
-
-            # 解析返回的矛盾点数组
-            cleaned = content.strip()
-            if cleaned.startswith("```"):
-                lines = cleaned.split("\n")
-                start = 1
-                end = len(lines) - 1 if lines[-1].strip() == "```" else len(lines)
-                cleaned = "\n".join(lines[start:end]).strip()
-
+            parsed = json.loads(cleaned)
+        except json.JSONDecodeError:
+            match = re.search(r'\[[\s\S]*\]', cleaned)
+            if not match:
+                return None
             try:
-                enriched = json.loads(cleaned)
+                parsed = json.loads(match.group())
             except json.JSONDecodeError:
-                match = re.search(r'\[[\s\S]*\]', cleaned)
-                if match:
-                    try:
-                        enriched = json.loads(match.group())
-                    except json.JSONDecodeError:
-                        enriched = None
-                else:
-                    enriched = None
-
-            if enriched and isinstance(enriched, list):
-                # 补充 transcript_id
-                for c in enriched:
-                    for src in c.get("sources", []):
-                        if not src.get("transcript_id"):
-                            person = src.get("person", "")
-                            src["transcript_id"] = name_id_map.get(person, "")
-                cross_result["contradictions"] = enriched
-
-        except Exception as e:
-            print(f"[TranscriptService] ⚠️ 矛盾点深入分析失败（保留原结果）: {e}")
-
-        return cross_result
+                return None
+        return parsed if isinstance(parsed, list) else None
 
     # ==================== 知识库搜索 ====================
 
@@ -854,19 +1390,9 @@ JSON 结构如下：
         page: int = 1,
         page_size: int = 20,
     ) -> dict:
-        """全局搜索笔录知识库（跨案件）"""
-        import re as _re
-        safe_kw = _re.escape(keyword)
-
+        """全局搜索笔录知识库（跨案件），关键词经 search_terms n-gram 索引取候选"""
         # 构建搜索条件
-        query: Dict[str, Any] = {
-            "$or": [
-                {"content": {"$regex": safe_kw, "$options": "i"}},
-                {"keywords": {"$regex": safe_kw, "$options": "i"}},
-                {"analysis.summary": {"$regex": safe_kw, "$options": "i"}},
-                {"title": {"$regex": safe_kw, "$options": "i"}},
-            ]
-        }
+        query: Dict[str, Any] = keyword_query(keyword, TRANSCRIPT_SEARCH_FIELDS)
         if transcript_type:
             query["type"] = transcript_type
         if subject_role:
@@ -883,59 +1409,83 @@ JSON 结构如下：
                         "page_size": page_size, "total_pages": 0}
             query["case_id"] = {"$in": case_ids}
 
-        total = await self.transcripts.count_documents(query)
         skip = (page - 1) * page_size
+        kw_lower = keyword.lower()
+        kw_len = len(keyword)
+
+        # 一次聚合完成：计数 + 分页 + 关联案件名称 + 服务端截取匹配片段（不返回全文）
+        # 排序只携带 _id 与 created_at，当前页的完整文档在分页后按 _id 取回，
+        # 全文、向量、检索词不经过排序阶段（避免超出排序内存上限）
+        pipeline = [
+            {"$match": query},
+            {"$project": {"created_at": 1}},
+            {"$sort": {"created_at": -1}},
+            {"$facet": {
+                "total": [{"$count": "count"}],
+                "items": [
+                    {"$skip": skip},
+                    {"$limit": page_size},
+                    {"$lookup": {
+                        "from": COLLECTION_TRANSCRIPTS,
+                        "localField": "_id",
+                        "foreignField": "_id",
+                        "pipeline": [{"$project": {"embedding": 0, "search_terms": 0}}],
+                        "as": "doc",
+                    }},
+                    {"$unwind": "$doc"},
+                    {"$replaceWith": "$doc"},
+                    {"$lookup": {
+                        "from": COLLECTION_CASES,
+                        "localField": "case_id",
+                        "foreignField": "case_id",
+                        "pipeline": [{"$project": {"_id": 0, "case_name": 1, "case_type": 1}}],
+                        "as": "case",
+                    }},
+                    {"$set": {
+                        "_pos": {"$indexOfCP": [{"$toLower": {"$ifNull": ["$content", ""]}}, kw_lower]},
+                        "_len": {"$strLenCP": {"$ifNull": ["$content", ""]}},
+                    }},
+                    {"$set": {
+                        "match_snippet": {"$cond": [
+                            {"$gte": ["$_pos", 0]},
+                            {"$let": {
+                                "vars": {
+                                    "start": {"$max": [0, {"$subtract": ["$_pos", 40]}]},
+                                    "end": {"$min": ["$_len", {"$add": ["$_pos", kw_len + 40]}]},
+                                },
+                                "in": {"$concat": [
+                                    {"$cond": [{"$gt": ["$$start", 0]}, "...", ""]},
+                                    {"$substrCP": ["$content", "$$start", {"$subtract": ["$$end", "$$start"]}]},
+                                    {"$cond": [{"$lt": ["$$end", "$_len"]}, "...", ""]},
+                                ]},
+                            }},
+                            "",
+                        ]},
+                        "case_name": {"$ifNull": [{"$first": "$case.case_name"}, ""]},
+                        "case_type_display": {"$ifNull": [{"$first": "$case.case_type"}, ""]},
+                        "summary": "$analysis.summary",
+                        "related_laws": {"$slice": [{"$ifNull": ["$analysis.related_laws", []]}, 3]},
+                    }},
+                    {"$project": {
+                        "_id": 0, "content": 0, "embedding": 0, "analysis": 0, "search_terms": 0,
+                        "case": 0, "_pos": 0, "_len": 0,
+                    }},
+                ],
+            }},
+        ]
+        result = await self.transcripts.aggregate(pipeline, allowDiskUse=True).to_list(length=1)
+        facet = result[0] if result else {"total": [], "items": []}
+        total = facet["total"][0]["count"] if facet["total"] else 0
 
-        cursor = self.transcripts.find(
-            query,
-            {
-                "_id": 0,
-                "embedding": 0,
-                "content": 0,  # 不返回全文，后面单独截取匹配片段
-            }
-        ).sort("created_at", -1).skip(skip).limit(page_size)
-
-        raw_items = await cursor.to_list(length=page_size)
-
-        # 高亮匹配内容（从原文截取匹配片段）
         items = []
-        for item in raw_items:
-            tid = item["transcript_id"]
-            # 重新读取 content 做片段截取
-            full_doc = await self.transcripts.find_one(
-                {"transcript_id": tid}, {"_id": 0, "content": 1}
-            )
-            match_snippet = ""
-            if full_doc and full_doc.get("content"):
-                text = full_doc["content"]
-                m = _re.search(safe_kw, text, _re.IGNORECASE)
-                if m:
-                    start = max(0, m.start() - 40)
-                    end = min(len(text), m.end() + 40)
-                    match_snippet = ("..." if start > 0 else "") + text[start:end] + ("..." if end < len(text) else "")
-            item["match_snippet"] = match_snippet
-
-            # 附带案件名称
-            case_doc = await self.cases.find_one(
-                {"case_id": item.get("case_id")},
-                {"_id": 0, "case_name": 1, "case_type": 1}
-            )
-            item["case_name"] = case_doc["case_name"] if case_doc else ""
-            item["case_type_display"] = case_doc.get("case_type", "") if case_doc else ""
-
+        for item in facet["items"]:
             # 简化分析字段
-            analysis = item.pop("analysis", None)
-            if analysis:
-                item["summary"] = analysis.get("summary", "")
-                laws = analysis.get("related_laws", [])
-                item["related_laws_display"] = [
-                    f"《{l.get('law_title', '')}》{l.get('article_display', '')}"
-                    for l in laws[:3]
-                ]
-            else:
-                item["summary"] = None
-                item["related_laws_display"] = []
-
+            laws = item.pop("related_laws", [])
+            item["summary"] = item.get("summary")
+            item["related_laws_display"] = [
+                f"《{l.get('law_title', '')}》{l.get('article_display', '')}"
+                for l in laws
+            ]
             items.append(item)
 
         total_pages = (total + page_size - 1) // page_size
@@ -0,0 +1,171 @@
+"""
+用量计数写回聚合器（write-behind）
+
+- QA 记忆命中次数（use_count / last_used_at）与 AI Token 用量先在内存中累加
+- 后台任务每隔几秒用一次 bulk_write 批量写回 MongoDB，应用关闭时再刷新一次
+- 对话热路径上不再有计数类写操作
+- Token 用量按 (UTC 日期, provider) 写入 ai_token_usage_daily 集合，形成按天的时间序列
+"""
+import asyncio
+import os
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+
+
+# 刷新间隔（秒）
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "5"))
+
+COLLECTION_TOKEN_USAGE_DAILY = "ai_token_usage_daily"
+
+TOKEN_USAGE_FIELDS = ["prompt_tokens", "completion_tokens", "total_tokens", "prompt_tokens_saved"]
+
+_USAGE_AGGREGATOR = None
+
+
+class UsageAggregator:
+    """内存累加 + 定期批量写回的计数聚合器"""
+
+    def __init__(self, flush_interval: float):
+        self.flush_interval = flush_interval
+        # memory _id -> {"count": int, "last_used_at": datetime}
+        self._memory_uses: Dict[Any, Dict[str, Any]] = {}
+        # (date, provider) -> {field: int, "call_count": int}
+        self._token_usage: Dict[Tuple[str, str], Dict[str, int]] = {}
+        self._db: Optional[AsyncIOMotorDatabase] = None
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    # ==================== 累加（热路径，只操作内存） ====================
+
+    def record_memory_use(self, memory_id: Any):
+        """记录一次 QA 记忆命中"""
+        pending = self._memory_uses.get(memory_id)
+        if pending is None:
+            pending = self._memory_uses[memory_id] = {"count": 0, "last_used_at": None}
+        pending["count"] += 1
+        pending["last_used_at"] = datetime.utcnow()
+
+    def record_token_usage(self, provider: Optional[str], usage: Dict[str, int]):
+        """记录一次 LLM 调用的 Token 用量"""
+        if not usage or usage.get("total_tokens", 0) == 0:
+            return
+        key = (datetime.utcnow().strftime("%Y-%m-%d"), provider or "default")
+        pending = self._token_usage.get(key)
+        if pending is None:
+            pending = self._token_usage[key] = {field: 0 for field in TOKEN_USAGE_FIELDS}
+            pending["call_count"] = 0
+        for field in TOKEN_USAGE_FIELDS:
+            pending[field] += usage.get(field, 0) or 0
+        pending["call_count"] += 1
+
+    # ==================== 写回 ====================
+
+    async def flush(self, db: Optional[AsyncIOMotorDatabase] = None) -> int:
+        """将累加的计数批量写回数据库，返回写入的操作数"""
+        db = db if db is not None else self._db
+        if db is None:
+            return 0
+        async with self._flush_lock:
+            memory_uses, self._memory_uses = self._memory_uses, {}
+            token_usage, self._token_usage = self._token_usage, {}
+            written = 0
+
+            if memory_uses:
+                ops = [
+                    UpdateOne(
+                        {"_id": memory_id},
+                        {"$inc": {"use_count": pending["count"]}, "$max": {"last_used_at": pending["last_used_at"]}},
+                    )
+                    for memory_id, pending in memory_uses.items()
+                ]
+                try:
+                    await db.qa_memory.bulk_write(ops, ordered=False)
+                    written += len(ops)
+                except Exception as e:
+                    print(f"[UsageAggregator] ⚠️ 写回记忆命中次数失败: {e}")
+                    self._merge_memory_uses(memory_uses)
+
+            if token_usage:
+                now = datetime.utcnow()
+                ops = [
+                    UpdateOne(
+                        {"date": date, "provider": provider},
+                        {"$inc": counters, "$set": {"updated_at": now}},
+                        upsert=True,
+                    )
+                    for (date, provider), counters in token_usage.items()
+                ]
+                try:
+                    await db[COLLECTION_TOKEN_USAGE_DAILY].bulk_write(ops, ordered=False)
+                    written += len(ops)
+                except Exception as e:
+                    print(f"[UsageAggregator] ⚠️ 写回 Token 用量失败: {e}")
+                    self._merge_token_usage(token_usage)
+
+            return written
+
+    def _merge_memory_uses(self, memory_uses: Dict[Any, Dict[str, Any]]):
+        """写回失败时把计数放回缓冲区，下次重试"""
+        for memory_id, pending in memory_uses.items():
+            current = self._memory_uses.get(memory_id)
+            if current is None:
+                self._memory_uses[memory_id] = pending
+            else:
+                current["count"] += pending["count"]
+                current["last_used_at"] = max(current["last_used_at"], pending["last_used_at"])
+
+    def _merge_token_usage(self, token_usage: Dict[Tuple[str, str], Dict[str, int]]):
+        for key, counters in token_usage.items():
+            current = self._token_usage.get(key)
+            if current is None:
+                self._token_usage[key] = counters
+            else:
+                for field, value in counters.items():
+                    current[field] = current.get(field, 0) + value
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[UsageAggregator] ⚠️ 定期写回失败: {e}")
+
+    async def start(self, db: AsyncIOMotorDatabase):
+        """启动定期写回任务（应用启动时调用）"""
+        self._db = db
+        try:
+            await db[COLLECTION_TOKEN_USAGE_DAILY].create_index([("date", 1), ("provider", 1)], unique=True)
+        except Exception as e:
+            print(f"[UsageAggregator] ⚠️ 创建 Token 用量索引失败: {e}")
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """停止定期任务并写回剩余计数（应用关闭时调用）"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+    def get_pending(self) -> Dict[str, int]:
+        return {
+            "memory_uses": sum(p["count"] for p in self._memory_uses.values()),
+            "token_usage_keys": len(self._token_usage),
+        }
+
+
+def get_usage_aggregator() -> UsageAggregator:
+    global _USAGE_AGGREGATOR
+    if _USAGE_AGGREGATOR is None:
+        _USAGE_AGGREGATOR = UsageAggregator(USAGE_FLUSH_INTERVAL)
+    return _USAGE_AGGREGATOR
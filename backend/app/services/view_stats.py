@@ -0,0 +1,304 @@
+"""
+法规浏览统计 - 浏览事件内存缓冲 + 预聚合计数
+
+- record() 只把浏览事件放入内存缓冲，后台定期（或缓冲达到上限时）批量写库
+- 原始浏览记录用 insert_many 批量写入 view_logs，并通过 TTL 索引只保留最近若干天
+- 同时以 $inc upsert 维护预聚合计数：总浏览量、每日浏览量（view_counters）、每部法规浏览量（law_view_counts）
+- 今日/累计浏览量、最常浏览法规等统计只读取少量计数文档，不再对 view_logs 做 count_documents
+- 每次刷新是一个带 id 的批次，计数文档记录最近应用过的批次 id：部分写入失败后重试同一批次不会重复计数
+- 原始记录带上批次 id，由历史 view_logs 初始化计数时只统计没有批次 id 的记录（未经过实时计数）
+"""
+import asyncio
+import os
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+
+# 刷新间隔（秒）
+VIEW_FLUSH_INTERVAL = float(os.getenv("VIEW_FLUSH_INTERVAL", "5"))
+# 缓冲的浏览事件达到该数量时立即刷新
+VIEW_BUFFER_MAX = int(os.getenv("VIEW_BUFFER_MAX", "500"))
+# 原始浏览记录保留天数（统计数据已预聚合，原始记录只用于排查）
+VIEW_LOG_TTL_DAYS = int(os.getenv("VIEW_LOG_TTL_DAYS", "90"))
+# 初始化计数的认领租约（分钟）：认领的 worker 崩溃后，超过该时长仍为 seeding 的标记可被重新认领
+VIEW_SEED_LEASE_MINUTES = float(os.getenv("VIEW_SEED_LEASE_MINUTES", "10"))
+
+COLLECTION_VIEW_LOGS = "view_logs"
+COLLECTION_VIEW_COUNTERS = "view_counters"
+COLLECTION_LAW_VIEW_COUNTS = "law_view_counts"
+
+TOTAL_COUNTER_ID = "total"
+# 由历史 view_logs 初始化计数的标记文档（多 worker 同时启动时只有一个执行初始化）
+SEEDED_MARKER_ID = "seeded"
+# 计数文档上标记已计入历史记录的字段（重新认领后重复执行初始化时跳过）
+SEEDED_FIELD = "seeded_from_logs"
+# 每个计数文档保留的已应用批次 id 数（失败批次在下一次刷新时即重试，远小于该数量）
+APPLIED_BATCHES_KEEP = 32
+
+_VIEW_STATS = None
+
+
+def _day_key(dt: datetime) -> str:
+    """按 UTC 日期分桶（与原 get_today_views 的 UTC 0 点口径一致）"""
+    return dt.strftime("%Y-%m-%d")
+
+
+class ViewStatsRecorder:
+    """浏览事件缓冲与计数维护"""
+
+    def __init__(self, flush_interval: float, buffer_max: int):
+        self.flush_interval = flush_interval
+        self.buffer_max = buffer_max
+        self._buffer: List[Dict[str, Any]] = []
+        # 更新计数失败、待原样重试的批次 [(batch_id, events)]
+        self._retry_batches: List[Tuple[str, List[Dict[str, Any]]]] = []
+        self._db: Optional[AsyncIOMotorDatabase] = None
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._pending_flush: Optional[asyncio.Task] = None
+
+    def record(self, law_id: str):
+        """记录一次法规浏览（只写内存）"""
+        self._buffer.append({"law_id": law_id, "viewed_at": datetime.utcnow()})
+        if len(self._buffer) >= self.buffer_max and self._db is not None:
+            if self._pending_flush is None or self._pending_flush.done():
+                self._pending_flush = asyncio.create_task(self.flush())
+
+    def pending_counts(self) -> Dict[str, Any]:
+        """尚未写库的浏览计数（统计接口叠加，保证读到的数字不滞后）"""
+        today = _day_key(datetime.utcnow())
+        events = self._buffer + [e for _, batch in self._retry_batches for e in batch]
+        return {
+            "total": len(events),
+            "today": sum(1 for e in events if _day_key(e["viewed_at"]) == today),
+            "by_law": Counter(e["law_id"] for e in events),
+        }
+
+    async def flush(self, db: Optional[AsyncIOMotorDatabase] = None) -> int:
+        """更新计数并批量写入原始记录，返回写入的浏览事件数"""
+        db = db if db is not None else self._db
+        if db is None:
+            return 0
+        async with self._flush_lock:
+            # 先原样重试失败的批次（沿用原批次 id），再处理新事件
+            batches, self._retry_batches = self._retry_batches, []
+            if self._buffer:
+                batches.append((uuid.uuid4().hex, self._buffer))
+                self._buffer = []
+            written = 0
+            for batch_id, events in batches:
+                try:
+                    await self._apply_counters(db, batch_id, events)
+                except Exception as e:
+                    print(f"[ViewStats] ⚠️ 更新浏览计数失败，{len(events)} 条将在下次重试: {e}")
+                    self._retry_batches.append((batch_id, events))
+                    continue
+                # 原始记录只用于排查，写入失败不重试（计数已经更新）
+                try:
+                    await db[COLLECTION_VIEW_LOGS].insert_many(
+                        [{**e, "batch_id": batch_id} for e in events], ordered=False
+                    )
+                except Exception as e:
+                    print(f"[ViewStats] ⚠️ 写入原始浏览记录失败: {e}")
+                written += len(events)
+            return written
+
+    @staticmethod
+    def _batch_inc(query: Dict[str, Any], update: Dict[str, Any], batch_id: str) -> UpdateOne:
+        """只在文档尚未应用过该批次时执行的计数更新，并记录批次 id"""
+        return UpdateOne(
+            {**query, "applied_batches": {"$ne": batch_id}},
+            {**update, "$push": {"applied_batches": {"$each": [batch_id], "$slice": -APPLIED_BATCHES_KEEP}}},
+            upsert=True,
+        )
+
+    @staticmethod
+    def _seed_inc(query: Dict[str, Any], update: Dict[str, Any]) -> UpdateOne:
+        """只在文档尚未计入历史记录时执行的计数更新"""
+        return UpdateOne(
+            {**query, SEEDED_FIELD: {"$ne": True}},
+            {**update, "$set": {**update.get("$set", {}), SEEDED_FIELD: True}},
+            upsert=True,
+        )
+
+    @staticmethod
+    async def _bulk_apply(collection, ops: List[UpdateOne]):
+        """
+        批量执行 _batch_inc / _seed_inc 生成的更新。
+        文档已应用过该批次时过滤条件不匹配，upsert 插入同一主键报重复键（11000），视为已应用；
+        重复键也可能来自其他 worker 并发插入同一文档，因此对这些操作再执行一次（此时文档已存在）。
+        """
+        for attempt in range(2):
+            try:
+                await collection.bulk_write(ops, ordered=False)
+                return
+            except BulkWriteError as e:
+                errors = e.details.get("writeErrors", [])
+                if e.details.get("writeConcernErrors") or any(err.get("code") != 11000 for err in errors):
+                    raise
+                ops = [ops[err["index"]] for err in errors]
+                if not ops:
+                    return
+
+    async def _apply_counters(self, db: AsyncIOMotorDatabase, batch_id: str, events: List[Dict[str, Any]]):
+        days = Counter(_day_key(e["viewed_at"]) for e in events)
+        laws: Dict[str, Dict[str, Any]] = {}
+        for e in events:
+            entry = laws.setdefault(e["law_id"], {"views": 0, "last_viewed_at": e["viewed_at"]})
+            entry["views"] += 1
+            entry["last_viewed_at"] = max(entry["last_viewed_at"], e["viewed_at"])
+
+        counter_ops = [
+            self._batch_inc({"_id": TOTAL_COUNTER_ID}, {"$inc": {"views": len(events)}}, batch_id)
+        ] + [
+            self._batch_inc({"_id": f"day:{day}"}, {"$inc": {"views": n}, "$set": {"date": day}}, batch_id)
+            for day, n in days.items()
+        ]
+        law_ops = [
+            self._batch_inc(
+                {"law_id": law_id},
+                {"$inc": {"views": entry["views"]}, "$max": {"last_viewed_at": entry["last_viewed_at"]}},
+                batch_id,
+            )
+            for law_id, entry in laws.items()
+        ]
+        # 两个集合分别写入：任一失败时整批重试，已应用该批次的文档被跳过
+        await self._bulk_apply(db[COLLECTION_VIEW_COUNTERS], counter_ops)
+        await self._bulk_apply(db[COLLECTION_LAW_VIEW_COUNTS], law_ops)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[ViewStats] ⚠️ 定期刷新失败: {e}")
+
+    async def ensure_indexes(self, db: AsyncIOMotorDatabase):
+        """计数集合索引 + 原始记录 TTL（滚动清理 view_logs）"""
+        await db[COLLECTION_LAW_VIEW_COUNTS].create_index("law_id", unique=True)
+        await db[COLLECTION_LAW_VIEW_COUNTS].create_index([("views", -1)])
+        try:
+            await db[COLLECTION_VIEW_LOGS].create_index(
+                "viewed_at",
+                name="viewed_at_ttl",
+                expireAfterSeconds=int(timedelta(days=VIEW_LOG_TTL_DAYS).total_seconds()),
+            )
+        except Exception as e:
+            print(f"[ViewStats] ⚠️ 创建 view_logs TTL 索引失败（可能已存在同字段的普通索引）: {e}")
+
+    async def _claim_seed(self, counters) -> Optional[datetime]:
+        """
+        认领初始化任务，返回历史记录的快照边界（首次认领的时间），未认领到返回 None。
+        首次以原子插入认领；标记仍为 seeding 且认领时间超过租约的（认领的 worker 已崩溃）可被重新认领，
+        沿用首次认领时的快照边界。
+        """
+        now = datetime.utcnow()
+        try:
+            await counters.insert_one({"_id": SEEDED_MARKER_ID, "status": "seeding", "claimed_at": now, "seed_until": now})
+            return now
+        except DuplicateKeyError:
+            pass
+        previous = await counters.find_one_and_update(
+            {
+                "_id": SEEDED_MARKER_ID,
+                "status": "seeding",
+                "claimed_at": {"$lt": now - timedelta(minutes=VIEW_SEED_LEASE_MINUTES)},
+            },
+            {"$set": {"claimed_at": now}},
+            return_document=ReturnDocument.BEFORE,
+        )
+        if previous is None:
+            return None
+        seed_until = previous.get("seed_until") or previous.get("claimed_at") or now
+        if "seed_until" not in previous:
+            await counters.update_one({"_id": SEEDED_MARKER_ID}, {"$set": {"seed_until": seed_until}})
+        print(f"[ViewStats] ⚠️ 初始化计数的认领已超时（{previous.get('claimed_at')}），重新执行初始化")
+        return seed_until
+
+    async def seed_from_logs(self, db: AsyncIOMotorDatabase) -> bool:
+        """
+        首次启用计数时，由历史 view_logs 初始化总量、每日和每部法规的计数。
+        只有认领到标记文档（status=seeding）的 worker 执行初始化，完成后标记为 done；
+        统计历史记录阶段失败时删除标记，下次启动重试（此时尚未写入任何计数）。
+        只统计快照边界之前、且没有批次 id 的记录：认领之后其他 worker 刷新的批次已实时计数，不会重复计入；
+        每个计数文档只计入一次历史记录，崩溃后重新认领再执行时已写入的部分被跳过。
+        """
+        counters = db[COLLECTION_VIEW_COUNTERS]
+        seed_until = await self._claim_seed(counters)
+        if seed_until is None:
+            return False
+
+        logs = db[COLLECTION_VIEW_LOGS]
+        snapshot = {"batch_id": {"$exists": False}, "viewed_at": {"$lte": seed_until}}
+        try:
+            total = await logs.count_documents(snapshot)
+            day_rows = await logs.aggregate([
+                {"$match": snapshot},
+                {"$group": {"_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$viewed_at"}}, "views": {"$sum": 1}}},
+            ]).to_list(length=None) if total else []
+            law_rows = await logs.aggregate([
+                {"$match": snapshot},
+                {"$group": {"_id": "$law_id", "views": {"$sum": 1}, "last_viewed_at": {"$max": "$viewed_at"}}},
+            ]).to_list(length=None) if total else []
+        except Exception:
+            await counters.delete_one({"_id": SEEDED_MARKER_ID, "status": "seeding"})
+            raise
+        if total == 0:
+            await counters.update_one({"_id": SEEDED_MARKER_ID}, {"$set": {"status": "done", "seeded_at": datetime.utcnow()}})
+            return True
+
+        counter_ops = [self._seed_inc({"_id": TOTAL_COUNTER_ID}, {"$inc": {"views": total}})] + [
+            self._seed_inc({"_id": f"day:{row['_id']}"}, {"$inc": {"views": row["views"]}, "$set": {"date": row["_id"]}})
+            for row in day_rows if row["_id"]
+        ]
+        law_ops = [
+            self._seed_inc(
+                {"law_id": row["_id"]},
+                {"$inc": {"views": row["views"]}, "$max": {"last_viewed_at": row["last_viewed_at"]}},
+            )
+            for row in law_rows if row["_id"]
+        ]
+        await self._bulk_apply(counters, counter_ops)
+        if law_ops:
+            await self._bulk_apply(db[COLLECTION_LAW_VIEW_COUNTS], law_ops)
+        await counters.update_one({"_id": SEEDED_MARKER_ID}, {"$set": {"status": "done", "seeded_at": datetime.utcnow()}})
+        print(f"[ViewStats] ✅ 已由 {total} 条历史浏览记录初始化统计计数")
+        return True
+
+    async def start(self, db: AsyncIOMotorDatabase):
+        """初始化计数并启动定期刷新（应用启动时调用）"""
+        self._db = db
+        try:
+            await self.ensure_indexes(db)
+            await self.seed_from_logs(db)
+        except Exception as e:
+            print(f"[ViewStats] ⚠️ 浏览统计初始化失败: {e}")
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """停止定期刷新并写入剩余事件（应用关闭时调用）"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+
+def get_view_stats() -> ViewStatsRecorder:
+    global _VIEW_STATS
+    if _VIEW_STATS is None:
+        _VIEW_STATS = ViewStatsRecorder(VIEW_FLUSH_INTERVAL, VIEW_BUFFER_MAX)
+    return _VIEW_STATS
@@ -0,0 +1,293 @@
+"""
+任务队列 worker - 执行 jobs 集合中的后台任务
+
+默认在 API 进程内运行（JOB_WORKER_EMBEDDED=true）；也可作为独立进程运行（不占用 API 进程的事件循环），
+此时 API 进程需设置 JOB_WORKER_EMBEDDED=false：
+    python -m app.worker
+
+LLM 并发上限（LLM_CONCURRENCY_<PROVIDER>）通过 MongoDB 名额租约与 API 进程共享，合计不超过上限，
+对话请求仍优先于分析任务获得名额。
+
+环境变量：
+    JOB_CONCURRENCY_ANALYZE_TRANSCRIPT  笔录分析并发数（默认 2）
+    JOB_CONCURRENCY_CROSS_ANALYZE       交叉分析并发数（默认 1）
+    JOB_CONCURRENCY_VECTORIZE_LAW       法规向量化并发数（默认 1）
+    JOB_POLL_INTERVAL                   队列为空时的轮询间隔（秒，默认 2）
+"""
+import asyncio
+import os
+import signal
+import socket
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from app.db import connect_to_mongo, close_mongo_connection, get_database
+from app.services.settings_cache import get_settings_cache
+from app.services.llm_dispatcher import get_llm_dispatcher
+from app.services.job_queue import (
+    JobQueue,
+    JOB_ANALYZE_TRANSCRIPT,
+    JOB_CROSS_ANALYZE,
+    JOB_VECTORIZE_LAW,
+    JOB_LEASE_SECONDS,
+)
+
+
+DEFAULT_JOB_CONCURRENCY = {
+    JOB_ANALYZE_TRANSCRIPT: 2,
+    JOB_CROSS_ANALYZE: 1,
+    JOB_VECTORIZE_LAW: 1,
+}
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "2"))
+# 回收过期租约的检查间隔（秒）
+STALE_CHECK_INTERVAL = float(os.getenv("JOB_STALE_CHECK_INTERVAL", "30"))
+# 收到停止信号后等待运行中任务结束的时间（秒），超时未完成的任务由租约过期机制回收
+SHUTDOWN_GRACE_SECONDS = float(os.getenv("JOB_SHUTDOWN_GRACE", "30"))
+
+Progress = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+def job_concurrency() -> Dict[str, int]:
+    """各任务类型的并发数（环境变量 JOB_CONCURRENCY_<TYPE> 覆盖默认值）"""
+    return {
+        job_type: int(os.getenv(f"JOB_CONCURRENCY_{job_type.upper()}", str(default)))
+        for job_type, default in DEFAULT_JOB_CONCURRENCY.items()
+    }
+
+
+# ==================== 任务处理函数 ====================
+
+async def _run_analyze_transcript(db, payload: Dict[str, Any], progress: Progress):
+    from app.services.transcript_service import TranscriptService
+    await TranscriptService(db).analyze_transcript(
+        payload["case_id"], payload["transcript_id"], progress=progress, force=payload.get("force", False)
+    )
+
+
+async def _fail_analyze_transcript(db, payload: Dict[str, Any], error: str):
+    from app.services.transcript_service import TranscriptService
+    await TranscriptService(db).mark_analysis_failed(payload["case_id"], payload["transcript_id"], error)
+
+
+async def _run_cross_analyze(db, payload: Dict[str, Any], progress: Progress):
+    from app.services.transcript_service import TranscriptService
+    await TranscriptService(db).cross_analyze(payload["case_id"], progress=progress, full=payload.get("full", False))
+
+
+async def _fail_cross_analyze(db, payload: Dict[str, Any], error: str):
+    from app.services.transcript_service import TranscriptService
+    await TranscriptService(db).mark_cross_analysis_failed(payload["case_id"], error)
+
+
+async def _run_vectorize_law(db, payload: Dict[str, Any], progress: Progress):
+    from app.services.law_service import LawService
+    result = await LawService(db).vectorize_law_articles(payload["law_id"], progress=progress)
+    if result.get("status") in ("failed", "partial"):
+        # 只会重新处理尚未向量化的条文
+        raise RuntimeError(f"向量化未完成: 成功 {result.get('vectorized', 0)}/{result.get('total', 0)}")
+    return result
+
+
+# 任务类型 -> (执行函数, 最终失败回调)
+JOB_HANDLERS = {
+    JOB_ANALYZE_TRANSCRIPT: (_run_analyze_transcript, _fail_analyze_transcript),
+    JOB_CROSS_ANALYZE: (_run_cross_analyze, _fail_cross_analyze),
+    JOB_VECTORIZE_LAW: (_run_vectorize_law, None),
+}
+
+
+# ==================== Worker ====================
+
+class JobWorker:
+    """按任务类型分别限制并发的队列消费者"""
+
+    def __init__(self, db, concurrency: Dict[str, int], worker_id: Optional[str] = None):
+        self.db = db
+        self.queue = JobQueue(db)
+        self.concurrency = {t: n for t, n in concurrency.items() if n > 0 and t in JOB_HANDLERS}
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._stopping = asyncio.Event()
+        self._running: Dict[str, int] = {t: 0 for t in self.concurrency}
+        self._tasks: set = set()
+        self._loops: list = []
+
+    async def _on_final_failure(self, job: Dict[str, Any]):
+        _, on_failure = JOB_HANDLERS.get(job["type"], (None, None))
+        if on_failure:
+            try:
+                await on_failure(self.db, job.get("payload", {}), job.get("error") or "任务失败")
+            except Exception as e:
+                print(f"[Worker] ⚠️ 任务 {job['job_id']} 失败回调异常: {e}")
+
+    async def _heartbeat(self, job_id: str):
+        interval = max(1.0, JOB_LEASE_SECONDS / 3)
+        while True:
+            await asyncio.sleep(interval)
+            if not await self.queue.heartbeat(job_id, self.worker_id):
+                print(f"[Worker] ⚠️ 任务 {job_id} 租约已失效")
+                return
+
+    async def _execute(self, job: Dict[str, Any]):
+        job_id = job["job_id"]
+        run, _ = JOB_HANDLERS[job["type"]]
+
+        async def progress(data: Dict[str, Any]):
+            await self.queue.report_progress(job_id, data)
+
+        print(f"[Worker] ▶️ 开始任务 {job['type']} {job_id}（第 {job['attempts']} 次）")
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        try:
+            result = await run(self.db, job.get("payload", {}), progress)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            final = await self.queue.fail(job, self.worker_id, error)
+            if final:
+                print(f"[Worker] ❌ 任务 {job_id} 最终失败: {error}")
+                await self._on_final_failure({**job, "error": error})
+            else:
+                print(f"[Worker] ⚠️ 任务 {job_id} 失败，稍后重试: {error}")
+        else:
+            await self.queue.complete(job_id, self.worker_id, result if isinstance(result, dict) else None)
+            print(f"[Worker] ✅ 任务完成 {job['type']} {job_id}")
+        finally:
+            heartbeat.cancel()
+
+    async def _consume(self, job_type: str):
+        """单个任务类型的领取循环"""
+        limit = self.concurrency[job_type]
+        slots = asyncio.Semaphore(limit)
+        while not self._stopping.is_set():
+            await slots.acquire()
+            job = None
+            try:
+                job = await self.queue.claim([job_type], self.worker_id)
+            except Exception as e:
+                print(f"[Worker] ⚠️ 领取 {job_type} 任务失败: {e}")
+            if job is None:
+                slots.release()
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), timeout=JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._running[job_type] += 1
+
+            async def run_job(job=job):
+                try:
+                    await self._execute(job)
+                finally:
+                    self._running[job_type] -= 1
+                    slots.release()
+
+            task = asyncio.create_task(run_job())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _recover_loop(self):
+        while not self._stopping.is_set():
+            try:
+                for job in await self.queue.recover_stale():
+                    await self._on_final_failure(job)
+            except Exception as e:
+                print(f"[Worker] ⚠️ 回收过期租约失败: {e}")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=STALE_CHECK_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _requeue_orphans(self):
+        """
+        接入任务队列前（或任务记录丢失时）停留在 analyzing 状态的笔录/交叉分析重新提交任务。
+        enqueue 按去重键去重，已有未完成任务的不会重复提交（执行中的任务也不标记重跑）。
+        """
+        from app.db import COLLECTION_TRANSCRIPTS, COLLECTION_CASES
+        from app.services.job_queue import job_key
+
+        requeued = 0
+        cursor = self.db[COLLECTION_TRANSCRIPTS].find(
+            {"analysis_status": "analyzing"}, {"_id": 0, "case_id": 1, "transcript_id": 1}
+        )
+        async for t in cursor:
+            job = await self.queue.enqueue(
+                JOB_ANALYZE_TRANSCRIPT,
+                {"case_id": t["case_id"], "transcript_id": t["transcript_id"]},
+                dedupe_key=job_key(JOB_ANALYZE_TRANSCRIPT, t["transcript_id"]),
+                rerun_if_running=False,
+            )
+            requeued += job.get("attempts", 0) == 0 and job.get("status") == "queued"
+        cursor = self.db[COLLECTION_CASES].find(
+            {"cross_analysis.analysis_status": "analyzing"}, {"_id": 0, "case_id": 1}
+        )
+        async for c in cursor:
+            job = await self.queue.enqueue(
+                JOB_CROSS_ANALYZE,
+                {"case_id": c["case_id"]},
+                dedupe_key=job_key(JOB_CROSS_ANALYZE, c["case_id"]),
+                rerun_if_running=False,
+            )
+            requeued += job.get("attempts", 0) == 0 and job.get("status") == "queued"
+        if requeued:
+            print(f"[Worker] ♻️ 为 {requeued} 个停留在分析中的对象补交任务")
+
+    async def start(self):
+        await self.queue.ensure_indexes()
+        try:
+            await self._requeue_orphans()
+        except Exception as e:
+            print(f"[Worker] ⚠️ 补交遗留任务失败: {e}")
+        concurrency = ", ".join(f"{t}={n}" for t, n in self.concurrency.items())
+        print(f"[Worker] 🚀 worker {self.worker_id} 已启动（{concurrency}）")
+        self._loops = [asyncio.create_task(self._consume(t)) for t in self.concurrency]
+        self._loops.append(asyncio.create_task(self._recover_loop()))
+
+    async def stop(self):
+        """停止领取新任务，等待运行中的任务结束（超时后取消，由租约过期回收）"""
+        self._stopping.set()
+        for loop_task in self._loops:
+            loop_task.cancel()
+        await asyncio.gather(*self._loops, return_exceptions=True)
+        if self._tasks:
+            print(f"[Worker] ⏳ 等待 {len(self._tasks)} 个运行中的任务结束...")
+            _, pending = await asyncio.wait(set(self._tasks), timeout=SHUTDOWN_GRACE_SECONDS)
+            for task in pending:
+                task.cancel()
+        print(f"[Worker] 🛑 worker {self.worker_id} 已停止")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "worker_id": self.worker_id,
+            "concurrency": self.concurrency,
+            "running": dict(self._running),
+        }
+
+
+async def main():
+    await connect_to_mongo()
+    db = get_database()
+    await get_settings_cache().start(db)
+    await get_llm_dispatcher().start(db)
+
+    worker = JobWorker(db, job_concurrency())
+    await worker.start()
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass  # Windows 下由 KeyboardInterrupt 处理
+    try:
+        await stop_event.wait()
+    finally:
+        await worker.stop()
+        await get_llm_dispatcher().stop()
+        await get_settings_cache().stop()
+        await close_mongo_connection()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,138 @@
+"""
+笔录关键词检索基准测试：正则全表扫描 vs search_terms n-gram 索引
+
+在独立的基准库中生成 N 份模拟笔录（默认 50000 份），分别用原正则条件和 n-gram 索引条件
+执行计数 + 首页查询，输出耗时与扫描文档数。
+
+用法：
+    python scripts/benchmark_transcript_search.py [--count 50000] [--keep]
+
+环境变量：
+    MONGODB_URL        MongoDB 地址（默认 mongodb://localhost:27017）
+    BENCH_MONGODB_DB   基准库名（默认 law_system_search_bench，运行结束后删除，--keep 保留）
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from pymongo import MongoClient
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+sys.path.append(str(BASE_DIR))
+
+from app.services.search_terms import (  # noqa: E402
+    keyword_query,
+    transcript_search_terms,
+    TRANSCRIPT_SEARCH_FIELDS,
+    SEARCH_TERMS_FIELD,
+)
+
+
+SURNAMES = "赵钱孙李周吴郑王冯陈褚卫蒋沈韩杨朱秦尤许何吕施张孔曹严华金魏陶姜"
+GIVEN = "伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚桂英华建国志红"
+PLACES = ["幸福小区", "人民路", "火车站广场", "城东菜市场", "滨江公园", "新华网吧", "中心医院停车场", "学府路口"]
+ACTS = ["盗窃电动车", "殴打他人", "醉酒驾驶", "诈骗钱财", "赌博", "故意损毁财物", "寻衅滋事", "非法侵入住宅"]
+FILLER = "当时我在现场看见对方先动手然后我们就发生了争执后来有人报警民警到场后把我们带到派出所"
+
+BENCH_KEYWORDS = ["盗窃电动车", "滨江公园", "张伟", "醉酒驾驶", "不存在的关键词"]
+
+
+def fake_transcript(rng: random.Random, now: datetime) -> dict:
+    name = rng.choice(SURNAMES) + rng.choice(GIVEN)
+    other = rng.choice(SURNAMES) + rng.choice(GIVEN) + rng.choice(GIVEN)
+    turns = []
+    for _ in range(rng.randint(20, 60)):
+        place, act = rng.choice(PLACES), rng.choice(ACTS)
+        start = rng.randint(0, len(FILLER) - 20)
+        turns.append(f"问：{other}在{place}做了什么？\n答：{FILLER[start:start + rng.randint(10, 20)]}，他{act}。")
+    content = f"询问人：{other}\n被询问人：{name}\n" + "\n".join(turns)
+    doc = {
+        "transcript_id": str(uuid.uuid4()),
+        "case_id": str(uuid.uuid4()),
+        "title": f"{name}询问笔录",
+        "type": rng.choice(["询问笔录", "讯问笔录"]),
+        "subject_name": name,
+        "subject_role": rng.choice(["嫌疑人", "被害人", "证人"]),
+        "content": content,
+        "keywords": [name, rng.choice(PLACES)],
+        "analysis": {"summary": f"{name}称{rng.choice(ACTS)}"},
+        "analysis_status": "analyzed",
+        "created_at": now - timedelta(seconds=rng.randint(0, 86400 * 365)),
+    }
+    doc[SEARCH_TERMS_FIELD] = transcript_search_terms(doc)
+    return doc
+
+
+def populate(coll, count: int):
+    rng = random.Random(42)
+    now = datetime.utcnow()
+    batch = []
+    started = time.perf_counter()
+    for i in range(count):
+        batch.append(fake_transcript(rng, now))
+        if len(batch) >= 1000:
+            coll.insert_many(batch, ordered=False)
+            batch = []
+            print(f"\r  已写入 {i + 1}/{count}", end="", flush=True)
+    if batch:
+        coll.insert_many(batch, ordered=False)
+    print(f"\r  已写入 {count} 份，耗时 {time.perf_counter() - started:.1f}s")
+    coll.create_index(SEARCH_TERMS_FIELD)
+    coll.create_index([("created_at", -1)])
+
+
+def run_query(coll, query: dict, page_size: int = 20) -> dict:
+    started = time.perf_counter()
+    total = coll.count_documents(query)
+    list(coll.find(query, {"_id": 0, "transcript_id": 1}).sort("created_at", -1).limit(page_size))
+    elapsed = (time.perf_counter() - started) * 1000
+    stats = coll.find(query).explain().get("executionStats", {})
+    return {
+        "total": total,
+        "ms": elapsed,
+        "docs_examined": stats.get("totalDocsExamined"),
+        "keys_examined": stats.get("totalKeysExamined"),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="笔录关键词检索基准测试")
+    parser.add_argument("--count", type=int, default=50000, help="模拟笔录数量")
+    parser.add_argument("--keep", action="store_true", help="保留基准库")
+    args = parser.parse_args()
+
+    client = MongoClient(os.getenv("MONGODB_URL", "mongodb://localhost:27017"))
+    db_name = os.getenv("BENCH_MONGODB_DB", "law_system_search_bench")
+    coll = client[db_name]["transcripts"]
+
+    if coll.estimated_document_count() != args.count:
+        coll.drop()
+        print(f"生成 {args.count} 份模拟笔录...")
+        populate(coll, args.count)
+
+    print(f"\n{'关键词':<12}{'命中':>8}{'正则(ms)':>12}{'扫描文档':>10}{'n-gram(ms)':>14}{'扫描文档':>10}")
+    for keyword in BENCH_KEYWORDS:
+        safe_kw = re.escape(keyword)
+        regex_query = {"$or": [{f: {"$regex": safe_kw, "$options": "i"}} for f in TRANSCRIPT_SEARCH_FIELDS]}
+        regex = run_query(coll, regex_query)
+        ngram = run_query(coll, keyword_query(keyword, TRANSCRIPT_SEARCH_FIELDS))
+        if regex["total"] != ngram["total"]:
+            print(f"⚠️ {keyword}: 结果数不一致（正则 {regex['total']}，n-gram {ngram['total']}）")
+        print(
+            f"{keyword:<12}{ngram['total']:>8}{regex['ms']:>12.1f}{regex['docs_examined'] or 0:>10}"
+            f"{ngram['ms']:>14.1f}{ngram['docs_examined'] or 0:>10}"
+        )
+
+    if not args.keep:
+        client.drop_database(db_name)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -3,19 +3,22 @@
 
 使用说明：
 1. 继承 BaseLawSpider 类
-2. 实现 extract_law_links() 和 parse_law_page() 方法
-3. 运行 run() 方法开始爬取
+2. 实现 extract_law_links()（异步）和 parse_law_page() 方法
+3. 运行 run() 方法开始爬取（在事件循环中可直接 await crawl()）
+
+请求经由 CrawlEngine 发出：共享连接池、按站点限速（默认每秒 1/delay 个请求）、失败重试退避，
+多个法规页面并发抓取。
 """
-import httpx
+import asyncio
 import json
 import hashlib
-import time
 from pathlib import Path
 from typing import List, Dict, Optional, Set
 from bs4 import BeautifulSoup
-from tenacity import retry, stop_after_attempt, wait_exponential
 import re
 
+from crawl_engine import CRAWL_CONCURRENCY, CrawlEngine, RetryPolicy
+
 
 class BaseLawSpider:
     """法规爬虫基类"""
@@ -26,6 +29,9 @@ class BaseLawSpider:
         base_url: str,
         output_dir: str = "output",
         delay: float = 1.0,
+        concurrency: int = CRAWL_CONCURRENCY,
+        headers: Optional[Dict[str, str]] = None,
+        retry: Optional[RetryPolicy] = None,
     ):
         """
         初始化爬虫
@@ -34,12 +40,18 @@ class BaseLawSpider:
             name: 爬虫名称
             base_url: 目标网站基础 URL
             output_dir: 输出目录
-            delay: 请求延迟（秒）
+            delay: 同一站点两次请求的平均间隔（秒），即限速为每秒 1/delay 个请求
+            concurrency: 同时在途的请求数
+            headers: 额外的请求头
+            retry: 重试策略
         """
         self.name = name
         self.base_url = base_url
         self.output_dir = Path(output_dir)
         self.delay = delay
+        self.concurrency = concurrency
+        self.headers = headers or {}
+        self.retry = retry
 
         # 创建输出目录
         self.output_dir.mkdir(parents=True, exist_ok=True)
@@ -47,14 +59,8 @@ class BaseLawSpider:
         # 已爬取 URL 集合（去重）
         self.seen_urls: Set[str] = self._load_seen_urls()
 
-        # HTTP 客户端
-        self.client = httpx.Client(
-            timeout=30.0,
-            headers={
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
-            },
-            follow_redirects=True,
-        )
+        # 抓取引擎（在事件循环内首次使用时创建，连接池绑定到该事件循环）
+        self._engine: Optional[CrawlEngine] = None
 
         # 统计信息
         self.stats = {
@@ -62,6 +68,8 @@ class BaseLawSpider:
             "success": 0,
             "failed": 0,
             "skipped": 0,
+            "requests": 0,
+            "retries": 0,
         }
 
     def _load_seen_urls(self) -> Set[str]:
@@ -79,10 +87,29 @@ class BaseLawSpider:
             f.write(url + "\n")
         self.seen_urls.add(url)
 
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=1, max=10))
-    def _fetch_page(self, url: str) -> str:
+    @property
+    def engine(self) -> CrawlEngine:
+        """共享的抓取引擎"""
+        if self._engine is None:
+            self._engine = CrawlEngine(
+                headers=self.headers,
+                concurrency=self.concurrency,
+                rate=1 / self.delay if self.delay > 0 else 0,
+                retry=self.retry,
+            )
+        return self._engine
+
+    async def aclose(self):
+        """关闭抓取引擎的连接池（请求与重试次数累计到 stats）"""
+        if self._engine is not None:
+            self.stats["requests"] += self._engine.stats["requests"]
+            self.stats["retries"] += self._engine.stats["retries"]
+            await self._engine.aclose()
+            self._engine = None
+
+    async def _fetch_page(self, url: str) -> str:
         """
-        获取页面 HTML（带重试）
+        获取页面 HTML（限速 + 重试）
 
         Args:
             url: 目标 URL
@@ -91,14 +118,11 @@ class BaseLawSpider:
             HTML 内容
         """
         print(f"📥 正在获取: {url}")
-        response = self.client.get(url)
-        response.raise_for_status()
-        time.sleep(self.delay)  # 限速
-        return response.text
+        return await self.engine.fetch_text(url)
 
-    def extract_law_links(self, list_page_url: str) -> List[str]:
+    async def extract_law_links(self, list_page_url: str) -> List[str]:
         """
-        从列表页提取法规链接（需子类实现）
+        从列表页提取法规链接（需子类实现，异步）
 
         Args:
             list_page_url: 列表页 URL
@@ -285,73 +309,84 @@ class BaseLawSpider:
 
         # 保存条文
         articles_file = self.output_dir / "law_articles.jsonl"
-        for article in law_data.get("articles", []):
-            article_data = {
-                "law_id": law_data["law_id"],
-                "article_num": article["article_num"],
-                "article_display": article["article_display"],
-                "content": article["content"],
-                "chapter": article.get("chapter"),
-                "section": article.get("section"),
-                "keywords": article.get("keywords", []),
-            }
-            with open(articles_file, "a", encoding="utf-8") as f:
+        with open(articles_file, "a", encoding="utf-8") as f:
+            for article in law_data.get("articles", []):
+                article_data = {
+                    "law_id": law_data["law_id"],
+                    "article_num": article["article_num"],
+                    "article_display": article["article_display"],
+                    "content": article["content"],
+                    "chapter": article.get("chapter"),
+                    "section": article.get("section"),
+                    "keywords": article.get("keywords", []),
+                }
                 f.write(json.dumps(article_data, ensure_ascii=False) + "\n")
 
-    def run(self, list_page_urls: List[str]):
-        """
-        运行爬虫
+    async def _crawl_law(self, url: str, index: int, total: int):
+        """抓取并保存单个法规（保存在事件循环线程中进行，文件写入不会交错）"""
+        self.stats["total"] += 1
 
-        Args:
-            list_page_urls: 列表页 URL 列表
-        """
-        print(f"🚀 启动爬虫: {self.name}")
-        print(f"📁 输出目录: {self.output_dir}")
+        # 去重检查
+        if url in self.seen_urls:
+            print(f"⏭️  [{index}/{total}] 已爬取，跳过: {url}")
+            self.stats["skipped"] += 1
+            return
 
-        all_law_urls = []
+        try:
+            # 获取页面
+            html = await self._fetch_page(url)
 
-        # 步骤1: 提取所有法规链接
-        for list_url in list_page_urls:
-            try:
-                law_urls = self.extract_law_links(list_url)
-                all_law_urls.extend(law_urls)
-                print(f"✅ 从 {list_url} 提取到 {len(law_urls)} 个法规链接")
-            except Exception as e:
-                print(f"❌ 提取链接失败 {list_url}: {e}")
+            # 解析数据
+            law_data = self.parse_law_page(url, html)
 
-        print(f"\n📊 总共发现 {len(all_law_urls)} 个法规链接")
+            if law_data:
+                # 保存数据
+                self._save_to_jsonl(law_data)
+                self._save_seen_url(url)
 
-        # 步骤2: 爬取每个法规
-        for i, url in enumerate(all_law_urls, 1):
-            self.stats["total"] += 1
+                self.stats["success"] += 1
+                print(f"✅ [{index}/{total}] 成功: {law_data['title']}")
+            else:
+                self.stats["failed"] += 1
+                print(f"❌ [{index}/{total}] 解析失败: {url}")
 
-            # 去重检查
-            if url in self.seen_urls:
-                print(f"⏭️  [{i}/{len(all_law_urls)}] 已爬取，跳过: {url}")
-                self.stats["skipped"] += 1
-                continue
+        except Exception as e:
+            self.stats["failed"] += 1
+            print(f"❌ [{index}/{total}] 错误: {url} - {e}")
 
-            try:
-                # 获取页面
-                html = self._fetch_page(url)
+    async def crawl(self, list_page_urls: List[str]):
+        """
+        异步爬取：列表页与法规页并发抓取（并发数与站点限速由抓取引擎控制）
 
-                # 解析数据
-                law_data = self.parse_law_page(url, html)
+        Args:
+            list_page_urls: 列表页 URL 列表
+        """
+        print(f"🚀 启动爬虫: {self.name}（并发 {self.concurrency}，每站点每秒 {1 / self.delay if self.delay > 0 else '不限'} 个请求）")
+        print(f"📁 输出目录: {self.output_dir}")
 
-                if law_data:
-                    # 保存数据
-                    self._save_to_jsonl(law_data)
-                    self._save_seen_url(url)
+        try:
+            # 步骤1: 提取所有法规链接
+            all_law_urls = []
+            results = await self.engine.map(self.extract_law_links, list_page_urls)
+            for list_url, law_urls in zip(list_page_urls, results):
+                if isinstance(law_urls, Exception):
+                    print(f"❌ 提取链接失败 {list_url}: {law_urls}")
+                    continue
+                all_law_urls.extend(law_urls)
+                print(f"✅ 从 {list_url} 提取到 {len(law_urls)} 个法规链接")
+            # 多个列表页中重复的链接只抓取一次
+            all_law_urls = list(dict.fromkeys(all_law_urls))
 
-                    self.stats["success"] += 1
-                    print(f"✅ [{i}/{len(all_law_urls)}] 成功: {law_data['title']}")
-                else:
-                    self.stats["failed"] += 1
-                    print(f"❌ [{i}/{len(all_law_urls)}] 解析失败: {url}")
+            print(f"\n📊 总共发现 {len(all_law_urls)} 个法规链接")
 
-            except Exception as e:
-                self.stats["failed"] += 1
-                print(f"❌ [{i}/{len(all_law_urls)}] 错误: {url} - {e}")
+            # 步骤2: 并发爬取每个法规
+            total = len(all_law_urls)
+            await self.engine.map(
+                lambda item: self._crawl_law(item[1], item[0], total),
+                enumerate(all_law_urls, 1),
+            )
+        finally:
+            await self.aclose()
 
         # 打印统计
         print("\n" + "=" * 60)
@@ -360,6 +395,14 @@ class BaseLawSpider:
         print(f"  成功: {self.stats['success']}")
         print(f"  失败: {self.stats['failed']}")
         print(f"  跳过: {self.stats['skipped']}")
+        print(f"  请求: {self.stats['requests']}（重试 {self.stats['retries']}）")
         print("=" * 60)
 
-        self.client.close()
+    def run(self, list_page_urls: List[str]):
+        """
+        运行爬虫（同步入口）
+
+        Args:
+            list_page_urls: 列表页 URL 列表
+        """
+        asyncio.run(self.crawl(list_page_urls))
@@ -0,0 +1,173 @@
+"""
+异步抓取引擎 - 共享连接池 + 按站点令牌桶限速 + 重试退避
+
+- 所有请求共用一个 httpx.AsyncClient（连接复用），同时在途的请求数不超过 concurrency
+- 每个站点（host）一个令牌桶：平均每秒 rate 个请求，最多突发 burst 个，并发再高也不会压垮源站
+- 网络错误与 429/5xx 按指数退避（带抖动）重试，服务端返回 Retry-After 时以其为准
+"""
+import asyncio
+import os
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+
+# 同时在途的请求数
+CRAWL_CONCURRENCY = int(os.getenv("CRAWL_CONCURRENCY", "4"))
+# 每个站点的最大突发请求数
+CRAWL_BURST = int(os.getenv("CRAWL_BURST", "1"))
+# 单个请求的最大尝试次数（含首次）
+CRAWL_MAX_ATTEMPTS = int(os.getenv("CRAWL_MAX_ATTEMPTS", "3"))
+CRAWL_TIMEOUT = float(os.getenv("CRAWL_TIMEOUT", "30"))
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
+}
+
+
+class TokenBucket:
+    """令牌桶：平均每秒 rate 个令牌，容量 burst"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        # 排队取令牌：持锁等待，先到先得
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class HostRateLimiter:
+    """按站点（host）限速，每个 host 一个令牌桶；rate <= 0 时不限速"""
+
+    def __init__(self, rate: float, burst: int = CRAWL_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    async def acquire(self, url: str):
+        if self.rate <= 0:
+            return
+        host = urlsplit(url).netloc
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            bucket = self._buckets[host] = TokenBucket(self.rate, self.burst)
+        await bucket.acquire()
+
+
+class RetryPolicy:
+    """重试策略：指数退避 + 抖动，429/5xx 与网络错误可重试"""
+
+    RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+    def __init__(self, max_attempts: int = CRAWL_MAX_ATTEMPTS, base_delay: float = 1.0, max_delay: float = 30.0):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def should_retry(self, status_code: int) -> bool:
+        return status_code in self.RETRY_STATUSES
+
+    def delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """第 attempt 次（从 1 开始）失败后的等待秒数"""
+        if retry_after:
+            try:
+                return min(self.max_delay, max(0.0, float(retry_after)))
+            except ValueError:
+                pass
+        backoff = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return backoff * random.uniform(0.5, 1.0)
+
+
+class CrawlEngine:
+    """
+    异步抓取引擎。在事件循环内使用，用完调用 aclose()（或 async with）。
+    rate 为每个站点每秒的请求数，rate <= 0 时不限速。
+    """
+
+    def __init__(
+        self,
+        headers: Optional[Dict[str, str]] = None,
+        concurrency: int = CRAWL_CONCURRENCY,
+        rate: float = 1.0,
+        burst: int = CRAWL_BURST,
+        retry: Optional[RetryPolicy] = None,
+        timeout: float = CRAWL_TIMEOUT,
+    ):
+        self.concurrency = max(1, concurrency)
+        self.limiter = HostRateLimiter(rate, burst)
+        self.retry = retry or RetryPolicy()
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self.client = httpx.AsyncClient(
+            headers={**DEFAULT_HEADERS, **(headers or {})},
+            timeout=timeout,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+        )
+        self.stats = {"requests": 0, "retries": 0, "errors": 0}
+
+    async def fetch(self, url: str, **kwargs) -> httpx.Response:
+        """
+        GET 请求（限速 + 重试）。可重试的状态码用尽重试后返回最后一次响应，
+        由调用方判断状态码；网络错误用尽重试后抛出。
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            retry_after = None
+            async with self._slots:
+                await self.limiter.acquire(url)
+                self.stats["requests"] += 1
+                try:
+                    response = await self.client.get(url, **kwargs)
+                except httpx.TransportError as e:
+                    if attempt >= self.retry.max_attempts:
+                        self.stats["errors"] += 1
+                        raise
+                    print(f"  🔁 请求失败，重试 {attempt}/{self.retry.max_attempts - 1}: {url} - {e}")
+                else:
+                    if not self.retry.should_retry(response.status_code) or attempt >= self.retry.max_attempts:
+                        if response.status_code >= 400:
+                            self.stats["errors"] += 1
+                        return response
+                    retry_after = response.headers.get("Retry-After")
+                    print(f"  🔁 HTTP {response.status_code}，重试 {attempt}/{self.retry.max_attempts - 1}: {url}")
+            # 退避等待时不占用并发名额
+            self.stats["retries"] += 1
+            await asyncio.sleep(self.retry.delay(attempt, retry_after))
+
+    async def fetch_text(self, url: str, **kwargs) -> str:
+        """获取页面文本，最终状态码非 2xx 时抛出 httpx.HTTPStatusError"""
+        response = await self.fetch(url, **kwargs)
+        response.raise_for_status()
+        return response.text
+
+    async def map(self, fn: Callable[[Any], Awaitable[Any]], items: Iterable[Any]) -> List[Any]:
+        """
+        对每个条目并发执行 fn，按输入顺序返回结果；单个条目的异常作为结果返回，不影响其他条目。
+        实际请求并发与速率仍由 fetch 控制。
+        """
+        return await asyncio.gather(*(fn(item) for item in items), return_exceptions=True)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def __aenter__(self) -> "CrawlEngine":
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
@@ -2,16 +2,29 @@
 爬虫数据导入到 MongoDB
 
 使用方法：
-    python import_data.py
+    python import_data.py [--full] [--batch-size 1000] [--writers 1]
+
+- 流式读取 JSONL，按批次 bulk_write(UpdateOne upsert, ordered=False) 写库，内存占用与文件大小无关
+- 可选多个写入线程并发提交批次（--writers）
+- 导入清单记录输入文件与每部法规的内容指纹：输入文件未变时整体跳过，未变化的法规不再写库
+- 条文内容未变时保留 embedding，内容变化时清除 embedding 等待重新向量化；法规中已不存在的条文被删除
 """
+import argparse
+import hashlib
 import json
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from pymongo import MongoClient
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from pymongo import DeleteMany, MongoClient, UpdateOne
 from datetime import datetime
 
 import os
 
+from import_sync import ImportManifest, ImportSummary, article_content_hash, existing_law_ids, sha256_file, sha256_text
+
 # MongoDB 配置
 MONGODB_URL = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
 MONGODB_DB = os.getenv("MONGODB_DB", "law_system")
@@ -21,12 +34,148 @@ OUTPUT_DIR = Path("output")
 LAWS_FILE = OUTPUT_DIR / "laws.jsonl"
 ARTICLES_FILE = OUTPUT_DIR / "law_articles.jsonl"
 
+# 每批写入的文档数
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+# 写入线程数
+IMPORT_WRITERS = int(os.getenv("IMPORT_WRITERS", "1"))
+
+
+def _read_jsonl(path: Path) -> Iterator[Tuple[str, dict]]:
+    """逐行流式读取 JSONL，返回 (原始行, 解析结果)，跳过空行与解析失败的行"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield line, json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"  ❌ {path.name} 第 {line_no} 行 JSON 解析错误: {e}")
+
+
+def _article_hashes() -> Dict[str, str]:
+    """第一遍扫描条文文件：每部法规全部条文行的内容指纹"""
+    digests: Dict[str, "hashlib._Hash"] = {}
+    if not ARTICLES_FILE.exists():
+        return {}
+    for line, article in _read_jsonl(ARTICLES_FILE):
+        if "law_id" in article:
+            digests.setdefault(article["law_id"], hashlib.sha256()).update(line.encode("utf-8"))
+    return {law_id: d.hexdigest() for law_id, d in digests.items()}
+
+
+def _article_upsert(article: dict) -> UpdateOne:
+    """
+    条文 upsert（管道更新）：库中条文内容指纹与新内容一致时保留 embedding，否则清除
+    """
+    content = article.get("content", "")
+    content_hash = article_content_hash(content)
+    created_at = article.pop("created_at", None) or datetime.utcnow()
+    fields = {k: v for k, v in article.items() if k not in ("_id", "embedding")}
+    fields["content_hash"] = content_hash
+    same_content = {"$or": [{"$eq": ["$content_hash", content_hash]}, {"$eq": ["$content", content]}]}
+    return UpdateOne(
+        {"law_id": article["law_id"], "article_num": article["article_num"]},
+        [
+            {"$set": {
+                "embedding": {"$cond": [same_content, "$embedding", "$$REMOVE"]},
+                "created_at": {"$ifNull": ["$created_at", {"$literal": created_at}]},
+            }},
+            {"$set": {k: {"$literal": v} for k, v in fields.items()}},
+        ],
+        upsert=True,
+    )
+
+
+class BulkWriter:
+    """
+    按批次提交 bulk_write，可用多个线程并发写入；在途批次数受限，内存占用保持平稳。
+    add 时可附带 key（如 law_id），写入失败的操作对应的 key 记入 failed_keys。
+    """
+
+    def __init__(self, collection, batch_size: int, writers: int):
+        self.collection = collection
+        self.batch_size = max(1, batch_size)
+        self.writers = max(1, writers)
+        self._ops: List = []
+        self._keys: List[Optional[str]] = []
+        self._executor = ThreadPoolExecutor(max_workers=self.writers) if self.writers > 1 else None
+        self._inflight = threading.BoundedSemaphore(self.writers * 2)
+        self._futures = []
+        self._lock = threading.Lock()
+        self.written = 0
+        self.errors = 0
+        self.failed_keys: Set[str] = set()
+        self.started = time.perf_counter()
+
+    def add(self, op, key: Optional[str] = None):
+        self._ops.append(op)
+        self._keys.append(key)
+        if len(self._ops) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._ops:
+            return
+        ops, self._ops = self._ops, []
+        keys, self._keys = self._keys, []
+        if self._executor is None:
+            self._write(ops, keys)
+            return
+        self._inflight.acquire()
+        future = self._executor.submit(self._write, ops, keys)
+        future.add_done_callback(lambda _: self._inflight.release())
+        self._futures.append(future)
+
+    def _write(self, ops: List, keys: List[Optional[str]]):
+        failed_indexes: List[int] = []
+        try:
+            self.collection.bulk_write(ops, ordered=False)
+        except Exception as e:
+            # ordered=False：其余操作已执行，按 writeErrors[].index 定位失败的操作；无明细时视为整批失败
+            details = getattr(e, "details", None) or {}
+            failed_indexes = [error["index"] for error in details.get("writeErrors", [])] or list(range(len(ops)))
+            print(f"  ❌ 批量写入错误（{len(failed_indexes)}/{len(ops)}）: {str(e)[:200]}")
+        with self._lock:
+            self.written += len(ops) - len(failed_indexes)
+            self.errors += len(failed_indexes)
+            self.failed_keys.update(keys[i] for i in failed_indexes if keys[i] is not None)
+
+    def close(self) -> float:
+        """写完剩余批次，返回吞吐量（文档/秒）"""
+        self.flush()
+        if self._executor is not None:
+            for future in self._futures:
+                future.result()
+            self._executor.shutdown()
+        elapsed = time.perf_counter() - self.started
+        return self.written / elapsed if elapsed > 0 else 0.0
+
+
+def _ensure_indexes(db):
+    """创建索引（upsert 依赖 law_id / (law_id, article_num) 索引，须在写入前创建）"""
+    # laws 集合索引
+    db.laws.create_index("law_id", unique=True)
+    db.laws.create_index([("category", 1), ("level", 1), ("status", 1)])
+    db.laws.create_index([("title", "text"), ("summary", "text"), ("full_text", "text")], default_language="none")
+
+    # law_articles 集合索引
+    db.law_articles.create_index([("law_id", 1), ("article_num", 1)], unique=True)
+    db.law_articles.create_index("law_id")
+    db.law_articles.create_index([("content", "text"), ("article_display", "text")], default_language="none")
+
 
-def import_data():
-    """导入数据到 MongoDB"""
+def import_data(full: bool = False, batch_size: int = IMPORT_BATCH_SIZE, writers: int = IMPORT_WRITERS):
+    """
+    导入数据到 MongoDB
+    导入清单记录输入文件与每部法规的内容指纹：输入文件未变时整体跳过，
+    未变化的法规不再写库（full=True 时忽略清单）
+    """
     print("🔌 连接 MongoDB...")
-    client = MongoClient(MONGODB_URL)
+    client = MongoClient(MONGODB_URL, maxPoolSize=max(10, writers * 2))
     db = client[MONGODB_DB]
+    manifest = ImportManifest(db, "import_data")
+    summary = ImportSummary()
 
     # 清空旧数据（可选）
     print("\n⚠️  是否清空旧数据？(y/n): ", end="")
@@ -35,109 +184,132 @@ def import_data():
         db.laws.delete_many({})
         db.law_articles.delete_many({})
         print("✅ 旧数据已清空")
+        full = True
+    if not full:
+        manifest.load()
 
-    # 导入法规数据
-    if LAWS_FILE.exists():
-        print(f"\n📥 导入法规数据: {LAWS_FILE}")
-        laws_count = 0
+    file_hashes = {
+        f"file:{path.name}": sha256_file(str(path)) for path in (LAWS_FILE, ARTICLES_FILE) if path.exists()
+    }
+    if file_hashes and all(manifest.unchanged(key, h) for key, h in file_hashes.items()) \
+            and db.laws.estimated_document_count() > 0:
+        print("\n⏭️  输入文件与上次导入一致，跳过导入")
+        client.close()
+        return
 
-        with open(LAWS_FILE, "r", encoding="utf-8") as f:
-            for line in f:
-                try:
-                    law_data = json.loads(line.strip())
+    print("\n🔍 创建索引...")
+    _ensure_indexes(db)
+    print("✅ 索引创建完成")
 
-                    # 添加时间戳
-                    if "created_at" not in law_data:
-                        law_data["created_at"] = datetime.utcnow()
+    # 每部法规的内容指纹 = 法规行 + 全部条文行
+    article_hashes = _article_hashes()
+    present_laws = existing_law_ids(db)
+    law_hashes: Dict[str, str] = {}
+    changed_laws: Set[str] = set()
+    writers_used: List[BulkWriter] = []
 
-                    # 插入或更新
-                    db.laws.update_one(
-                        {"law_id": law_data["law_id"]},
-                        {"$set": law_data},
-                        upsert=True
-                    )
+    # 导入法规数据
+    if LAWS_FILE.exists():
+        print(f"\n📥 导入法规数据: {LAWS_FILE}")
+        laws_writer = BulkWriter(db.laws, batch_size, writers)
+        for line, law_data in _read_jsonl(LAWS_FILE):
+            law_id = law_data.get("law_id")
+            if not law_id:
+                print("  ❌ 法规缺少 law_id，已跳过")
+                continue
+            law_hash = sha256_text(line + article_hashes.get(law_id, ""))
+            law_hashes[law_id] = law_hash
+            if manifest.unchanged(f"law:{law_id}", law_hash) and law_id in present_laws:
+                summary.add("skipped")
+                continue
 
-                    laws_count += 1
+            created_at = law_data.pop("created_at", None) or datetime.utcnow()
+            laws_writer.add(UpdateOne(
+                {"law_id": law_id},
+                {"$set": law_data, "$setOnInsert": {"created_at": created_at}},
+                upsert=True,
+            ), key=law_id)
+            changed_laws.add(law_id)
+        rate = laws_writer.close()
+        writers_used.append(laws_writer)
+        print(
+            f"✅ 法规数据导入完成，写入 {laws_writer.written} 条（失败 {laws_writer.errors}），"
+            f"未变化跳过 {summary.counts['skipped']} 条，{rate:.0f} docs/s"
+        )
+    else:
+        print(f"⚠️  未找到法规数据文件: {LAWS_FILE}")
 
-                    if laws_count % 10 == 0:
-                        print(f"  已导入 {laws_count} 条法规...")
+    # 只有条文、法规行不在法规文件中的法规
+    for law_id, article_hash in article_hashes.items():
+        if law_id not in law_hashes:
+            law_hashes[law_id] = sha256_text(article_hash)
+            if not (manifest.unchanged(f"law:{law_id}", law_hashes[law_id]) and law_id in present_laws):
+                changed_laws.add(law_id)
 
-                except json.JSONDecodeError as e:
-                    print(f"  ❌ JSON 解析错误: {e}")
-                except Exception as e:
-                    print(f"  ❌ 导入错误: {e}")
+    # 导入条文数据：只写入变化法规的条文
+    if ARTICLES_FILE.exists() and changed_laws:
+        print(f"\n📥 导入条文数据: {ARTICLES_FILE}（{len(changed_laws)} 部法规有变化）")
+        articles_writer = BulkWriter(db.law_articles, batch_size, writers)
+        # 各变化法规本次出现的条号，用于删除已不存在的条文
+        article_nums: Dict[str, Set] = {law_id: set() for law_id in changed_laws}
+        queued = 0
+        for _, article_data in _read_jsonl(ARTICLES_FILE):
+            law_id = article_data.get("law_id")
+            if law_id not in article_nums or "article_num" not in article_data:
+                continue
+            article_nums[law_id].add(article_data["article_num"])
+            articles_writer.add(_article_upsert(article_data), key=law_id)
+            queued += 1
+            if queued % (batch_size * 10) == 0:
+                print(f"  已提交 {queued} 条条文...")
+        rate = articles_writer.close()
+        writers_used.append(articles_writer)
 
-        print(f"✅ 法规数据导入完成，共 {laws_count} 条")
-    else:
-        print(f"⚠️  未找到法规数据文件: {LAWS_FILE}")
+        deleter = BulkWriter(db.law_articles, batch_size, 1)
+        for law_id, nums in article_nums.items():
+            # 条文文件中没有该法规的条文时不删除（可能只更新了法规信息）
+            if nums:
+                deleter.add(DeleteMany({"law_id": law_id, "article_num": {"$nin": sorted(nums)}}), key=law_id)
+        deleter.close()
+        writers_used.append(deleter)
+        print(f"✅ 条文数据导入完成，写入 {articles_writer.written} 条（失败 {articles_writer.errors}），{rate:.0f} docs/s")
 
-    # 导入条文数据
-    if ARTICLES_FILE.exists():
-        print(f"\n📥 导入条文数据: {ARTICLES_FILE}")
-        articles_count = 0
-
-        with open(ARTICLES_FILE, "r", encoding="utf-8") as f:
-            for line in f:
-                try:
-                    article_data = json.loads(line.strip())
-
-                    # 添加时间戳
-                    if "created_at" not in article_data:
-                        article_data["created_at"] = datetime.utcnow()
-
-                    # 插入或更新
-                    db.law_articles.update_one(
-                        {
-                            "law_id": article_data["law_id"],
-                            "article_num": article_data["article_num"]
-                        },
-                        {"$set": article_data},
-                        upsert=True
-                    )
-
-                    articles_count += 1
-
-                    if articles_count % 100 == 0:
-                        print(f"  已导入 {articles_count} 条条文...")
-
-                except json.JSONDecodeError as e:
-                    print(f"  ❌ JSON 解析错误: {e}")
-                except Exception as e:
-                    print(f"  ❌ 导入错误: {e}")
-
-        print(f"✅ 条文数据导入完成，共 {articles_count} 条")
+    # 写入失败的法规不记入清单，下次导入时重新写入
+    failed_laws = set().union(*(w.failed_keys for w in writers_used))
+    for law_id in changed_laws:
+        if law_id in failed_laws:
+            summary.add("failed")
+            continue
+        summary.add("updated" if law_id in present_laws else "new")
+        manifest.record(f"law:{law_id}", law_hashes[law_id], law_id)
+    # 有任何写入失败时不记录输入文件指纹，否则下次会因文件未变而整体跳过
+    if any(w.errors for w in writers_used):
+        print("⚠️  存在写入失败，未记录输入文件指纹，下次导入将重试失败的法规")
     else:
-        print(f"⚠️  未找到条文数据文件: {ARTICLES_FILE}")
+        for key, file_hash in file_hashes.items():
+            manifest.record(key, file_hash)
+    manifest.save()
+    print(f"\n📊 {summary.report()}")
 
     # 验证导入
     print("\n" + "=" * 60)
     print("📊 数据库统计:")
-    print(f"  法规总数: {db.laws.count_documents({})}")
-    print(f"  条文总数: {db.law_articles.count_documents({})}")
+    print(f"  法规总数: {db.laws.estimated_document_count()}")
+    print(f"  条文总数: {db.law_articles.estimated_document_count()}")
     print("=" * 60)
 
-    # 创建索引（如果尚未创建）
-    print("\n🔍 创建索引...")
-
-    # laws 集合索引
-    db.laws.create_index("law_id", unique=True)
-    db.laws.create_index([("category", 1), ("level", 1), ("status", 1)])
-    db.laws.create_index([("title", "text"), ("summary", "text"), ("full_text", "text")], default_language="none")
-
-    # law_articles 集合索引
-    db.law_articles.create_index([("law_id", 1), ("article_num", 1)], unique=True)
-    db.law_articles.create_index("law_id")
-    db.law_articles.create_index([("content", "text"), ("article_display", "text")], default_language="none")
-
-    print("✅ 索引创建完成")
-
     client.close()
     print("\n🎉 数据导入完成！")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="爬虫数据导入到 MongoDB")
+    parser.add_argument("--full", action="store_true", help="忽略导入清单，全部重新写入")
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE, help="每批写入的文档数")
+    parser.add_argument("--writers", type=int, default=IMPORT_WRITERS, help="并发写入线程数")
+    args = parser.parse_args()
     try:
-        import_data()
+        import_data(full=args.full, batch_size=args.batch_size, writers=args.writers)
     except KeyboardInterrupt:
         print("\n\n⚠️  用户中断操作")
         sys.exit(1)
@@ -3,9 +3,13 @@ import re
 import hashlib
 import json
 import logging
-from pymongo import MongoClient, ASCENDING, TEXT
+from concurrent.futures import ProcessPoolExecutor
+from pymongo import MongoClient, ReplaceOne, ASCENDING, TEXT
+from pymongo.errors import BulkWriteError
 from dotenv import load_dotenv
 
+from import_sync import ImportManifest, ImportSummary, existing_law_ids, law_content_hash, sha256_file, sync_law_articles_many
+
 # Word 文档支持
 try:
     from docx import Document
@@ -20,41 +24,16 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 # 加载环境变量
 load_dotenv(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'backend', '.env'))
 
-class LocalImporter:
-    def __init__(self, input_dir="manual_data"):
-        self.input_dir = input_dir
-        # 优先使用环境变量，否则使用 Docker 映射的端口
-        self.mongo_uri = os.getenv("MONGODB_URL", "mongodb://localhost:27019")
-        logging.info(f"🔗 连接 MongoDB: {self.mongo_uri}")
-        self.client = MongoClient(self.mongo_uri, serverSelectionTimeoutMS=5000)
-        self.db = self.client[os.getenv("MONGODB_DB", "law_system")]
-        # 测试连接
-        try:
-            self.client.admin.command('ping')
-            logging.info(f"✅ MongoDB 连接成功")
-        except Exception as e:
-            logging.error(f"❌ MongoDB 连接失败: {e}")
-            raise
-        self.setup_indexes()
+# 解析逻辑（元数据识别、条文拆分）变化时递增，导入清单中的旧指纹随之失效
+PARSER_VERSION = "1"
+# 解析进程数（默认按 CPU 核数）
+IMPORT_WORKERS = int(os.getenv("IMPORT_LOCAL_WORKERS", str(os.cpu_count() or 1)))
+# 每批写库的法规数（每批写完写回一次导入清单）
+WRITE_BATCH_SIZE = int(os.getenv("IMPORT_LOCAL_BATCH_SIZE", "50"))
 
-    def setup_indexes(self):
-        """确保索引存在（忽略已存在的索引冲突）"""
-        try:
-            self.db.laws.create_index([("title", ASCENDING)], unique=True)
-        except Exception:
-            pass
-        try:
-            self.db.laws.create_index([("title", TEXT), ("summary", TEXT)], name="law_text_search")
-        except Exception:
-            pass
-        try:
-            self.db.law_articles.create_index([("law_id", ASCENDING), ("article_num", ASCENDING)], unique=True)
-        except Exception:
-            pass
-        try:
-            self.db.law_articles.create_index([("content", TEXT)], name="article_content_search")
-        except Exception:
-            pass
+
+class LawFileParser:
+    """法规文件解析（读取文件、识别元数据、拆分条文），不依赖数据库，可在子进程中运行"""
 
     def parse_metadata(self, content):
         """解析元数据和修订说明"""
@@ -533,6 +512,142 @@ class LocalImporter:
             logging.error(f"❌ 读取 Word 文档失败: {e}")
             return None
 
+    def read_file(self, file_path):
+        """读取 txt/md/docx 文件内容，失败返回 None"""
+        if os.path.splitext(file_path)[1].lower() == '.docx':
+            return self.read_docx(file_path)
+        # txt 或 md 文件
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                return f.read()
+        except UnicodeDecodeError:
+            try:
+                with open(file_path, 'r', encoding='gbk') as f:
+                    return f.read()
+            except:
+                logging.error(f"❌ 无法读取文件 {os.path.basename(file_path)} (编码错误)")
+                return None
+
+    def parse_file(self, file_path):
+        """
+        读取并解析单个法规文件。
+        返回 {"title", "metadata", "articles"}，读取失败返回 {"error"}。
+        """
+        title = os.path.splitext(os.path.basename(file_path))[0]  # 文件名作为标题
+        logging.info(f"📄 处理: {title}")
+
+        content = self.read_file(file_path)
+        if content is None:
+            return {"error": "文件读取失败"}
+
+        # 1. 解析元数据
+        metadata = self.parse_metadata(content)
+
+        # 优先使用合并后的标题 > 文档末尾的标题 > 文件名
+        if metadata.get("merged_title"):
+            title = metadata["merged_title"]
+            logging.info(f"   📋 使用合并标题: {title}")
+        elif metadata.get("title_from_tail"):
+            title = metadata["title_from_tail"]
+            logging.info(f"   📋 使用文档中的标题: {title}")
+
+        # 2. 拆分条文
+        articles = self.split_articles(content)
+        return {"title": title, "metadata": metadata, "articles": articles}
+
+# 子进程内复用的解析器
+_worker_parser = None
+
+
+def _parse_law_file(file_path):
+    """解析进程池任务：解析单个法规文件（异常转为 error，不中断整批导入）"""
+    global _worker_parser
+    if _worker_parser is None:
+        _worker_parser = LawFileParser()
+    try:
+        return _worker_parser.parse_file(file_path)
+    except Exception as e:
+        logging.error(f"❌ 解析文件失败 {os.path.basename(file_path)}: {e}")
+        return {"error": str(e)}
+
+class LocalImporter(LawFileParser):
+    def __init__(self, input_dir="manual_data", full=False, workers=IMPORT_WORKERS):
+        self.input_dir = input_dir
+        # full=True 时忽略导入清单，全部重新解析入库
+        self.full = full
+        # 解析进程数，1 时在当前进程中顺序解析
+        self.workers = max(1, workers)
+        # 本次跳过的文件：法规 -> 其中排在最后的文件序号；本次解析的文件 -> 法规
+        self._skipped_owner = {}
+        self._parsed_law = {}
+        # 优先使用环境变量，否则使用 Docker 映射的端口
+        self.mongo_uri = os.getenv("MONGODB_URL", "mongodb://localhost:27019")
+        logging.info(f"🔗 连接 MongoDB: {self.mongo_uri}")
+        self.client = MongoClient(self.mongo_uri, serverSelectionTimeoutMS=5000)
+        self.db = self.client[os.getenv("MONGODB_DB", "law_system")]
+        # 测试连接
+        try:
+            self.client.admin.command('ping')
+            logging.info(f"✅ MongoDB 连接成功")
+        except Exception as e:
+            logging.error(f"❌ MongoDB 连接失败: {e}")
+            raise
+        self.setup_indexes()
+
+    def setup_indexes(self):
+        """确保索引存在（忽略已存在的索引冲突）"""
+        try:
+            self.db.laws.create_index([("title", ASCENDING)], unique=True)
+        except Exception:
+            pass
+        try:
+            self.db.laws.create_index([("title", TEXT), ("summary", TEXT)], name="law_text_search")
+        except Exception:
+            pass
+        try:
+            self.db.law_articles.create_index([("law_id", ASCENDING), ("article_num", ASCENDING)], unique=True)
+        except Exception:
+            pass
+        try:
+            self.db.law_articles.create_index([("content", TEXT)], name="article_content_search")
+        except Exception:
+            pass
+
+    def build_law_doc(self, law_id, title, metadata, existing_law):
+        """生成法规主档；新解析的是默认值、但数据库中有更好的值时保留数据库的值"""
+        final_issue_org = metadata["issue_org"]
+        final_issue_date = metadata["issue_date"] or "2000-01-01"
+        final_effect_date = metadata["effect_date"] or "2000-01-01"
+
+        if existing_law:
+            # 如果新值是默认值，但旧值更有意义，则保留旧值
+            if final_issue_date == "2000-01-01" and existing_law.get("issue_date") and existing_law["issue_date"] != "2000-01-01":
+                final_issue_date = existing_law["issue_date"]
+                logging.info(f"   📅 {title} 保留已有的发布日期: {final_issue_date}")
+
+            if final_effect_date == "2000-01-01" and existing_law.get("effect_date") and existing_law["effect_date"] != "2000-01-01":
+                final_effect_date = existing_law["effect_date"]
+                logging.info(f"   📅 {title} 保留已有的实施日期: {final_effect_date}")
+
+            # 如果新的发布机关是通用默认值，但旧值更具体，则保留旧值
+            generic_orgs = ["公安部", "全国人民代表大会及其常务委员会"]
+            if final_issue_org in generic_orgs and existing_law.get("issue_org") and existing_law["issue_org"] not in generic_orgs:
+                final_issue_org = existing_law["issue_org"]
+                logging.info(f"   🏛️ {title} 保留已有的发布机关: {final_issue_org}")
+
+        return {
+            "law_id": law_id,
+            "title": title,
+            "status": metadata["status"],
+            "issue_org": final_issue_org,
+            "issue_date": final_issue_date,
+            "effect_date": final_effect_date,
+            "category": metadata["category"],
+            "level": metadata["level"],
+            "content_type": "text",
+            "summary": metadata.get("summary", "")
+        }
+
     def run(self):
         if not os.path.exists(self.input_dir):
             os.makedirs(self.input_dir)
@@ -549,118 +664,182 @@ class LocalImporter:
             logging.warning(f"⚠️ {self.input_dir} 目录为空，请放入法规文件（支持: {', '.join(supported_ext)}）！")
             return
 
-        logging.info(f"🚀 发现 {len(files)} 个文件，开始处理...")
-        
-        for file in files:
-            file_path = os.path.join(self.input_dir, file)
-            title = os.path.splitext(file)[0]  # 文件名作为标题
-             # 去除文件名中的 (2024) 等修饰以保持干净，或者保留
-            
-            logging.info(f"📄 处理: {title}")
-            
-            # 根据文件类型读取内容
-            ext = os.path.splitext(file)[1].lower()
-            
-            if ext == '.docx':
-                content = self.read_docx(file_path)
-                if content is None:
-                    continue
-            else:
-                # txt 或 md 文件
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                except UnicodeDecodeError:
-                    try:
-                        with open(file_path, 'r', encoding='gbk') as f:
-                            content = f.read()
-                    except:
-                        logging.error(f"❌ 无法读取文件 {file} (编码错误)")
-                        continue
-
-            # 1. 解析元数据
-            metadata = self.parse_metadata(content)
-            
-            # 优先使用合并后的标题 > 文档末尾的标题 > 文件名
-            if metadata.get("merged_title"):
-                title = metadata["merged_title"]
-                logging.info(f"   📋 使用合并标题: {title}")
-            elif metadata.get("title_from_tail"):
-                title = metadata["title_from_tail"]
-                logging.info(f"   📋 使用文档中的标题: {title}")
-            
-            law_id = self.generate_id(title)
-            
-            # 检查是否已存在该法规，保留已有的有效数据
-            existing_law = self.db.laws.find_one({"law_id": law_id})
-            
-            # 智能合并：如果新解析的是默认值，但数据库中有更好的值，则保留数据库的值
-            final_issue_org = metadata["issue_org"]
-            final_issue_date = metadata["issue_date"] or "2000-01-01"
-            final_effect_date = metadata["effect_date"] or "2000-01-01"
-            
-            if existing_law:
-                # 如果新值是默认值，但旧值更有意义，则保留旧值
-                if final_issue_date == "2000-01-01" and existing_law.get("issue_date") and existing_law["issue_date"] != "2000-01-01":
-                    final_issue_date = existing_law["issue_date"]
-                    logging.info(f"   📅 保留已有的发布日期: {final_issue_date}")
-                    
-                if final_effect_date == "2000-01-01" and existing_law.get("effect_date") and existing_law["effect_date"] != "2000-01-01":
-                    final_effect_date = existing_law["effect_date"]
-                    logging.info(f"   📅 保留已有的实施日期: {final_effect_date}")
-                
-                # 如果新的发布机关是通用默认值，但旧值更具体，则保留旧值
-                generic_orgs = ["公安部", "全国人民代表大会及其常务委员会"]
-                if final_issue_org in generic_orgs and existing_law.get("issue_org") and existing_law["issue_org"] not in generic_orgs:
-                    final_issue_org = existing_law["issue_org"]
-                    logging.info(f"   🏛️ 保留已有的发布机关: {final_issue_org}")
-            
-            law_doc = {
-                "law_id": law_id,
-                "title": title,
-                "status": metadata["status"],
-                "issue_org": final_issue_org,
-                "issue_date": final_issue_date,
-                "effect_date": final_effect_date,
-                "category": metadata["category"],
-                "level": metadata["level"],
-                "content_type": "text",
-                "summary": metadata.get("summary", "")
+        logging.info(f"🚀 发现 {len(files)} 个文件，开始处理（解析进程 {self.workers} 个）...")
+
+        manifest = ImportManifest(self.db, "import_local", PARSER_VERSION)
+        if not self.full:
+            manifest.load()
+        present_laws = existing_law_ids(self.db)
+        summary = ImportSummary()
+
+        executor = ProcessPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+
+        def pmap(fn, items):
+            """按输入顺序返回结果（进程池并行，或当前进程顺序执行）"""
+            if executor is None:
+                return map(fn, items)
+            return executor.map(fn, items, chunksize=max(1, min(16, len(items) // (self.workers * 4))))
+
+        file_index = {file: i for i, file in enumerate(files)}
+        # 上次导入时各文件对应的法规、各法规胜出的文件（标题相同的文件以排在后面的为准）
+        prev_law = {file: manifest.law_id(f"file:{file}") for file in files}
+        prev_winner = {law_id: manifest.law_file(law_id) for law_id in set(prev_law.values()) if law_id}
+
+        def unchanged_file(file, file_hash):
+            """文件未变、法规仍在库中，且该法规仍以本文件或其后的文件为准时，整个文件跳过"""
+            law_id = prev_law[file]
+            if not manifest.unchanged(f"file:{file}", file_hash) or law_id not in present_laws:
+                return False
+            winner = prev_winner.get(law_id)
+            # 胜出的文件已删除（或顺序变化）时，需要重新解析本文件
+            return winner is None or winner == file or file_index.get(winner, -1) > file_index[file]
+
+        def parse_and_write(items):
+            """解析结果按文件顺序到达，逐批写库（解析与写库流水进行）"""
+            batch = []
+            parsed = pmap(_parse_law_file, [os.path.join(self.input_dir, f) for f, _ in items])
+            for (file, file_hash), result in zip(items, parsed):
+                batch.append({"file": file, "file_hash": file_hash, "index": file_index[file], **result})
+                if len(batch) >= WRITE_BATCH_SIZE:
+                    self.write_batch(batch, manifest, present_laws, summary)
+                    batch = []
+            self.write_batch(batch, manifest, present_laws, summary)
+
+        try:
+            file_hashes = list(pmap(sha256_file, [os.path.join(self.input_dir, f) for f in files]))
+            pending, skipped = [], []
+            for file, file_hash in zip(files, file_hashes):
+                (skipped if unchanged_file(file, file_hash) else pending).append((file, file_hash))
+
+            # 跳过的文件仍参与同标题判定：排在其前面的变化文件不能覆盖它
+            self._skipped_owner = {}
+            for file, _ in skipped:
+                self._skipped_owner[prev_law[file]] = max(self._skipped_owner.get(prev_law[file], -1), file_index[file])
+            self._parsed_law = {}
+            parse_and_write(pending)
+
+            # 上次胜出的文件本次改了标题（归入其他法规）：原法规改由跳过的同标题文件中排在最后的重新写入
+            orphaned = {
+                prev_law[file] for file, _ in pending
+                if prev_law[file] and prev_winner.get(prev_law[file]) == file
+                and self._parsed_law.get(file) not in (None, prev_law[file])
             }
-            
-            # 2. 插入法规主表
-            try:
-                self.db.laws.replace_one({"law_id": law_id}, law_doc, upsert=True)
-            except Exception as e:
-                logging.error(f"入库法规失败: {e}")
+            reparse = [(file, h) for file, h in skipped if prev_law[file] in orphaned]
+            if reparse:
+                logging.info(f"🔁 {len(orphaned)} 部法规原先的文件已改名，重新解析 {len(reparse)} 个同标题文件")
+                for law_id in orphaned:
+                    self._skipped_owner.pop(law_id, None)
+                skipped = [item for item in skipped if prev_law[item[0]] not in orphaned]
+                parse_and_write(reparse)
+            for _ in skipped:
+                summary.add("skipped")
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        logging.info(f"📊 {summary.report()}")
+        logging.info("🎉 所有文件处理完成！")
+
+    def write_batch(self, batch, manifest, present_laws, summary):
+        """
+        一批解析结果写库：法规主表一次 bulk_write，条文差异一次 bulk_write，随后写回导入清单。
+        batch 按文件顺序排列；标题相同的文件以后者为准（与逐个导入时后写覆盖前写一致）。
+        """
+        latest = {}
+        for item in batch:
+            if item.get("error"):
+                summary.add("failed")
+                continue
+            item["law_id"] = self.generate_id(item["title"])
+            self._parsed_law[item["file"]] = item["law_id"]
+            # 排在后面的同标题文件本次未变化被跳过：以它为准
+            if self._skipped_owner.get(item["law_id"], -1) > item["index"]:
+                item["superseded"] = True
                 continue
+            latest[item["law_id"]] = item
+        if not latest and not any(item.get("superseded") for item in batch):
+            manifest.save()
+            return
 
-            # 3. 拆分条文
-            articles = self.split_articles(content)
-            
-            # 4. 插入条文表 (先删后插)
-            self.db.law_articles.delete_many({"law_id": law_id})
-            
-            article_docs = []
-            for art in articles:
-                art["law_id"] = law_id
-                article_docs.append(art)
-            
-            if article_docs:
-                try:
-                    # ordered=False 允许跳过重复项继续插入
-                    self.db.law_articles.insert_many(article_docs, ordered=False)
-                except Exception as e:
-                    # BulkWriteError 可能因重复键引发，但部分数据已成功插入
-                    logging.warning(f"   ⚠️ 部分条文插入时遇到问题: {str(e)[:100]}")
-                
-                inserted_count = self.db.law_articles.count_documents({"law_id": law_id})
-                logging.info(f"   ✅ 成功导入 {inserted_count} 条条文")
-            else:
-                logging.warning(f"   ⚠️ 未提取到条文，请检查格式")
+        # 检查是否已存在该法规，保留已有的有效数据
+        existing = {doc["law_id"]: doc for doc in self.db.laws.find({"law_id": {"$in": list(latest)}})}
 
-        logging.info("🎉 所有文件处理完成！")
+        writes = {}
+        for item in batch:
+            if item.get("error"):
+                continue
+            law_id, file_key = item["law_id"], f"file:{item['file']}"
+            if item.get("superseded") or latest[law_id] is not item:
+                manifest.record(file_key, item["file_hash"], law_id)
+                summary.add("skipped")
+                logging.info(f"   ⏭️ {item['file']} 与后续文件标题相同，以后者为准")
+                continue
+
+            law_doc = self.build_law_doc(law_id, item["title"], item["metadata"], existing.get(law_id))
+            # 解析结果与上次导入一致：跳过写库
+            law_hash = law_content_hash(law_doc, item["articles"])
+            if manifest.unchanged(f"law:{law_id}", law_hash) and law_id in present_laws:
+                manifest.record(file_key, item["file_hash"], law_id)
+                manifest.record(f"law:{law_id}", law_hash, law_id, file=item["file"])
+                summary.add("skipped")
+                logging.info(f"   ⏭️ {item['title']} 内容未变化，跳过")
+                continue
+            item.update(law_doc=law_doc, law_hash=law_hash)
+            writes[law_id] = item
 
+        # 3. 写入法规主表
+        if writes:
+            try:
+                self.db.laws.bulk_write(
+                    [ReplaceOne({"law_id": law_id}, item["law_doc"], upsert=True) for law_id, item in writes.items()],
+                    ordered=False,
+                )
+            except BulkWriteError as e:
+                # ordered=False：只剔除写入失败的法规
+                failed = {err["index"] for err in e.details.get("writeErrors", [])}
+                for index, law_id in enumerate(list(writes)):
+                    if index in failed:
+                        logging.error(f"入库法规失败: {writes.pop(law_id)['title']}")
+                        summary.add("failed")
+            except Exception as e:
+                logging.error(f"入库法规失败: {str(e)[:200]}")
+                for _ in writes:
+                    summary.add("failed")
+                writes = {}
+
+        # 4. 条文差异写入（只新增/更新/删除变化的条文，未变条文保留 embedding）
+        law_articles = {law_id: item["articles"] for law_id, item in writes.items() if item["articles"]}
+        try:
+            # article_num 为顺序编号（插入"第X条之一"后其后条文整体后移），按条号文字对应库中条文
+            article_stats = sync_law_articles_many(self.db, law_articles, match_field="article_display")
+        except Exception as e:
+            logging.error(f"   ❌ 条文写入失败: {str(e)[:200]}")
+            article_stats = {}
+
+        for law_id, item in writes.items():
+            stats = article_stats.get(law_id)
+            if law_id in law_articles and stats is None:
+                summary.add("failed")
+                continue
+            if stats:
+                logging.info(
+                    f"   ✅ {item['title']} 条文 {len(item['articles'])} 条：新增 {stats['inserted']}，更新 {stats['updated']}，"
+                    f"未变 {stats['unchanged']}，删除 {stats['deleted']}"
+                )
+            else:
+                logging.warning(f"   ⚠️ {item['title']} 未提取到条文，请检查格式")
+            summary.add("updated" if law_id in existing else "new", stats)
+            present_laws.add(law_id)
+            manifest.record(f"law:{law_id}", item["law_hash"], law_id, file=item["file"])
+            manifest.record(f"file:{item['file']}", item["file_hash"], law_id)
+        manifest.save()
 if __name__ == "__main__":
-    importer = LocalImporter()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="导入本地法规文件")
+    parser.add_argument("--input-dir", default="manual_data", help="法规文件目录")
+    parser.add_argument("--full", action="store_true", help="忽略导入清单，全部重新解析入库")
+    parser.add_argument("--workers", type=int, default=IMPORT_WORKERS, help="解析进程数（1 为顺序解析）")
+    args = parser.parse_args()
+    importer = LocalImporter(args.input_dir, full=args.full, workers=args.workers)
     importer.run()
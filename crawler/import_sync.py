@@ -0,0 +1,222 @@
+"""
+导入增量同步 - 导入清单（内容指纹）+ 条文差异写入
+
+- 导入清单保存在 import_manifest 集合中：每个输入文件、每部法规的内容指纹
+  输入文件指纹未变（且法规仍在库中）时整个文件跳过，不再解析；法规内容指纹未变时跳过写库
+- 内容变化的法规按 article_num（或 article_display）与库中条文比对，只新增/更新/删除变化的条文，
+  内容未变的条文保留 embedding，内容变化的条文清除 embedding 等待重新向量化
+- 汇总新增/更新/跳过的法规数与耗时
+"""
+import hashlib
+import json
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from pymongo import DeleteOne, InsertOne, UpdateOne
+
+
+MANIFEST_COLLECTION = "import_manifest"
+
+
+def sha256_text(text: str) -> str:
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+def sha256_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def article_content_hash(content: str) -> str:
+    """条文内容指纹（与后端 LawService 一致：内容变化才需要重新向量化）"""
+    return sha256_text((content or "").strip())
+
+
+def law_content_hash(law_doc: Dict[str, Any], articles: Iterable[Dict[str, Any]]) -> str:
+    """法规主档 + 全部条文的内容指纹"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps(law_doc, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8"))
+    for art in articles:
+        digest.update(json.dumps(art, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ImportManifest:
+    """导入清单：source 区分不同导入脚本，key 为文件路径或 law_id"""
+
+    def __init__(self, db, source: str, version: str = "1"):
+        self.coll = db[MANIFEST_COLLECTION]
+        self.source = source
+        # 解析逻辑变化时递增 version，清单中的旧指纹随之失效
+        self.version = version
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._pending: Dict[str, Dict[str, Any]] = {}
+
+    def load(self) -> "ImportManifest":
+        cursor = self.coll.find({"source": self.source, "version": self.version}, {"key": 1, "hash": 1, "law_id": 1, "file": 1})
+        self._entries = {doc["key"]: doc for doc in cursor}
+        return self
+
+    def _id(self, key: str) -> str:
+        return f"{self.source}:{key}"
+
+    def unchanged(self, key: str, content_hash: str) -> bool:
+        entry = self._entries.get(key)
+        return bool(entry) and entry.get("hash") == content_hash
+
+    def law_id(self, key: str) -> Optional[str]:
+        return (self._entries.get(key) or {}).get("law_id")
+
+    def law_file(self, law_id: str) -> Optional[str]:
+        """上次写入该法规所用的文件（同标题的多个文件中胜出的那个）"""
+        return (self._entries.get(f"law:{law_id}") or {}).get("file")
+
+    def record(self, key: str, content_hash: str, law_id: Optional[str] = None, file: Optional[str] = None):
+        entry = {"key": key, "hash": content_hash, "law_id": law_id, "file": file}
+        self._entries[key] = entry
+        self._pending[key] = entry
+
+    def save(self):
+        """写回本次变化的指纹（一次 bulk_write）"""
+        if not self._pending:
+            return
+        now = datetime.utcnow()
+        self.coll.bulk_write([
+            UpdateOne(
+                {"_id": self._id(key)},
+                {"$set": {**entry, "source": self.source, "version": self.version, "updated_at": now}},
+                upsert=True,
+            )
+            for key, entry in self._pending.items()
+        ], ordered=False)
+        self._pending = {}
+
+
+def existing_law_ids(db, law_ids: Optional[List[str]] = None) -> set:
+    """库中已存在的 law_id（清单记录的法规被手动删除后需要重新导入）"""
+    query = {"law_id": {"$in": law_ids}} if law_ids is not None else {}
+    return {doc["law_id"] for doc in db.laws.find(query, {"_id": 0, "law_id": 1})}
+
+
+def sync_law_articles(db, law_id: str, articles: List[Dict[str, Any]], match_field: str = "article_num") -> Dict[str, int]:
+    """
+    条文差异写入：按 match_field 比对，只写变化部分。
+    返回 {"inserted", "updated", "unchanged", "deleted"}。
+    """
+    return sync_law_articles_many(db, {law_id: articles}, match_field)[law_id]
+
+
+def _match_existing(articles: List[Dict[str, Any]], existing: List[Dict[str, Any]], match_field: str) -> List[Optional[Dict[str, Any]]]:
+    """
+    为每条新条文找到对应的库中条文：先按 match_field（同值多条时按出现顺序），
+    再按内容指纹（条号文字变化但内容未变）；找不到的为 None。
+    """
+    by_key: Dict[Any, List[Dict[str, Any]]] = {}
+    by_hash: Dict[str, List[Dict[str, Any]]] = {}
+    for old in existing:
+        by_key.setdefault(old.get(match_field), []).append(old)
+        by_hash.setdefault(old.get("content_hash") or article_content_hash(old.get("content", "")), []).append(old)
+
+    used = set()
+
+    def take(candidates: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        for old in candidates:
+            if old["_id"] not in used:
+                used.add(old["_id"])
+                return old
+        return None
+
+    matched = [take(by_key.get(art.get(match_field), [])) for art in articles]
+    for i, art in enumerate(articles):
+        if matched[i] is None:
+            matched[i] = take(by_hash.get(article_content_hash(art.get("content", "")), []))
+    return matched
+
+
+def sync_law_articles_many(
+    db, law_articles: Dict[str, List[Dict[str, Any]]], match_field: str = "article_num"
+) -> Dict[str, Dict[str, int]]:
+    """
+    多部法规的条文差异写入：一次查询库中条文，全部变化合并写入。
+    条文按 match_field 与库中条文对应（未对应上的再按内容指纹对应），内容未变的保留 embedding；
+    match_field 不是 article_num 时（如按顺序编号的 article_num 会因插入"第X条之一"整体后移），
+    article_num 作为普通字段更新。
+    返回 {law_id: {"inserted", "updated", "unchanged", "deleted"}}。
+    """
+    if not law_articles:
+        return {}
+    existing: Dict[str, List[Dict[str, Any]]] = {law_id: [] for law_id in law_articles}
+    for doc in db.law_articles.find(
+        {"law_id": {"$in": list(law_articles)}},
+        {"_id": 1, "law_id": 1, "article_num": 1, "article_display": 1, "content": 1, "content_hash": 1, "chapter": 1, "section": 1},
+    ):
+        existing[doc["law_id"]].append(doc)
+
+    # (law_id, article_num) 唯一：先删除、并把需要改号的条文移到临时（负数）条号，再写入最终条号
+    first_ops, ops = [], []
+    temp_num = 0
+    all_stats: Dict[str, Dict[str, int]] = {}
+    for law_id, articles in law_articles.items():
+        stats = all_stats[law_id] = {"inserted": 0, "updated": 0, "unchanged": 0, "deleted": 0}
+        seen, unique = set(), []
+        for art in articles:
+            if art["article_num"] not in seen:
+                seen.add(art["article_num"])
+                unique.append(art)
+        matched = _match_existing(unique, existing[law_id], match_field)
+        kept = set()
+        for art, old in zip(unique, matched):
+            article_num = art["article_num"]
+            content_hash = article_content_hash(art.get("content", ""))
+            fields = {k: v for k, v in art.items() if k not in ("_id", "law_id", "embedding")}
+            fields["content_hash"] = content_hash
+            if old is None:
+                ops.append(InsertOne({"law_id": law_id, **fields}))
+                stats["inserted"] += 1
+                continue
+            kept.add(old["_id"])
+            if old.get("article_num") != article_num:
+                temp_num -= 1
+                first_ops.append(UpdateOne({"_id": old["_id"]}, {"$set": {"article_num": temp_num}}))
+            if (old.get("content_hash") or article_content_hash(old.get("content", ""))) != content_hash:
+                ops.append(UpdateOne({"_id": old["_id"]}, {"$set": fields, "$unset": {"embedding": ""}}))
+                stats["updated"] += 1
+            else:
+                if any(old.get(k) != v for k, v in fields.items() if k in ("article_num", "article_display", "content", "content_hash", "chapter", "section")):
+                    ops.append(UpdateOne({"_id": old["_id"]}, {"$set": fields}))
+                stats["unchanged"] += 1
+        for old in existing[law_id]:
+            if old["_id"] not in kept:
+                first_ops.append(DeleteOne({"_id": old["_id"]}))
+                stats["deleted"] += 1
+    if first_ops:
+        db.law_articles.bulk_write(first_ops, ordered=False)
+    if ops:
+        db.law_articles.bulk_write(ops, ordered=False)
+    return all_stats
+
+
+class ImportSummary:
+    """导入汇总：新增/更新/跳过的法规数与耗时"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.counts = {"new": 0, "updated": 0, "skipped": 0, "failed": 0}
+        self.articles = {"inserted": 0, "updated": 0, "unchanged": 0, "deleted": 0}
+
+    def add(self, status: str, article_stats: Optional[Dict[str, int]] = None):
+        self.counts[status] += 1
+        for k, v in (article_stats or {}).items():
+            self.articles[k] += v
+
+    def report(self) -> str:
+        elapsed = time.perf_counter() - self.started
+        c, a = self.counts, self.articles
+        text = f"法规 新增 {c['new']}，更新 {c['updated']}，跳过（未变化） {c['skipped']}，失败 {c['failed']}；"
+        if any(a.values()):
+            text += f"条文 新增 {a['inserted']}，更新 {a['updated']}，未变 {a['unchanged']}，删除 {a['deleted']}；"
+        return text + f"耗时 {elapsed:.1f}s"
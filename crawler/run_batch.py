@@ -24,20 +24,18 @@ async def run_crawling_batch():
         "中华人民共和国反恐怖主义法"
     ]
 
+    # 并发数与站点限速见 crawl_engine（CRAWL_CONCURRENCY 等环境变量），同一站点默认每秒 1 个请求
     spider = LawStarSpider()
     
-    print(f"🚀 开始批量抓取 {len(law_titles)} 部法规...")
+    print(f"🚀 开始批量抓取 {len(law_titles)} 部法规（并发 {spider.concurrency}）...")
     
-    for title in law_titles:
-        try:
-            print(f"--- 正在处理: {title} ---")
-            await spider.search_and_parse(title)
-            # 适当延时，模拟真人操作
-            await asyncio.sleep(3)
-        except Exception as e:
-            print(f"❌ 处理 {title} 失败: {str(e)}")
+    results = await spider.crawl_titles(law_titles)
+    for title, result in zip(law_titles, results):
+        if not result:
+            print(f"❌ 处理 {title} 失败")
 
-    print("\n✅ 抓取阶段完成！")
+    stats = spider.stats
+    print(f"\n✅ 抓取阶段完成！成功 {sum(1 for r in results if r)}/{len(law_titles)}，请求 {stats['requests']} 次（重试 {stats['retries']}）")
 
 def run_import():
     print("📥 开始导入数据到 MongoDB...")
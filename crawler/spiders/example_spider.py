@@ -22,16 +22,17 @@ class ChinaLawSpider(BaseLawSpider):
             name="china_law",
             base_url="https://flk.npc.gov.cn",  # 示例 URL（请替换为实际网站）
             output_dir="output",
-            delay=2.0,  # 请求延迟 2 秒
+            delay=2.0,  # 同一站点平均每 2 秒一个请求
+            concurrency=4,  # 同时在途的请求数
         )
 
-    def extract_law_links(self, list_page_url: str) -> List[str]:
+    async def extract_law_links(self, list_page_url: str) -> List[str]:
         """
         从列表页提取法规链接
 
         【TODO】请根据实际网站结构调整选择器
         """
-        html = self._fetch_page(list_page_url)
+        html = await self._fetch_page(list_page_url)
         soup = BeautifulSoup(html, "lxml")
 
         law_urls = []
@@ -1,18 +1,23 @@
-import httpx
 import asyncio
 from bs4 import BeautifulSoup
 import re
 from base_spider import BaseLawSpider
+from crawl_engine import CRAWL_CONCURRENCY
 import urllib.parse
 import logging
 
 class LawStarSpider(BaseLawSpider):
-    def __init__(self, db_client=None):
-        super().__init__(name="law_star", base_url="https://www.law-star.com")
-        self.headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-            "Referer": "https://www.law-star.com/"
-        }
+    def __init__(self, db_client=None, concurrency=CRAWL_CONCURRENCY, delay=1.0):
+        super().__init__(
+            name="law_star",
+            base_url="https://www.law-star.com",
+            delay=delay,  # 同一站点平均每 delay 秒一个请求
+            headers={
+                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+                "Referer": "https://www.law-star.com/"
+            },
+            concurrency=concurrency,
+        )
         self.logger = logging.getLogger("LawStarSpider")
         logging.basicConfig(level=logging.INFO)
 
@@ -24,8 +29,7 @@ class LawStarSpider(BaseLawSpider):
         
         search_url = f"{self.base_url}/search?keyword={urllib.parse.quote(search_keyword)}"
         try:
-          async with httpx.AsyncClient(headers=self.headers, timeout=20.0, follow_redirects=True) as client:
-            resp = await client.get(search_url)
+            resp = await self.engine.fetch(search_url)
             if resp.status_code != 200:
                 self.logger.error(f"搜索请求失败: {resp.status_code}")
                 return None
@@ -69,74 +73,84 @@ class LawStarSpider(BaseLawSpider):
         """解析详情页内容"""
         self.logger.info(f"正在抓取详情页: {url}")
         
-        async with httpx.AsyncClient(headers=self.headers, timeout=20.0, follow_redirects=True) as client:
-            resp = await client.get(url)
-            # 处理编码问题
-            if "charset=gb2312" in resp.text.lower() or "charset=gbk" in resp.text.lower():
-                resp.encoding = "gbk"
-            else:
-                resp.encoding = "utf-8"
-                
-            soup = BeautifulSoup(resp.text, 'lxml')
+        resp = await self.engine.fetch(url)
+        # 处理编码问题
+        if "charset=gb2312" in resp.text.lower() or "charset=gbk" in resp.text.lower():
+            resp.encoding = "gbk"
+        else:
+            resp.encoding = "utf-8"
             
-            # 1. 提取元数据
-            def get_meta_value(label):
-                # Law-star 详情页可能会在表格或 div 中显示元数据
-                el = soup.find(lambda t: t.name in ["span", "div", "li", "td"] and label in t.text)
-                if el:
-                    text = el.get_text().strip()
-                    if label in text:
-                        return text.split(label)[-1].strip()
-                return ""
+        soup = BeautifulSoup(resp.text, 'lxml')
+        
+        # 1. 提取元数据
+        def get_meta_value(label):
+            # Law-star 详情页可能会在表格或 div 中显示元数据
+            el = soup.find(lambda t: t.name in ["span", "div", "li", "td"] and label in t.text)
+            if el:
+                text = el.get_text().strip()
+                if label in text:
+                    return text.split(label)[-1].strip()
+            return ""
 
-            # 抓取页面上的真实标题
-            real_title = soup.select_one("h1, .head h1")
-            actual_title = real_title.get_text().strip() if real_title else law_title
+        # 抓取页面上的真实标题
+        real_title = soup.select_one("h1, .head h1")
+        actual_title = real_title.get_text().strip() if real_title else law_title
 
-            issue_date = get_meta_value("发布日期：") or get_meta_value("发布日期:")
-            metadata = {
-                "title": actual_title,
-                "issue_org": get_meta_value("发布部门：") or get_meta_value("发布部门:"),
-                "issue_date": issue_date,
-                "effect_date": get_meta_value("实施日期：") or get_meta_value("实施日期:"),
-                "status": get_meta_value("时效性：") or get_meta_value("时效性:") or "有效",
-                "level": get_meta_value("效力级别：") or get_meta_value("效力级别:") or "法律",
-                "category": get_meta_value("类别：") or get_meta_value("类别:") or "通用",
-                "source_url": url
-            }
-            
-            # 使用基类方法生成 ID
-            metadata["law_id"] = self._generate_law_id(actual_title, issue_date or "unknown")
+        issue_date = get_meta_value("发布日期：") or get_meta_value("发布日期:")
+        metadata = {
+            "title": actual_title,
+            "issue_org": get_meta_value("发布部门：") or get_meta_value("发布部门:"),
+            "issue_date": issue_date,
+            "effect_date": get_meta_value("实施日期：") or get_meta_value("实施日期:"),
+            "status": get_meta_value("时效性：") or get_meta_value("时效性:") or "有效",
+            "level": get_meta_value("效力级别：") or get_meta_value("效力级别:") or "法律",
+            "category": get_meta_value("类别：") or get_meta_value("类别:") or "通用",
+            "source_url": url
+        }
+        
+        # 使用基类方法生成 ID
+        metadata["law_id"] = self._generate_law_id(actual_title, issue_date or "unknown")
 
-            # 2. 提取全文内容
-            # Law-Star 正文通常在 id 为 content 的 div 或 .scroll 中
-            content_div = soup.select_one("#content, .scroll, .scrollable, .head + div")
-            if not content_div:
-                # 按照段落抓取
-                content_text = "\n".join([p.get_text() for p in soup.select(".row, p") if len(p.get_text()) > 5])
-            else:
-                content_text = content_div.get_text("\n")
+        # 2. 提取全文内容
+        # Law-Star 正文通常在 id 为 content 的 div 或 .scroll 中
+        content_div = soup.select_one("#content, .scroll, .scrollable, .head + div")
+        if not content_div:
+            # 按照段落抓取
+            content_text = "\n".join([p.get_text() for p in soup.select(".row, p") if len(p.get_text()) > 5])
+        else:
+            content_text = content_div.get_text("\n")
 
-            if not content_text or len(content_text) < 50:
-                self.logger.error("抓取到的正文内容过短")
-                return None
+        if not content_text or len(content_text) < 50:
+            self.logger.error("抓取到的正文内容过短")
+            return None
 
-            # 3. 拆分条文
-            articles = self._split_articles(content_text)
-            
-            if not articles:
-                self.logger.warning(f"未能拆分出条目，整篇存入第一条")
-                articles = [{
-                    "article_num": 1,
-                    "article_display": "全文",
-                    "content": content_text,
-                    "keywords": self._extract_keywords(content_text)
-                }]
-            
-            # 4. 保存为标准格式
-            law_data = metadata.copy()
-            law_data["articles"] = articles
-            self._save_to_jsonl(law_data)
-            
-            self.logger.info(f"法规 {actual_title} 处理完成，共 {len(articles)} 条")
-            return law_data
+        # 3. 拆分条文
+        articles = self._split_articles(content_text)
+        
+        if not articles:
+            self.logger.warning(f"未能拆分出条目，整篇存入第一条")
+            articles = [{
+                "article_num": 1,
+                "article_display": "全文",
+                "content": content_text,
+                "keywords": self._extract_keywords(content_text)
+            }]
+        
+        # 4. 保存为标准格式
+        law_data = metadata.copy()
+        law_data["articles"] = articles
+        self._save_to_jsonl(law_data)
+        
+        self.logger.info(f"法规 {actual_title} 处理完成，共 {len(articles)} 条")
+        return law_data
+
+    async def crawl_titles(self, law_titles):
+        """
+        按标题批量抓取：各标题并发检索、解析（请求并发与站点限速由抓取引擎控制），
+        返回与 law_titles 顺序一致的结果列表，失败的标题为 None
+        """
+        try:
+            results = await self.engine.map(self.search_and_parse, law_titles)
+        finally:
+            await self.aclose()
+        return [None if isinstance(r, Exception) else r for r in results]
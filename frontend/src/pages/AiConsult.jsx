@@ -2,11 +2,12 @@ import { useState, useRef, useEffect } from 'react';
 import { message } from 'antd';
 import { Link } from 'react-router-dom';
 import { Send, MessageCircle, Bot, User, Sparkles, Trash2, Copy, Check, ThumbsUp, ThumbsDown } from 'lucide-react';
-import { sendAiMessage, submitAiFeedback } from '../services/api';
+import { sendAiMessage, submitAiFeedback, deleteAiSession } from '../services/api';
 import './AiConsult.css';
 
 // sessionStorage key
 const STORAGE_KEY = 'ai_chat_messages';
+const SESSION_KEY = 'ai_chat_session_id';
 
 // 默认欢迎消息
 const DEFAULT_MESSAGES = [
@@ -165,13 +166,11 @@ export default function AiConsult() {
         setLoading(true);
 
         try {
-            // 准备历史消息（排除系统消息，只保留最近10轮对话）
-            const history = newMessages.slice(-20).map(msg => ({
-                role: msg.role,
-                content: msg.content
-            }));
-
-            const response = await sendAiMessage(trimmedValue, history.slice(0, -1));
+            // 对话历史由服务端会话维护，只需发送新消息
+            const response = await sendAiMessage(trimmedValue, sessionStorage.getItem(SESSION_KEY));
+            if (response.session_id) {
+                sessionStorage.setItem(SESSION_KEY, response.session_id);
+            }
 
             // 添加 AI 回复
             setMessages(prev => [...prev, {
@@ -192,6 +191,11 @@ export default function AiConsult() {
 
     // 清空对话
     const handleClear = () => {
+        const sessionId = sessionStorage.getItem(SESSION_KEY);
+        if (sessionId) {
+            sessionStorage.removeItem(SESSION_KEY);
+            deleteAiSession(sessionId).catch(() => {});
+        }
         const clearedMessages = [
             {
                 role: 'assistant',
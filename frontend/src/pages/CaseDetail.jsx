@@ -89,9 +89,11 @@ export default function CaseDetail() {
     }, [crossAnalysis, caseId]);
 
     const handleCrossAnalyze = async () => {
+        // 已有结果时"重新分析"为全量重算（增量模式在笔录未变化时直接返回上次结果）
+        const full = crossAnalysis?.analysis_status === 'analyzed';
         setCrossLoading(true);
         try {
-            const res = await triggerCrossAnalysis(caseId);
+            const res = await triggerCrossAnalysis(caseId, full);
             if (res.success) {
                 message.success('交叉分析任务已提交');
                 setCrossAnalysis({ analysis_status: 'analyzing' });
@@ -119,8 +121,8 @@ export default function CaseDetail() {
     const handleReanalyze = async (e, transcriptId) => {
         e.stopPropagation();
         try {
-            await triggerAnalysis(caseId, transcriptId);
-            message.success('分析任务已提交');
+            const res = await triggerAnalysis(caseId, transcriptId);
+            message.success(res.data?.message || '分析任务已提交');
             fetchDetail();
         } catch {
             message.error('触发分析失败');
@@ -479,8 +481,8 @@ function UploadFileModal({ caseId, onClose, onSuccess }) {
                 message.error('仅支持 .doc、.docx 和 .txt 文件');
                 return;
             }
-            if (f.size > 10 * 1024 * 1024) {
-                message.error('文件大小不能超过 10MB');
+            if (f.size > 30 * 1024 * 1024) {
+                message.error('文件大小不能超过 30MB');
                 return;
             }
             setFile(f);
@@ -539,7 +541,7 @@ function UploadFileModal({ caseId, onClose, onSuccess }) {
                     >
                         <Upload size={32} />
                         <p>点击或拖拽文件到此处上传</p>
-                        <p>支持 .doc / .docx / .txt，最大 10MB</p>
+                        <p>支持 .doc / .docx / .txt，最大 30MB</p>
                         <input ref={fileInputRef} type="file" accept=".doc,.docx,.txt" hidden
                             onChange={e => e.target.files[0] && handleFile(e.target.files[0])} />
                     </div>
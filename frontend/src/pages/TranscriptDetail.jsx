@@ -37,9 +37,13 @@ export default function TranscriptDetail() {
 
     const handleReanalyze = async () => {
         try {
-            await triggerAnalysis(caseId, transcriptId);
-            message.success('分析任务已提交');
-            setData(prev => prev ? { ...prev, analysis_status: 'analyzing' } : prev);
+            const res = await triggerAnalysis(caseId, transcriptId);
+            message.success(res.data?.message || '分析任务已提交');
+            if (res.data?.cached) {
+                fetchData();
+            } else {
+                setData(prev => prev ? { ...prev, analysis_status: 'analyzing' } : prev);
+            }
         } catch {
             message.error('触发分析失败');
         }
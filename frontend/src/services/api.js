@@ -110,6 +110,14 @@ export const getTotalViews = () => {
     return apiClient.get('/laws/stats/total-views');
 };
 
+/**
+ * 获取浏览量最高的法规
+ * @param {number} limit - 返回数量
+ */
+export const getMostViewedLaws = (limit = 10) => {
+    return apiClient.get('/laws/stats/most-viewed', { params: { limit } });
+};
+
 /**
  * 更新法规信息（管理功能）
  */
@@ -223,10 +231,18 @@ export const adminLogin = (password) => {
 /**
  * 发送消息给 AI 法律助手
  * @param {string} message - 用户消息
- * @param {Array} history - 对话历史（可选）
+ * @param {string} sessionId - 会话 ID（可选，首次对话不传，由服务端创建并返回）
+ */
+export const sendAiMessage = (message, sessionId = null) => {
+    return apiClient.post('/ai/chat', { message, session_id: sessionId });
+};
+
+/**
+ * 删除 AI 对话会话（清空对话时调用）
+ * @param {string} sessionId - 会话 ID
  */
-export const sendAiMessage = (message, history = null) => {
-    return apiClient.post('/ai/chat', { message, history });
+export const deleteAiSession = (sessionId) => {
+    return apiClient.delete(`/ai/sessions/${sessionId}`);
 };
 
 /**
@@ -375,6 +391,22 @@ export const uploadTranscript = (caseId, file, meta) => {
     });
 };
 
+/**
+ * 批量导入笔录（多个文件或 zip 压缩包）
+ * manifest: [{ file_name, title, type, subject_name, subject_role }]，按文件名匹配
+ */
+export const bulkUploadTranscripts = (caseId, files, manifest = [], defaults = {}) => {
+    const formData = new FormData();
+    files.forEach((file) => formData.append('files', file));
+    formData.append('manifest', JSON.stringify(manifest));
+    if (defaults.type) formData.append('type', defaults.type);
+    if (defaults.subject_role) formData.append('subject_role', defaults.subject_role);
+    formData.append('auto_analyze', String(defaults.auto_analyze ?? true));
+    return apiClient.postForm(`/cases/${caseId}/transcripts/bulk-upload`, formData, {
+        timeout: 300000,
+    });
+};
+
 /**
  * 获取案件下笔录列表
  */
@@ -397,10 +429,10 @@ export const deleteTranscript = (caseId, transcriptId) => {
 };
 
 /**
- * 触发 AI 分析
+ * 触发 AI 分析（相同内容已有分析结果时直接复用，force 为 true 时强制重新分析）
  */
-export const triggerAnalysis = (caseId, transcriptId) => {
-    return apiClient.post(`/cases/${caseId}/transcripts/${transcriptId}/analyze`);
+export const triggerAnalysis = (caseId, transcriptId, force = false) => {
+    return apiClient.post(`/cases/${caseId}/transcripts/${transcriptId}/analyze`, null, { params: { force } });
 };
 
 /**
@@ -422,8 +454,8 @@ export const searchTranscripts = (params) => {
 /**
  * 触发交叉分析
  */
-export const triggerCrossAnalysis = (caseId) => {
-    return apiClient.post(`/cases/${caseId}/cross-analyze`);
+export const triggerCrossAnalysis = (caseId, full = false) => {
+    return apiClient.post(`/cases/${caseId}/cross-analyze`, null, { params: { full } });
 };
 
 /**